@@ -0,0 +1,79 @@
+"""
+Handshakes per second with every host key type lobbyboy serves.
+
+lobbyboy serves all host keys of a ``HandshakeContext``, the client (paramiko with default settings otherwise)
+is limited to one host key type, like an ssh client that has saved that key in ``known_hosts``.
+Every handshake is a key exchange over loopback, signed by the host key, no auth.
+The cost of signing alone is shown as well, that is the part of a handshake the host key type decides.
+
+Usage: python benchmarks/handshake_host_keys.py [handshakes]
+"""
+
+import logging
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import paramiko
+
+from lobbyboy.handshake import HandshakeContext
+
+KEY_TYPES = {
+    "ed25519": "ssh-ed25519",
+    "ecdsa": "ecdsa-sha2-nistp256",
+    "rsa-3072": "rsa-sha2-512",
+}
+
+
+def handshake(context: HandshakeContext, listener: socket.socket, key_type: str):
+    client_sock = socket.create_connection(listener.getsockname())
+    server_sock, _ = listener.accept()
+    server_t = paramiko.Transport(server_sock)
+    context.prepare(server_t)
+    server_t.start_server(event=threading.Event(), server=paramiko.ServerInterface())
+
+    client_t = paramiko.Transport(client_sock)
+    client_t.get_security_options().key_types = [key_type]
+    client_t.start_client()
+    assert client_t.host_key_type == key_type
+    client_t.close()
+    server_t.close()
+
+
+def sign_cost(key: paramiko.PKey, key_type: str, rounds: int = 200) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        key.sign_ssh_data(b"x" * 32, key_type)
+    return (time.perf_counter() - start) / rounds
+
+
+def main(handshakes: int = 50):
+    # connections closed right after handshake are logged as errors by paramiko.
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(8)
+    with tempfile.TemporaryDirectory() as data_dir, mock.patch("socket.getfqdn", return_value="lobbyboy.test"):
+        context = HandshakeContext(Path(data_dir))
+        print(f"{handshakes} handshakes per host key type")
+        host_keys = {key.get_name(): key for key in context.host_keys()}
+        for name, key_type in KEY_TYPES.items():
+            host_key = host_keys["ssh-rsa" if name.startswith("rsa") else key_type]
+            sign = sign_cost(host_key, key_type)
+            start = time.perf_counter()
+            for _ in range(handshakes):
+                handshake(context, listener, key_type)
+            cost = time.perf_counter() - start
+            print(
+                f"{name:>10}: {handshakes / cost:7.1f} handshakes/s, {cost / handshakes * 1000:6.2f}ms per handshake, "
+                f"{sign * 1000:6.3f}ms to sign"
+            )
+    listener.close()
+
+
+if __name__ == "__main__":
+    main(*[int(i) for i in sys.argv[1:]])
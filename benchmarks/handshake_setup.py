@@ -0,0 +1,57 @@
+"""
+Per-connection setup cost before the ssh handshake starts.
+
+before: what every connection did itself, load moduli, read the key files, parse the host key, lookup fqdn.
+after: what every connection does with a process-wide ``HandshakeContext``.
+
+Usage: python benchmarks/handshake_setup.py [rounds]
+"""
+
+import socket
+import sys
+import tempfile
+import time
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+import paramiko
+from paramiko.transport import Transport
+
+from lobbyboy.handshake import HandshakeContext
+from lobbyboy.utils import KeyTypeSupport, confirm_ssh_key_pair
+
+
+def before(data_dir: Path):
+    Transport.load_server_moduli()
+    pri, _ = confirm_ssh_key_pair(key_type=KeyTypeSupport.RSA, save_path=data_dir, key_name="ssh_host_rsa_key")
+    host_key = paramiko.RSAKey.from_private_key(StringIO(pri))
+    return socket.getfqdn(), [host_key]
+
+
+def after(context: HandshakeContext):
+    return context.gss_host, context.host_keys()
+
+
+def timeit(func, rounds: int, *args) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(*args)
+    return (time.perf_counter() - start) / rounds
+
+
+def main(rounds: int = 200):
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(tmp)
+        context = HandshakeContext(data_dir)
+        print(f"rounds: {rounds}")
+        for name, func, args in (("before", before, (data_dir,)), ("after", after, (context,))):
+            cost = timeit(func, rounds, *args)
+            print(f"{name:>6}: {cost * 1e6:10.1f} us/connection")
+        with mock.patch("socket.getfqdn", return_value="localhost"):
+            cost = timeit(before, rounds, data_dir)
+            print(f"before (without DNS lookup): {cost * 1e6:10.1f} us/connection")
+
+
+if __name__ == "__main__":
+    main(*[int(i) for i in sys.argv[1:]])
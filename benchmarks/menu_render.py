@@ -0,0 +1,99 @@
+"""
+Packets and bytes on the wire for rendering a menu to the user.
+
+The menu is what providers show in ``_manually_create_new_node``: a banner, one line per image, and a prompt,
+written line by line with ``send_to_channel``. It is rendered over a real ssh session on a socket pair.
+
+before: every ``send_to_channel`` goes to the channel, so every line is an encrypted packet.
+after: the lines go to a ``BufferedChannel``, which is flushed before waiting for user input.
+
+Usage: python benchmarks/menu_render.py [options]
+"""
+
+import socket
+import sys
+import threading
+
+import paramiko
+
+from lobbyboy.channel_writer import BufferedChannel
+from lobbyboy.utils import send_to_channel
+
+PROMPT = b"Please choose linode image: "
+
+
+class CountingSocket(socket.socket):
+    sends = 0
+    sent_bytes = 0
+
+    def send(self, data, *args):
+        sent = super().send(data, *args)
+        self.sends += 1
+        self.sent_bytes += sent
+        return sent
+
+    def reset(self):
+        self.sends = self.sent_bytes = 0
+
+
+class NoAuthServer(paramiko.ServerInterface):
+    def get_allowed_auths(self, username):
+        return "none"
+
+    def check_auth_none(self, username):
+        return paramiko.common.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.common.OPEN_SUCCEEDED
+
+
+def render_menu(channel, options: int):
+    send_to_channel(channel, "Welcome to LobbyBoy!")
+    send_to_channel(channel, "Available images:")
+    for idx in range(options):
+        send_to_channel(channel, f"{idx:>3} - linode/some-distribution-{idx}")
+    send_to_channel(channel, PROMPT, suffix=b"")
+    # lobbyboy waits for user input here.
+    if isinstance(channel, BufferedChannel):
+        channel.flush()
+
+
+def measure(options: int, buffered: bool):
+    server_side, client_side = socket.socketpair()
+    server_sock = CountingSocket(fileno=server_side.detach())
+    server_t = paramiko.Transport(server_sock)
+    server_t.add_server_key(paramiko.RSAKey.generate(2048))
+    server_t.start_server(event=threading.Event(), server=NoAuthServer())
+    client_t = paramiko.Transport(client_side)
+    client_t.start_client()
+    client_t.auth_none("Gustave")
+    client_channel = client_t.open_session()
+    channel = server_t.accept(5)
+
+    received = bytearray()
+
+    def read():
+        while not received.endswith(PROMPT):
+            received.extend(client_channel.recv(65536))
+
+    reader = threading.Thread(target=read)
+    server_sock.reset()
+    reader.start()
+    render_menu(BufferedChannel(channel) if buffered else channel, options)
+    reader.join(10)
+    assert received.endswith(PROMPT)
+    result = server_sock.sends, server_sock.sent_bytes, len(received)
+    client_t.close()
+    server_t.close()
+    return result
+
+
+def main(options: int = 300):
+    print(f"menu with {options} options")
+    for name, buffered in (("before", False), ("after", True)):
+        packets, wire_bytes, payload = measure(options, buffered)
+        print(f"{name:>6}: {packets:5} packets, {wire_bytes:7} bytes on wire for {payload} bytes of menu")
+
+
+if __name__ == "__main__":
+    main(*[int(i) for i in sys.argv[1:]])
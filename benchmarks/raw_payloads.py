@@ -0,0 +1,86 @@
+"""
+What the raw payloads of many servers cost, on disk and when all of them are destroyed.
+
+``server.json`` is how payloads were kept before ``lobbyboy.payloads``: one file in every server's workspace,
+read and parsed by ``destroy_server`` to get the server's id. ``payload store`` keeps all payloads in one
+compressed file, and the id in ``provider_data`` of the server. A payload is about the size of a droplet
+of digitalocean.
+
+Usage: python benchmarks/raw_payloads.py [servers]
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from lobbyboy.config import LBServerMeta
+from lobbyboy.contrib.provider.footloose import FootlooseConfig, FootlooseProvider
+
+
+def payload(i: int) -> dict:
+    return {
+        "id": 280000000 + i,
+        "name": f"2021-12-05-{i}",
+        "memory": 1024,
+        "vcpus": 1,
+        "disk": 25,
+        "status": "active",
+        "region": {"name": "Singapore 1", "slug": "sgp1", "features": ["backups", "ipv6", "metadata"] * 4},
+        "image": {"id": 93524084, "name": "21.04 x64", "distribution": "Ubuntu", "regions": ["sgp1", "nyc1"] * 8},
+        "size": {"slug": "s-1vcpu-1gb", "price_monthly": 5.0, "regions": ["ams3", "blr1", "fra1", "sgp1"] * 5},
+        "networks": {"v4": [{"ip_address": f"10.0.{i // 256 % 256}.{i % 256}", "type": "public"}] * 2, "v6": []},
+        "kernel": None,
+        "tags": [],
+        "volume_ids": [],
+        "features": ["ipv6", "private_networking"],
+        "backup_ids": [],
+        "snapshot_ids": [],
+        "created_at": "2021-12-05T14:05:00Z",
+    }
+
+
+def usage(root: Path):
+    files = [p for p in root.rglob("*") if p.is_file()]
+    return len(files), sum(p.stat().st_size for p in files)
+
+
+def main(servers: int = 5000):
+    for name in ("server.json", "payload store"):
+        root = Path(tempfile.mkdtemp())
+        provider = FootlooseProvider(name="digitalocean", config=FootlooseConfig(), workspace=root)
+        metas = []
+        for i in range(servers):
+            workspace = root.joinpath(str(i))
+            workspace.mkdir()
+            if name == "server.json":
+                provider.save_raw_server(payload(i), workspace)
+                metas.append(LBServerMeta(provider_name="digitalocean", workspace=workspace, server_name=str(i)))
+            else:
+                provider_data = provider.save_payload(str(i), payload(i), id=payload(i)["id"])
+                metas.append(
+                    LBServerMeta(
+                        provider_name="digitalocean",
+                        workspace=workspace,
+                        server_name=str(i),
+                        provider_data=provider_data,
+                    )
+                )
+        files, size = usage(root)
+
+        start = time.perf_counter()
+        ids = [provider.provider_field(meta, "id") for meta in metas]
+        destroy = (time.perf_counter() - start) / servers * 1000
+        assert ids == [payload(i)["id"] for i in range(servers)]
+        start = time.perf_counter()
+        for meta in metas[:: max(servers // 100, 1)]:
+            provider.load_payload(meta)
+        load = (time.perf_counter() - start) / len(metas[:: max(servers // 100, 1)]) * 1000
+        print(
+            f"{name:>13}: {files} files, {size // 1024}KB, id for destroy {destroy:.4f}ms, "
+            f"whole payload {load:.3f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(i) for i in sys.argv[1:]])
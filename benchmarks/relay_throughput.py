@@ -0,0 +1,143 @@
+"""
+Throughput of the relay engine, and the buffers it allocates and copies, for one bulk session.
+
+- pty -> user: the proxy process prints a lot (``cat`` a huge log), read from the PTY, written to the user's channel.
+- server -> user: a spliced session, read from the server's channel, written to the user's channel.
+
+Channels are socket pairs here, so the cost of the engine itself is measured, without ssh crypto.
+Allocations are the buffers returned by reads (``bytes``), and the copies into the pending buffer of a session.
+
+Usage: python benchmarks/relay_throughput.py [megabytes]
+"""
+
+import os
+import pty
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from lobbyboy.relay import ChannelEndpoint, PtyEndpoint, RelayEngine, RelaySession
+
+CHUNK = b"x" * 64 * 1024
+
+
+class SocketChannel:
+    """paramiko channel look-alike backed by a socket."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def recv(self, size):
+        try:
+            return self.sock.recv(size)
+        except BlockingIOError:
+            raise socket.timeout()
+
+    def send(self, data):
+        try:
+            return self.sock.send(data)
+        except BlockingIOError:
+            raise socket.timeout()
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+
+class CountingBuffer(bytearray):
+    copies = 0
+
+    def extend(self, data):
+        CountingBuffer.copies += 1
+        super().extend(data)
+
+
+class Counting:
+    """count reads of an endpoint, and how many of them returned a new buffer."""
+
+    reads = allocations = 0
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        for name in ("read", "read_into"):
+            if hasattr(endpoint, name):
+                setattr(self, name, self._counted(getattr(endpoint, name)))
+
+    def __getattr__(self, name):
+        return getattr(self.endpoint, name)
+
+    @staticmethod
+    def _counted(read):
+        def counted(*args):
+            data = read(*args)
+            if data:
+                Counting.reads += 1
+                # a view of a new buffer, not of the one the engine read into.
+                Counting.allocations += isinstance(data, bytes) or isinstance(getattr(data, "obj", None), bytes)
+            return data
+
+        return counted
+
+
+def pty_upstream():
+    master_fd, slave_fd = pty.openpty()
+    # raw, like a terminal running a full-screen program, no newline translation.
+    subprocess.run(["stty", "raw", "-echo"], stdin=slave_fd)
+    process = subprocess.Popen(["sleep", "3600"], start_new_session=True)
+    return PtyEndpoint(master_fd, process), lambda data: os.write(slave_fd, data)
+
+
+def socket_upstream():
+    server_side, upstream_side = socket.socketpair()
+
+    def write(data):
+        server_side.sendall(data)
+        return len(data)
+
+    return ChannelEndpoint(SocketChannel(upstream_side)), write
+
+
+def measure(engine: RelayEngine, create_upstream, total: int):
+    upstream, write = create_upstream()
+    user_side, lobbyboy_side = socket.socketpair()
+    downstream = ChannelEndpoint(SocketChannel(lobbyboy_side))
+    session = RelaySession(downstream=downstream, upstream=Counting(upstream))
+    session.pending = {endpoint: CountingBuffer() for endpoint in session.pending}
+    Counting.reads = Counting.allocations = CountingBuffer.copies = 0
+
+    def produce():
+        sent = 0
+        while sent < total:
+            sent += write(CHUNK)
+
+    start = time.perf_counter()
+    engine.attach(session)
+    threading.Thread(target=produce, daemon=True).start()
+    received = 0
+    while received < total:
+        received += len(user_side.recv(1024 * 1024))
+    cost = time.perf_counter() - start
+    engine.close(session)
+    megabytes = total / 1024 / 1024
+    return megabytes / cost, Counting.reads / megabytes, (Counting.allocations + CountingBuffer.copies) / megabytes
+
+
+def main(megabytes: int = 256):
+    engine = RelayEngine()
+    engine.start()
+    print(f"relay {megabytes}MB")
+    for name, create_upstream in (("pty -> user", pty_upstream), ("server -> user", socket_upstream)):
+        speed, reads, allocations = measure(engine, create_upstream, megabytes * 1024 * 1024)
+        print(f"{name:>15}: {speed:8.1f} MB/s, {reads:7.1f} reads/MB, {allocations:7.1f} allocations/MB")
+
+
+if __name__ == "__main__":
+    main(*[int(i) for i in sys.argv[1:]])
@@ -0,0 +1,71 @@
+"""
+What a lookup or a change of the servers registry costs, with many servers in it.
+
+Every operation is what lobbyboy does with the registry: ``get`` when a user enters a server by name, ``add``
+when a server is created, ``remove`` when the killer destroys one, and ``killer round`` is the query of a
+killer round, servers of one provider old enough to be destroyed (a 10th of all servers here).
+
+Usage: python benchmarks/server_registry.py [servers] [rounds]
+"""
+
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from lobbyboy.config import LBServerMeta, update_local_servers
+from lobbyboy.registry import (
+    JournalServerRegistry,
+    JsonServerRegistry,
+    SQLiteServerRegistry,
+)
+
+
+def meta(i: int) -> LBServerMeta:
+    return LBServerMeta(
+        provider_name=f"provider-{i % 10}",
+        workspace=Path(f"/var/lib/lobbyboy/provider-{i % 10}/server-{i}"),
+        server_name=f"server-{i}",
+        server_host=f"10.0.{i // 256 % 256}.{i % 256}",
+        created_timestamp=1_600_000_000 + i,
+    )
+
+
+def cost(func, rounds: int) -> float:
+    start = time.perf_counter()
+    for i in range(rounds):
+        func(i)
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main(servers: int = 5000, rounds: int = 50):
+    logging.disable(logging.CRITICAL)
+    data_dir = Path(tempfile.mkdtemp())
+    json_path = data_dir / "available_servers_db.json"
+    update_local_servers(json_path, new=[meta(i) for i in range(servers)])
+
+    start = time.perf_counter()
+    sqlite = SQLiteServerRegistry(data_dir / "available_servers_db.sqlite3", json_path)
+    print(f"{servers} servers, sqlite registry migrated from json in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    start = time.perf_counter()
+    journal = JournalServerRegistry(json_path)
+    print(f"{servers} servers, journal registry loaded in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    for name, registry in (("json", JsonServerRegistry(json_path)), ("sqlite", sqlite), ("journal", journal)):
+        print(f"{name:>7}:")
+        results = {
+            "get": cost(lambda i: registry.get(f"server-{i * 97 % servers}"), rounds),
+            "add": cost(lambda i: registry.add(meta(servers + i)), rounds),
+            "remove": cost(lambda i: registry.remove(meta(servers + i)), rounds),
+            "killer round": cost(
+                lambda i: registry.servers(provider_name="provider-3", created_until=1_600_000_000 + servers), rounds
+            ),
+        }
+        for operation, ms in results.items():
+            print(f"  {operation:>12}: {ms:8.3f}ms")
+
+
+if __name__ == "__main__":
+    main(*[int(i) for i in sys.argv[1:]])
@@ -0,0 +1,110 @@
+"""
+What idle sessions cost: threads, fds and memory per session, see ``lobbyboy.footprint``.
+
+Every session is what lobbyboy keeps for a user sitting idle in a spliced session: the ``Transport`` (and its
+thread) of the user's connection, the ``Server``, and a relay session between the user's channel and a socket
+standing for the shell channel on the server. Users are paramiko clients in a child process.
+
+Usage: python benchmarks/session_footprint.py [sessions] [thread stack size, bytes, 0 for the system default]
+"""
+
+import gc
+import logging
+import multiprocessing
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import paramiko
+
+from lobbyboy import footprint
+from lobbyboy.channel_writer import BufferedChannel
+from lobbyboy.handshake import HandshakeContext
+from lobbyboy.relay import ChannelEndpoint, RelayEngine, RelaySession
+from lobbyboy.server import Server
+from lobbyboy.utils import KeyTypeSupport
+
+
+class SocketChannel:
+    """paramiko channel look-alike backed by a socket, the server's side of the session."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def recv(self, size):
+        try:
+            return self.sock.recv(size)
+        except BlockingIOError:
+            raise socket.timeout()
+
+
+def users(address, sessions: int, ready: multiprocessing.Event, done: multiprocessing.Event):
+    transports = []
+    for _ in range(sessions):
+        t = paramiko.Transport(socket.create_connection(address))
+        t.start_client()
+        t.auth_password("Gustave", "Fiennes")
+        channel = t.open_session()
+        channel.get_pty()
+        channel.invoke_shell()
+        transports.append((t, channel))
+    ready.set()
+    done.wait()
+
+
+def main(sessions: int = 200, stack_size: int = 0):
+    logging.disable(logging.WARNING)
+    if stack_size:
+        threading.stack_size(stack_size)
+    context = HandshakeContext(Path(tempfile.mkdtemp()), [KeyTypeSupport.ED25519])
+    config_watcher = mock.MagicMock()
+    config_watcher.config.user = {"Gustave": mock.MagicMock(password="Fiennes")}
+
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(128)
+    relay = RelayEngine()
+    relay.start()
+    gc.collect()
+    baseline = footprint.take(0)
+
+    ctx = multiprocessing.get_context("fork")
+    ready, done = ctx.Event(), ctx.Event()
+    client = ctx.Process(target=users, args=(listener.getsockname(), sessions, ready, done), daemon=True)
+    client.start()
+    upstreams = []
+    for _ in range(sessions):
+        sock, _ = listener.accept()
+        t = paramiko.Transport(sock)
+        context.prepare(t)
+        server = Server(config_watcher)
+        t.start_server(server=server)
+        channel = BufferedChannel(t.accept(10))
+        server.wait_for("shell", 10)
+        server_side, upstream_side = socket.socketpair()
+        upstreams.append(server_side)
+        relay.attach(RelaySession(ChannelEndpoint(channel.channel), ChannelEndpoint(SocketChannel(upstream_side))))
+    ready.wait()
+    time.sleep(1)
+    gc.collect()
+    # the users' side is a child process of this one, not part of what lobbyboy costs.
+    with mock.patch("lobbyboy.footprint._descendants", return_value=[]):
+        now = footprint.take(len(relay.sessions))
+    print(f"thread stack size: {stack_size or 'system default'}")
+    print(footprint.report(baseline, now))
+    done.set()
+
+
+if __name__ == "__main__":
+    main(*[int(i) for i in sys.argv[1:]])
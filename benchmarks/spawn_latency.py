@@ -0,0 +1,74 @@
+"""
+Latency of spawning proxy processes under concurrent logins, from a big lobbyboy process with many threads.
+
+before: every handler thread forks lobbyboy itself, ``Popen(shell=True, preexec_fn=os.setsid)``.
+after: handler threads ask the spawn helper (``lobbyboy.spawner``) started at boot.
+
+The process is made big with ``megabytes`` of Python objects, like a lobbyboy serving many sessions,
+the spawned command is ``exit 0`` on a new PTY, latency is the time until the pid is known.
+
+Usage: python benchmarks/spawn_latency.py [logins] [concurrency] [megabytes]
+"""
+
+import os
+import pty
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import Popen
+
+from lobbyboy.spawner import Spawner
+
+COMMAND = "exit 0"
+
+
+def spawn_by_fork(slave_fd: int):
+    return Popen(COMMAND, shell=True, preexec_fn=os.setsid, stdin=slave_fd, stdout=slave_fd, stderr=slave_fd)
+
+
+def login(spawn) -> float:
+    master_fd, slave_fd = pty.openpty()
+    start = time.perf_counter()
+    process = spawn(slave_fd)
+    cost = time.perf_counter() - start
+    os.close(slave_fd)
+    process.wait(10)
+    os.close(master_fd)
+    return cost
+
+
+def measure(spawn, logins: int, concurrency: int):
+    with ThreadPoolExecutor(concurrency) as executor:
+        start = time.perf_counter()
+        costs = sorted(executor.map(lambda _: login(spawn), range(logins)))
+        total = time.perf_counter() - start
+    return costs, total
+
+
+def main(logins: int = 400, concurrency: int = 32, megabytes: int = 512):
+    spawner = Spawner()
+    spawner.start()
+    # sessions, buffers, caches... of a busy lobbyboy.
+    ballast = [bytearray(1024 * 1024) for _ in range(megabytes)]  # noqa: F841
+    ballast_objects = [{"idx": i} for i in range(megabytes * 2000)]  # noqa: F841
+    # relay, handler and timer threads.
+    stop = threading.Event()
+    for _ in range(64):
+        threading.Thread(target=stop.wait, daemon=True).start()
+
+    threads = threading.active_count()
+    print(f"{logins} logins, {concurrency} at the same time, {megabytes}MB process with {threads} threads")
+    for name, spawn in (("before", spawn_by_fork), ("after", lambda fd: spawner.spawn(COMMAND, fd))):
+        costs, total = measure(spawn, logins, concurrency)
+        p99 = costs[int(len(costs) * 0.99) - 1]
+        print(
+            f"{name:>6}: p50 {statistics.median(costs) * 1000:7.2f}ms, p99 {p99 * 1000:7.2f}ms, "
+            f"max {costs[-1] * 1000:7.2f}ms, {logins / total:7.1f} spawns/s"
+        )
+    stop.set()
+
+
+if __name__ == "__main__":
+    main(*[int(i) for i in sys.argv[1:]])
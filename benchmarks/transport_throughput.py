@@ -0,0 +1,97 @@
+"""
+Throughput of a channel between a user and lobbyboy over loopback, with different transport profiles.
+
+The user (a paramiko client with default settings) uploads data to lobbyboy, whose ``Transport`` is created by
+``create_transport`` with the profile, like pasting into a session or copying a file through it.
+
+Usage: python benchmarks/transport_throughput.py [megabytes]
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+
+import paramiko
+
+from lobbyboy.config import LBConfigTransport
+from lobbyboy.transport_profile import create_transport
+
+PROFILES = {
+    "default": LBConfigTransport(),
+    "big window": LBConfigTransport(window_size=16 * 1024 * 1024, max_packet_size=256 * 1024),
+    "aes128-ctr + etm": LBConfigTransport(ciphers=["aes128-ctr"], macs=["hmac-sha2-256-etm@openssh.com"]),
+    "big window + aes128-ctr + etm": LBConfigTransport(
+        window_size=16 * 1024 * 1024,
+        max_packet_size=256 * 1024,
+        ciphers=["aes128-ctr"],
+        macs=["hmac-sha2-256-etm@openssh.com"],
+    ),
+    "compression": LBConfigTransport(compression=True),
+}
+
+
+class NoAuthServer(paramiko.ServerInterface):
+    def get_allowed_auths(self, username):
+        return "none"
+
+    def check_auth_none(self, username):
+        return paramiko.common.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.common.OPEN_SUCCEEDED
+
+
+def measure(profile: LBConfigTransport, payload: bytes, total: int) -> float:
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    client_sock = socket.create_connection(listener.getsockname())
+    server_sock, _ = listener.accept()
+    listener.close()
+
+    server_t = create_transport(server_sock, profile, gss_kex=False)
+    server_t.add_server_key(paramiko.RSAKey.generate(2048))
+    server_t.start_server(event=threading.Event(), server=NoAuthServer())
+    client_t = paramiko.Transport(client_sock)
+    client_t.use_compression(profile.compression)
+    client_t.start_client()
+    client_t.auth_none("Gustave")
+    client_channel = client_t.open_session()
+    channel = server_t.accept(5)
+
+    def upload():
+        sent = 0
+        while sent < total:
+            client_channel.sendall(payload)
+            sent += len(payload)
+
+    start = time.perf_counter()
+    uploader = threading.Thread(target=upload)
+    uploader.start()
+    received = 0
+    while received < total:
+        received += len(channel.recv(1024 * 1024))
+    cost = time.perf_counter() - start
+    uploader.join()
+    client_t.close()
+    server_t.close()
+    return total / cost / 1024 / 1024
+
+
+def main(megabytes: int = 64):
+    total = megabytes * 1024 * 1024
+    # random bytes, and terminal-like output which compresses well.
+    payloads = {
+        "random": os.urandom(64 * 1024),
+        "text": b"".join(b"%06d drwxr-xr-x 2 root root 4096 Oct 16 20:50 lobbyboy\r\n" % i for i in range(1100)),
+    }
+    print(f"upload {megabytes}MB over loopback")
+    for name, profile in PROFILES.items():
+        for payload_name, payload in payloads.items():
+            print(f"{name:>30} {payload_name:>6}: {measure(profile, payload, total):8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main(*[int(i) for i in sys.argv[1:]])
@@ -0,0 +1,54 @@
+"""
+What it costs to pick a name for a new server, when a provider has many workspaces already.
+
+``flat`` is how names were picked before ``lobbyboy.workspace``: every candidate is tried by ``exists()`` in one
+flat directory holding all workspaces. ``allocator`` is ``WorkspaceAllocator``. Every round, all candidates but
+the last one are taken, like the busiest minute of the default names (``<date>-<time>[a-z]``).
+
+Usage: python benchmarks/workspace_names.py [workspaces] [rounds]
+"""
+
+import string
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from lobbyboy.workspace import WorkspaceAllocator
+
+SUFFIXES = ["", *string.ascii_lowercase]
+
+
+def flat(root: Path) -> Callable[[List[str]], str]:
+    def allocate(candidates: List[str]) -> str:
+        for name in candidates:
+            workspace = root.joinpath(name)
+            if not workspace.exists():
+                workspace.mkdir(parents=True)
+                return name
+
+    return allocate
+
+
+def allocator(root: Path) -> Callable[[List[str]], str]:
+    return WorkspaceAllocator(root).allocate
+
+
+def main(workspaces: int = 20000, rounds: int = 200):
+    for name, factory in (("flat", flat), ("allocator", allocator)):
+        root = Path(tempfile.mkdtemp()).joinpath("vagrant")
+        allocate = factory(root)
+        for i in range(workspaces):
+            allocate([f"old-{i}"])
+
+        start = time.perf_counter()
+        for i in range(rounds):
+            for suffix in SUFFIXES:
+                allocate([f"srv-{i}{s}" for s in SUFFIXES if s <= suffix])
+        cost = (time.perf_counter() - start) / (rounds * len(SUFFIXES)) * 1000
+        print(f"{name:>10}: {cost:.3f}ms per name, {len(list(root.iterdir()))} entries in {root}")
+
+
+if __name__ == "__main__":
+    main(*[int(i) for i in sys.argv[1:]])
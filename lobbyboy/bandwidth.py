@@ -0,0 +1,78 @@
+import math
+import time
+from typing import Optional
+
+# seconds, how long the traffic of a session is remembered when telling interactive ones from bulk ones.
+TRAFFIC_TIME_CONSTANT = 1.0
+# sessions moving more bytes per second than this are bulk sessions.
+DEFAULT_BULK_THRESHOLD = 64 * 1024
+# a session is held back until at least a packet worth of bytes is allowed, don't wake up for a few bytes.
+MIN_ALLOWANCE = 1024
+
+
+class TokenBucket:
+    """
+    Allow ``rate`` bytes per second, and at most ``burst`` bytes at once (``rate`` if not set).
+
+    Bytes are taken after they have been moved, so the bucket may go into debt, then nothing is allowed
+    until the debt is paid off. A ``rate`` of 0 means unlimited.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: int = 0, burst: int = 0):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def available(self, now: float) -> float:
+        if self.unlimited:
+            return math.inf
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def allowance(self, now: float) -> float:
+        """how many bytes can be moved now, 0 if less than ``MIN_ALLOWANCE`` (or ``burst``) bytes."""
+        tokens = self.available(now)
+        return tokens if tokens >= min(self.burst, MIN_ALLOWANCE) else 0
+
+    def consume(self, nbytes: int, now: float):
+        if not self.unlimited:
+            self.available(now)
+            self.tokens -= nbytes
+
+    def wait_time(self, now: float) -> float:
+        """seconds until ``allowance`` is not 0 again."""
+        return max(min(self.burst, MIN_ALLOWANCE) - self.available(now), 0) / self.rate
+
+
+class TrafficMeter:
+    """Recent bytes per second of a session, decays with ``TRAFFIC_TIME_CONSTANT``."""
+
+    __slots__ = ("level", "updated")
+
+    def __init__(self):
+        self.level = 0.0
+        self.updated = time.monotonic()
+
+    def _decay(self, now: float):
+        self.level *= math.exp(-(now - self.updated) / TRAFFIC_TIME_CONSTANT)
+        self.updated = now
+
+    def add(self, nbytes: int, now: float):
+        self._decay(now)
+        self.level += nbytes
+
+    def rate(self, now: float) -> float:
+        self._decay(now)
+        return self.level / TRAFFIC_TIME_CONSTANT
+
+
+def session_limiter(rate: int, burst: int = 0) -> Optional[TokenBucket]:
+    return TokenBucket(rate, burst) if rate > 0 else None
@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+from typing import Optional, Union
+
+from paramiko.channel import Channel
+
+logger = logging.getLogger(__name__)
+
+# buffered output is sent at most this many seconds after it is written.
+DEFAULT_MAX_LATENCY = 0.05
+# send buffered output once there are this many bytes, a few of max ssh packets.
+DEFAULT_MAX_BUFFER = 64 * 1024
+# the flusher thread of a channel exits once nothing is written for this many seconds.
+FLUSHER_IDLE_TIMEOUT = 1
+
+
+class BufferedChannel:
+    """
+    Wrap the user's channel, so the output lobbyboy generates itself (menus, banners, progress of
+    creating servers...) goes out in a few large writes instead of many tiny SSH packets.
+
+    Written bytes are kept until:
+
+    - ``flush`` is called, before lobbyboy waits for user input (``recv``), shuts the channel down,
+      or hands the channel off to the relay engine;
+    - there are ``max_buffer`` bytes kept;
+    - they have been kept for ``max_latency`` seconds, so progress output still shows up in time.
+
+    The last one is done by one flusher thread of the channel, it keeps going while output keeps coming
+    (e.g. progress dots) and exits once nothing is written for ``FLUSHER_IDLE_TIMEOUT`` seconds.
+    Writes only wait for the buffer, never for the channel, bytes go out in the order they were written.
+
+    Other attributes are read from the wrapped channel.
+    """
+
+    __slots__ = (
+        "channel",
+        "max_latency",
+        "max_buffer",
+        "_buffer",
+        "_buffered_at",
+        "_lock",
+        "_send_lock",
+        "_flusher",
+        "line_editor",
+        "__weakref__",
+    )
+
+    def __init__(
+        self, channel: Channel, max_latency: float = DEFAULT_MAX_LATENCY, max_buffer: int = DEFAULT_MAX_BUFFER
+    ):
+        self.channel = channel
+        self.max_latency = max_latency
+        self.max_buffer = max_buffer
+        self._buffer = bytearray()
+        # time.monotonic() when the first byte of the buffer was written.
+        self._buffered_at = 0.0
+        # guards the buffer, ``_send_lock`` keeps sends in order, it is taken before ``_lock`` if both are.
+        self._lock = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        # the ``LineEditor`` reading the user's answers, with what they have typed ahead, see ``lobbyboy.utils``.
+        self.line_editor = None
+
+    def __getattr__(self, name):
+        return getattr(self.channel, name)
+
+    def sendall(self, data: Union[bytes, bytearray]):
+        with self._lock:
+            if not self._buffer:
+                self._buffered_at = time.monotonic()
+            self._buffer.extend(data)
+            full = len(self._buffer) >= self.max_buffer
+            if not full:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_forever, name="channel-flusher", daemon=True)
+                    self._flusher.start()
+                else:
+                    self._lock.notify()
+        if full:
+            self.flush()
+
+    def send(self, data: Union[bytes, bytearray]) -> int:
+        self.sendall(data)
+        return len(data)
+
+    def flush(self):
+        with self._send_lock:
+            with self._lock:
+                data, self._buffer = bytes(self._buffer), bytearray()
+            if data:
+                self.channel.sendall(data)
+
+    def _flush_forever(self):
+        while True:
+            with self._lock:
+                if not self._buffer:
+                    self._lock.wait(FLUSHER_IDLE_TIMEOUT)
+                if not self._buffer:
+                    self._flusher = None
+                    return
+                delay = self._buffered_at + self.max_latency - time.monotonic()
+                if delay > 0:
+                    # flushed by others meanwhile, or not yet time.
+                    self._lock.wait(delay)
+                    continue
+            try:
+                self.flush()
+            except OSError as e:
+                logger.info(f"can not flush output to user: {e}")
+
+    def recv(self, nbytes: int) -> bytes:
+        # user can not answer what they haven't seen.
+        self.flush()
+        return self.channel.recv(nbytes)
+
+    def shutdown(self, how: int):
+        try:
+            self.flush()
+        except OSError as e:
+            logger.info(f"can not flush output to user before shutdown: {e}")
+        self.channel.shutdown(how)
+
+    def close(self):
+        try:
+            self.flush()
+        except OSError as e:
+            logger.info(f"can not flush output to user before close: {e}")
+        self.channel.close()
+
+
+class StderrChannel:
+    """
+    Wrap the user's channel of a command or subsystem, what lobbyboy says goes to stderr,
+    stdout only carries the server's output.
+    """
+
+    __slots__ = ("channel",)
+
+    def __init__(self, channel: Channel):
+        self.channel = channel
+
+    def __getattr__(self, name):
+        return getattr(self.channel, name)
+
+    def sendall(self, data: Union[bytes, bytearray]):
+        self.channel.sendall_stderr(data)
+
+    def send(self, data: Union[bytes, bytearray]) -> int:
+        return self.channel.send_stderr(data)
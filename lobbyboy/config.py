@@ -1,26 +1,105 @@
+import base64
+import binascii
+import fcntl
+import hashlib
+import ipaddress
 import json
 import logging
+import threading
 import time
-from collections import OrderedDict
-from dataclasses import asdict, dataclass, field, fields
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, fields, replace
 from json import JSONDecodeError
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 from typing import OrderedDict as typeOrderedDict
-from typing import Tuple, Type
+from typing import Set, Tuple, Type
 
 import toml
 
 from lobbyboy.exceptions import InvalidConfigException
-from lobbyboy.utils import confirm_dc_type, encoder_factory, import_class
+from lobbyboy.handshake import HOST_KEYS
+from lobbyboy.utils import (
+    KeyTypeSupport,
+    atomic_write,
+    confirm_dc_type,
+    encoder_factory,
+    file_signature,
+    import_class,
+)
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class LBConfigTransport:
+    """How lobbyboy talks ssh with users, see ``lobbyboy.transport``."""
+
+    # bytes a user can send on a channel before we adjust the window, paramiko's default if not set.
+    window_size: Optional[int] = None
+    # max size of a data packet on a channel, paramiko's default if not set.
+    max_packet_size: Optional[int] = None
+    # preferred ciphers and MACs, most preferred first, paramiko's default order if empty.
+    ciphers: List[str] = field(default_factory=list)
+    macs: List[str] = field(default_factory=list)
+    compression: bool = False
+    tcp_nodelay: bool = True
+    tcp_keepalive: bool = True
+    # send ssh keepalive messages when there is no traffic for this long, "0s" to disable.
+    keepalive_interval: str = "0s"
+
+
+@dataclass
+class LBConfigBandwidth:
+    """How fast sessions move data, see ``lobbyboy.bandwidth``, rates are bytes per second, 0 means unlimited."""
+
+    # every session of a user, what the servers send to the user, the user's own input is never held back.
+    session_rate: int = 0
+    session_burst: int = 0
+    # all bulk sessions in one process, interactive sessions are never held back by it.
+    global_rate: int = 0
+    global_burst: int = 0
+    # sessions moving more than this many bytes per second recently are bulk sessions, others are interactive.
+    bulk_threshold: int = 64 * 1024
+
+
+@dataclass
+class LBConfigThrottle:
+    """Connections from one source address, checked before any ssh work is done, see ``lobbyboy.throttle``."""
+
+    # connections an address can open in ``window``, 0 means unlimited.
+    max_connections: int = 30
+    # addresses failing auth this many times in ``window`` are banned for ``ban_time``, 0 means never.
+    # failures are the auth rejections paramiko has sent (``auth_fail_count``), counted once per connection
+    # when its auth ends.
+    max_auth_failures: int = 20
+    window: str = "1m"
+    ban_time: str = "1h"
+    # at most this many addresses are tracked, the least recently seen ones are forgotten first.
+    max_addresses: int = 10000
+    # bans are kept in this file of ``data_dir``, across restarts.
+    bans_file: str = "banned_addresses.json"
+    # addresses or networks never throttled, e.g. "10.0.0.0/8".
+    trusted_addresses: List[str] = field(default_factory=list)
+
+
+# how the servers registry is kept, "sqlite" is kept next to ``servers_file``, with the same name,
+# "journal" keeps ``servers_file`` as its snapshot.
+SERVERS_BACKENDS = ("json", "sqlite", "journal")
+
+# items of ``[bandwidth]`` that can be overridden per user.
+USER_BANDWIDTH_ITEMS = ("session_rate", "session_burst")
+
+
 @dataclass
 class LBConfigUser:
     authorized_keys: str = None
     password: Optional[str] = None
+    # override items of the ``[transport]`` section for this user.
+    transport: Dict[str, Any] = field(default_factory=dict)
+    # override ``session_rate`` and ``session_burst`` of the ``[bandwidth]`` section for this user.
+    bandwidth: Dict[str, Any] = field(default_factory=dict)
 
     def auth_key_pairs(self) -> List[Tuple]:
         """
@@ -30,7 +109,40 @@ class LBConfigUser:
         """
         if not self.authorized_keys:
             return []
-        return [tuple(ssh_key.split(maxsplit=1)) for ssh_key in self.authorized_keys.split("\n") if ssh_key]
+        # drop the comment at the end of the key, if any.
+        key_lines = (line.split() for line in self.authorized_keys.splitlines())
+        return [tuple(units[:2]) for units in key_lines if len(units) >= 2 and not units[0].startswith("#")]
+
+
+class AuthorizedKeyIndex:
+    """
+    Index of all users' authorized keys, it is built once per config snapshot, so checking an offered key is
+    only a dict lookup.
+    """
+
+    def __init__(self, users: Dict[str, LBConfigUser]):
+        self._keys: Set[Tuple[str, str, bytes]] = set()
+        # md5 fingerprint(hex, same as ``paramiko.PKey.get_fingerprint``) -> users, only for logging.
+        self.fingerprint_users: Dict[str, List[str]] = defaultdict(list)
+        for username, user in users.items():
+            for key_type, key_data in user.auth_key_pairs():
+                try:
+                    key_blob = base64.b64decode(key_data, validate=True)
+                except binascii.Error:
+                    logger.error(f"invalid authorized key of user {username}: {key_type} {key_data[:16]}...")
+                    continue
+                self._keys.add((username, key_type, key_blob))
+                self.fingerprint_users[self.fingerprint(key_blob)].append(username)
+
+    @staticmethod
+    def fingerprint(key_blob: bytes) -> str:
+        return hashlib.md5(key_blob).hexdigest()  # nosec: md5 is the key fingerprint, not for security
+
+    def accept(self, username: str, key_type: str, key_blob: bytes) -> bool:
+        return (username, key_type, key_blob) in self._keys
+
+    def users_of(self, key_blob: bytes) -> List[str]:
+        return self.fingerprint_users.get(self.fingerprint(key_blob), [])
 
 
 @dataclass
@@ -65,6 +177,9 @@ class LBServerMeta:
     ssh_extra_args: List[str] = field(default_factory=list)
     # indicate whether this server is managed by us or not.
     manage: bool = True
+    # what the provider needs to manage the server, kept small: e.g. its id at the vendor, and where its raw
+    # payload is, see ``BaseProvider.save_payload``.
+    provider_data: Dict[str, Any] = field(default_factory=dict)
 
     def __post_init__(self):
         self.confirm_data_type()
@@ -87,11 +202,30 @@ class LBConfig:
     listen_ip: str = None
     min_destroy_interval: str = None
     servers_file: str = None
+    # where servers are kept, see ``lobbyboy.registry``.
+    servers_backend: str = "json"
     log_level: str = None
+    max_handshakes: int = 32
+    handshake_queue_size: int = 128
+    handshake_timeout: str = "30s"
+    splice_upstream: bool = False
+    upstream_idle_timeout: str = "10m"
+    detach_grace_period: str = "0s"
+    detach_scrollback_size: int = 64 * 1024
+    detached_session_keeps_server: bool = True
+    spawn_helper: bool = True
+    # stack size of every thread lobbyboy and paramiko start, bytes, 0 means the system default (8MB mostly).
+    thread_stack_size: int = 0
+    # host key types to serve, ssh clients pick one of them, see ``lobbyboy.handshake``.
+    host_key_types: List[str] = field(default_factory=lambda: ["ed25519", "ecdsa", "rsa"])
+    transport: LBConfigTransport = field(default_factory=LBConfigTransport)
+    bandwidth: LBConfigBandwidth = field(default_factory=LBConfigBandwidth)
+    throttle: LBConfigThrottle = field(default_factory=LBConfigThrottle)
     user: Dict[str, Type[LBConfigUser]] = field(default_factory=dict)
     provider: Dict[str, LBConfigProvider] = field(default_factory=dict)
     # Hold all providers class.
     _provider_cls: Dict[str, Any] = field(default_factory=dict)
+    _authorized_key_index: Optional[AuthorizedKeyIndex] = None
 
     @classmethod
     def load(cls, config_file: Path) -> "LBConfig":
@@ -125,6 +259,24 @@ class LBConfig:
         """
         if self.data_dir is None:
             return False, "missing required config: please check 'data_dir' in your config file."
+        unknown = {t.upper() for t in self.host_key_types} - {t.name for t in HOST_KEYS}
+        if unknown or not self.host_key_types:
+            return False, f"invalid host_key_types, choose from: {', '.join(t.name.lower() for t in HOST_KEYS)}."
+        if self.servers_backend not in SERVERS_BACKENDS:
+            return False, f"invalid servers_backend, choose from: {', '.join(SERVERS_BACKENDS)}."
+        for address in self.throttle.trusted_addresses:
+            try:
+                ipaddress.ip_network(address, strict=False)
+            except ValueError:
+                return False, f"invalid trusted address of throttle: {address}."
+        transport_items = {f.name for f in fields(LBConfigTransport)}
+        for username, user in self.user.items():
+            unknown = set(user.transport) - transport_items
+            if unknown:
+                return False, f"unknown transport config of user {username}: {', '.join(sorted(unknown))}."
+            unknown = set(user.bandwidth) - set(USER_BANDWIDTH_ITEMS)
+            if unknown:
+                return False, f"unknown bandwidth config of user {username}: {', '.join(sorted(unknown))}."
         # TODO, config validator
         return True, None
 
@@ -134,6 +286,9 @@ class LBConfig:
         if self.data_dir:
             self.data_dir = Path(self.data_dir)
         self.user = {u: confirm_dc_type(config, LBConfigUser) for u, config in self.user.items()}
+        self.transport = confirm_dc_type(self.transport, LBConfigTransport)
+        self.bandwidth = confirm_dc_type(self.bandwidth, LBConfigBandwidth)
+        self.throttle = confirm_dc_type(self.throttle, LBConfigThrottle)
 
         # Initialize the configuration with each provider's own config class.
         config: Dict
@@ -151,14 +306,80 @@ class LBConfig:
             self.provider[name] = confirm_dc_type(config, provider_cls.config)
             self._provider_cls[name] = provider_cls
 
+    def transport_profile(self, username: str = None) -> LBConfigTransport:
+        """the ``[transport]`` section, with the overrides of ``username`` applied if given."""
+        user = self.user.get(username) if username else None
+        if not (user and user.transport):
+            return self.transport
+        return replace(self.transport, **user.transport)
+
+    def bandwidth_profile(self, username: str = None) -> LBConfigBandwidth:
+        """the ``[bandwidth]`` section, with the overrides of ``username`` applied if given."""
+        user = self.user.get(username) if username else None
+        if not (user and user.bandwidth):
+            return self.bandwidth
+        return replace(self.bandwidth, **user.bandwidth)
+
     @property
     def provider_cls(self):
         return self._provider_cls
 
+    @property
+    def authorized_key_index(self) -> AuthorizedKeyIndex:
+        if self._authorized_key_index is None:
+            self._authorized_key_index = AuthorizedKeyIndex(self.user)
+        return self._authorized_key_index
+
     @property
     def servers_db_path(self) -> Path:
         return self.data_dir.joinpath(self.servers_file)
 
+    @property
+    def bans_path(self) -> Path:
+        return self.data_dir.joinpath(self.throttle.bans_file)
+
+    @property
+    def host_key_type_list(self) -> List[KeyTypeSupport]:
+        return [KeyTypeSupport[t.upper()] for t in self.host_key_types]
+
+
+class LBConfigWatcher:
+    """
+    Hold the latest snapshot of the config file.
+
+    The file is parsed again only when its inode, mtime or size changed, so reading the config is cheap enough
+    for every auth attempt. A snapshot is never changed after it is published, readers get the current one
+    without locking.
+    """
+
+    def __init__(self, config: LBConfig):
+        self._config: LBConfig = config
+        self._signature: Optional[Tuple] = self._stat(config._file)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stat(config_file: Path) -> Optional[Tuple]:
+        signature = file_signature(config_file)
+        if signature is None:
+            logger.error(f"can not stat config file {config_file}")
+        return signature
+
+    @property
+    def config(self) -> LBConfig:
+        signature = self._stat(self._config._file)
+        if signature is None or signature == self._signature:
+            return self._config
+
+        with self._lock:
+            if signature != self._signature:
+                logger.info(f"config file {self._config._file} changed, reloading...")
+                try:
+                    self._config = self._config.reload()
+                except Exception as e:  # noqa
+                    logger.error(f"reload config failed, keep using the last good one: {e}")
+                self._signature = signature
+        return self._config
+
 
 def load_local_servers(servers_db_path: Path) -> typeOrderedDict[str, LBServerMeta]:
     """
@@ -181,21 +402,39 @@ def load_local_servers(servers_db_path: Path) -> typeOrderedDict[str, LBServerMe
     return d
 
 
+@contextmanager
+def servers_db_file_lock(servers_db_path: Path):
+    """
+    Lock the server db across processes (worker processes and the server killer may update it at the same time).
+    """
+    with open(servers_db_path.with_name(f"{servers_db_path.name}.lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
 def update_local_servers(
     servers_db_path: Path,
     new: List[LBServerMeta] = None,
     deleted: List[LBServerMeta] = None,
 ) -> Dict[str, LBServerMeta]:
-    local_servers = load_local_servers(servers_db_path)
+    with servers_db_file_lock(servers_db_path):
+        local_servers = load_local_servers(servers_db_path)
 
-    _add_servers = new or []
-    local_servers.update({server.server_name: server for server in _add_servers})
+        _add_servers = new or []
+        local_servers.update({server.server_name: server for server in _add_servers})
 
-    _remove_servers = deleted or []
-    for server in _remove_servers:
-        local_servers.pop(server.server_name, None)
+        _remove_servers = deleted or []
+        for server in _remove_servers:
+            local_servers.pop(server.server_name, None)
 
-    with open(servers_db_path, "w+") as f:
-        c = [asdict(i) for i in local_servers.values()]  # type: ignore
-        f.write(json.dumps(c, default=encoder_factory()))
+        save_local_servers(servers_db_path, local_servers)
     return local_servers
+
+
+def save_local_servers(servers_db_path: Path, servers: Dict[str, LBServerMeta]):
+    """write all servers, the caller should hold ``servers_db_file_lock``."""
+    c = [asdict(i) for i in servers.values()]  # type: ignore
+    atomic_write(servers_db_path, json.dumps(c, default=encoder_factory()))
@@ -40,7 +40,14 @@ class DigitalOceanProvider(BaseProvider):
         return False
 
     def create_server(self, channel: Channel) -> LBServerMeta:
-        region, size, image = self._ask_user_customize_server(channel)
+        return self._create_server(channel, *self._ask_user_customize_server(channel))
+
+    def create_server_from_template(self, channel: Channel, template: str) -> LBServerMeta:
+        favorite = self.choose_template(self.provider_config.favorite_instance_types, template)
+        region, size, image = favorite.split(":")
+        return self._create_server(channel, region, size, image)
+
+    def _create_server(self, channel: Channel, region: str, size: str, image: str) -> LBServerMeta:
         server_name = self.generate_default_server_name()
         server_workspace = self.get_server_workspace(server_name)
         server_workspace.mkdir(exist_ok=True, parents=True)
@@ -79,7 +86,7 @@ class DigitalOceanProvider(BaseProvider):
 
         # save server info to local first
         droplet_meta = dict_factory(droplet.__dict__, ignore_fields=["tokens"], ignore_rule=lambda x: x.startswith("_"))
-        self.save_raw_server(droplet_meta, workspace)
+        provider_data = self.save_payload(server_name, droplet_meta, id=droplet.id)
 
         # wait for server to startup(check port is alive or not)
         send_to_channel(channel, "Waiting for server to boot...")
@@ -91,6 +98,7 @@ class DigitalOceanProvider(BaseProvider):
             server_name=server_name,
             workspace=workspace,
             server_host=droplet.ip_address,
+            provider_data=provider_data,
         )
 
     def _ask_user_customize_server(self, channel: Channel) -> Tuple[str, str, str]:
@@ -132,9 +140,7 @@ class DigitalOceanProvider(BaseProvider):
         logger.info(f"try to destroy {meta.server_name} under workspace {meta.workspace}...")
         if channel:
             send_to_channel(channel, f"Destroy server {meta.server_name}...")
-        data = self.load_raw_server(meta.workspace)
-
-        droplet = Droplet.get_object(api_token=self.__token, droplet_id=data["id"])
+        droplet = Droplet.get_object(api_token=self.__token, droplet_id=self.provider_field(meta, "id"))
         logger.info(f"get object from digitalocean: {droplet}")
         result = droplet.destroy()
         logger.info(f"destroy droplet, result: {result}")
@@ -26,6 +26,8 @@ class FootlooseConfig(LBConfigProvider):
 
 class FootlooseProvider(BaseProvider):
     config = FootlooseConfig
+    # servers are only reachable via the provider's own ssh command.
+    splice_capable = False
 
     def is_available(self) -> bool:
         if not self.check_command(["footloose", "-h"]):
@@ -29,6 +29,8 @@ class IgniteConfig(LBConfigProvider):
 
 class IgniteProvider(BaseProvider):
     config = IgniteConfig
+    # servers are only reachable via the provider's own ssh command.
+    splice_capable = False
 
     def is_available(self) -> bool:
         if not self.check_command(["ignite", "-h"]):
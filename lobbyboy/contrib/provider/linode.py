@@ -38,7 +38,14 @@ class LinodeProvider(BaseProvider):
             return False
 
     def create_server(self, channel: Channel) -> LBServerMeta:
-        region_id, type_id, image_id = self._ask_user_customize_server(channel)
+        return self._create_server(channel, *self._ask_user_customize_server(channel))
+
+    def create_server_from_template(self, channel: Channel, template: str) -> LBServerMeta:
+        favorite = self.choose_template(self.provider_config.favorite_instance_types, template)
+        region_id, type_id, image_id = favorite.split(":")
+        return self._create_server(channel, region_id, type_id, image_id)
+
+    def _create_server(self, channel: Channel, region_id: str, type_id: str, image_id: str) -> LBServerMeta:
         server_name = self.generate_default_server_name()
         server_workspace = self.get_server_workspace(server_name)
         server_workspace.mkdir(exist_ok=True, parents=True)
@@ -72,7 +79,7 @@ class LinodeProvider(BaseProvider):
         # TODO `_serialize` information le less
         instance_info = instance._serialize()  # noqa
         instance_info["id"] = instance.id
-        self.save_raw_server(instance_info, workspace)  # noqa
+        provider_data = self.save_payload(server_name, instance_info, id=instance.id)
 
         # wait for server to startup(check port is alive or not)
         send_to_channel(channel, "Waiting for server to boot...")
@@ -84,6 +91,7 @@ class LinodeProvider(BaseProvider):
             server_name=server_name,
             workspace=workspace,
             server_host=instance.ipv4[0],
+            provider_data=provider_data,
         )
 
     def _ask_user_customize_server(self, channel: Channel) -> Tuple[str, str, str]:
@@ -135,9 +143,8 @@ class LinodeProvider(BaseProvider):
         logger.info(f"try to destroy {meta.server_name} under workspace {meta.workspace}...")
         if channel:
             send_to_channel(channel, f"Destroy server {meta.server_name}...")
-        data = self.load_raw_server(meta.workspace)
-
-        instance: Instance = LinodeClient(token=self.__token).linode.instances(Instance.id == data["id"]).first()
+        instance_id = self.provider_field(meta, "id")
+        instance: Instance = LinodeClient(token=self.__token).linode.instances(Instance.id == instance_id).first()
         logger.info(f"get object from linode: {instance}")
         result = instance.delete()
         logger.info(f"destroy linode, result: {result}")
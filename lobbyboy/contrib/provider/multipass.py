@@ -31,6 +31,8 @@ class MultipassConfig(LBConfigProvider):
 
 class MultipassProvider(BaseProvider):
     config = MultipassConfig
+    # servers are only reachable via the provider's own ssh command.
+    splice_capable = False
 
     def is_available(self) -> bool:
         if not self.check_command(["multipass", "-h"]):
@@ -4,11 +4,12 @@ from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Optional
 
-from paramiko import Channel
+from paramiko import Channel, SSHConfig
 
 from lobbyboy.config import LBConfigProvider, LBServerMeta
 from lobbyboy.exceptions import NoAvailableNameException, VagrantProviderException
 from lobbyboy.provider import BaseProvider
+from lobbyboy.upstream import UpstreamAddress
 from lobbyboy.utils import send_to_channel
 
 logger = logging.getLogger(__name__)
@@ -27,15 +28,11 @@ class VagrantProvider(BaseProvider):
         self._tmp_ssh_config_file: Optional[Path] = None
 
     def generate_server_name(self):
-        vm_name = None
-        for idx in range(1, 99):
-            vm_name = str(idx)
-            if self.provider_config.server_name_prefix:
-                vm_name = f"{self.provider_config.server_name_prefix}-{vm_name}"
-            server_workspace = self.workspace.joinpath(vm_name)
-            if not server_workspace.exists():
-                return vm_name
-        raise NoAvailableNameException(f"{self.name}'s server {vm_name}[a-z] already exist!")
+        prefix = f"{self.provider_config.server_name_prefix}-" if self.provider_config.server_name_prefix else ""
+        allocated = self.workspaces.allocate(f"{prefix}{idx}" for idx in range(1, 99))
+        if allocated is None:
+            raise NoAvailableNameException(f"{self.name}'s server {prefix}[1-98] already exist!")
+        return allocated[0]
 
     def create_server(self, channel: Channel) -> LBServerMeta:
         server_name = self.generate_server_name()
@@ -59,7 +56,7 @@ class VagrantProvider(BaseProvider):
         send_to_channel(channel, f"New server {server_name} created!")
 
         # export the ssh_config to file
-        self._tmp_ssh_config_file = server_workspace.joinpath("ssh_config")
+        self._tmp_ssh_config_file = self.ssh_config_file(server_workspace)
         VagrantProvider._run_vagrant(
             command_exec=["vagrant", "ssh-config", server_name],
             cwd=str(server_workspace),
@@ -81,6 +78,20 @@ class VagrantProvider(BaseProvider):
             raise VagrantProviderException("Error when destroy {}".format(vid))
         return success
 
+    @staticmethod
+    def ssh_config_file(server_workspace: Path) -> Path:
+        return server_workspace.joinpath("ssh_config")
+
+    def upstream_address(self, meta: LBServerMeta) -> UpstreamAddress:
+        """vagrant picks the forwarded port and the insecure key, they are in the exported ssh_config."""
+        host_config = SSHConfig.from_path(str(self.ssh_config_file(meta.workspace))).lookup(meta.server_name)
+        return UpstreamAddress(
+            host=host_config.get("hostname", meta.server_host),
+            port=int(host_config.get("port", meta.server_port)),
+            user=host_config.get("user", meta.server_user),
+            key_path=Path(host_config.get("identityfile", [self.default_private_key_path(meta.workspace)])[0]),
+        )
+
     def ssh_server_command(self, meta: LBServerMeta, pri_key_path: Path = None) -> List[str]:
         command = [
             "ssh",
@@ -41,7 +41,14 @@ class VultrProvider(BaseProvider):
             return False
 
     def create_server(self, channel: Channel) -> LBServerMeta:
-        region_id, plan_id, image_id = self._ask_user_customize_server(channel)
+        return self._create_server(channel, *self._ask_user_customize_server(channel))
+
+    def create_server_from_template(self, channel: Channel, template: str) -> LBServerMeta:
+        favorite = self.choose_template(self.provider_config.favorite_instance_types, template)
+        region_id, plan_id, image_id = favorite.split(":")
+        return self._create_server(channel, region_id, plan_id, image_id)
+
+    def _create_server(self, channel: Channel, region_id: str, plan_id: str, image_id: str) -> LBServerMeta:
         server_name = self.generate_default_server_name()
         server_workspace = self.get_server_workspace(server_name)
         server_workspace.mkdir(exist_ok=True, parents=True)
@@ -85,7 +92,7 @@ class VultrProvider(BaseProvider):
         send_to_channel(channel, f"New server {server_name} (IP: {instance.main_ip}) created!")
 
         # save server info to local first
-        self.save_raw_server(instance.to_dict(), workspace)
+        provider_data = self.save_payload(server_name, instance.to_dict(), id=instance.id)
 
         # wait for server to startup(check port is alive or not)
         send_to_channel(channel, "Waiting for server to boot...")
@@ -97,6 +104,7 @@ class VultrProvider(BaseProvider):
             server_name=server_name,
             workspace=workspace,
             server_host=instance.main_ip,
+            provider_data=provider_data,
         )
 
     def _ask_user_customize_server(self, channel: Channel) -> Tuple[str, str, str]:
@@ -140,9 +148,7 @@ class VultrProvider(BaseProvider):
         logger.info(f"try to destroy {meta.server_name} under workspace {meta.workspace}...")
         if channel:
             send_to_channel(channel, f"Destroy server {meta.server_name}...")
-        data = self.load_raw_server(meta.workspace)
-
-        failed = self.client.instance.delete(instance_id=data["id"])
+        failed = self.client.instance.delete(instance_id=self.provider_field(meta, "id"))
         success = not failed
         logger.info(f"destroy vultr, result: {success}")
         if channel:
@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from lobbyboy.config import LBServerMeta
+from lobbyboy.relay import RelaySession
+from lobbyboy.server import Server
+from lobbyboy.utils import detached_session_counter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DetachedSession:
+    username: str
+    meta: LBServerMeta
+    session: RelaySession
+    # the ``Server`` of the connection that has gone, holding the pty or upstream of the session.
+    server: Server
+    detached_at: float = field(default_factory=time.monotonic)
+    timer: Optional[threading.Timer] = None
+    # the id in ``detached_session_counter``, the same as in ``session_counter``.
+    session_id: Optional[str] = None
+
+
+class DetachedSessions:
+    """
+    Sessions whose user has gone, they are kept in the relay engine for a grace period,
+    and expired (closed) if nobody claims them before that.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[RelaySession, DetachedSession] = {}
+        self._lock = threading.Lock()
+
+    def add(self, detached: DetachedSession, grace_period: float, on_expire: Callable[[RelaySession], None]):
+        detached.timer = threading.Timer(grace_period, self._expire, args=(detached.session, on_expire))
+        detached.timer.daemon = True
+        # counted before it can be claimed or discarded, they take it off the counter.
+        detached.session_id = detached_session_counter.add(detached.meta.server_name, detached.server.session_id)
+        with self._lock:
+            self._sessions[detached.session] = detached
+            detached.timer.start()
+
+    def _expire(self, session: RelaySession, on_expire: Callable[[RelaySession], None]):
+        detached = self._pop(session)
+        if detached is not None:
+            logger.info(f"detached session of {detached.username} on {detached.meta.server_name} expired.")
+            on_expire(session)
+
+    def of_user(self, username: str) -> List[DetachedSession]:
+        """detached sessions of the user, the latest first."""
+        with self._lock:
+            sessions = [d for d in self._sessions.values() if d.username == username]
+        return sorted(sessions, key=lambda d: d.detached_at, reverse=True)
+
+    def claim(self, detached: DetachedSession) -> bool:
+        """take the session to resume it, False if it has been expired or closed."""
+        return self._pop(detached.session) is not None
+
+    def discard(self, session: RelaySession):
+        self._pop(session)
+
+    def _pop(self, session: RelaySession) -> Optional[DetachedSession]:
+        with self._lock:
+            detached = self._sessions.pop(session, None)
+        if detached is not None:
+            detached.timer.cancel()
+            detached_session_counter.remove(detached.session_id, notify=False)
+        return detached
+
+
+# sessions live in the relay engine of this process, so do the detached ones.
+detached_sessions = DetachedSessions()
@@ -18,6 +18,22 @@ class UserCancelException(LobbyBoyException):
     pass
 
 
+class HandshakeTimeoutException(LobbyBoyException):
+    pass
+
+
+class UpstreamException(LobbyBoyException):
+    pass
+
+
+class RoutingException(LobbyBoyException):
+    pass
+
+
+class SpawnerException(LobbyBoyException):
+    pass
+
+
 class ProviderException(LobbyBoyException):
     pass
 
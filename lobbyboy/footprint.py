@@ -0,0 +1,112 @@
+import logging
+import os
+import threading
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# how many allocation sites are listed in a report, when tracemalloc is tracing.
+TOP_ALLOCATIONS = 5
+
+
+@dataclass
+class Footprint:
+    """What this process holds at some point, read from ``/proc`` (0 where it is not available)."""
+
+    sessions: int = 0
+    threads: int = 0
+    fds: int = 0
+    # bytes, resident memory of this process, and its virtual memory (thread stacks are reserved here).
+    rss: int = 0
+    vm: int = 0
+    # bytes, resident memory of the processes started by this one (proxy ``ssh`` processes, the spawner...).
+    children_rss: int = 0
+    children: int = 0
+    # bytes allocated by python, if tracemalloc is tracing (``PYTHONTRACEMALLOC=1``).
+    traced: Optional[int] = None
+    top_allocations: List[Tuple[str, int]] = field(default_factory=list)
+
+
+def _status(pid) -> Dict[str, str]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            return dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {}
+
+
+def _kb(value: Optional[str]) -> int:
+    """``VmRSS`` of ``/proc/<pid>/status`` is like "  1234 kB"."""
+    return int(value.split()[0]) * 1024 if value else 0
+
+
+def _descendants(pid: int) -> List[int]:
+    children: Dict[int, List[int]] = {}
+    try:
+        pids = [int(p) for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return []
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                # the command in (...) may have spaces, ppid is the second field after it.
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(p)
+    found, queue = [], list(children.get(pid, []))
+    while queue:
+        p = queue.pop()
+        found.append(p)
+        queue.extend(children.get(p, []))
+    return found
+
+
+def take(sessions: int = 0) -> Footprint:
+    status = _status("self")
+    try:
+        fds = len(os.listdir("/proc/self/fd"))
+    except OSError:
+        fds = 0
+    children = _descendants(os.getpid())
+    footprint = Footprint(
+        sessions=sessions,
+        threads=int(status.get("Threads", 0)) or threading.active_count(),
+        fds=fds,
+        rss=_kb(status.get("VmRSS")),
+        vm=_kb(status.get("VmSize")),
+        children_rss=sum(_kb(_status(p).get("VmRSS")) for p in children),
+        children=len(children),
+    )
+    if tracemalloc.is_tracing():
+        footprint.traced = tracemalloc.get_traced_memory()[0]
+        stats = tracemalloc.take_snapshot().statistics("lineno")[:TOP_ALLOCATIONS]
+        footprint.top_allocations = [(str(stat.traceback), stat.size) for stat in stats]
+    return footprint
+
+
+def report(baseline: Footprint, now: Footprint) -> str:
+    """``now`` compared with ``baseline`` (taken before any session), and what one session costs on average."""
+    sessions = now.sessions - baseline.sessions
+
+    def line(name: str, base: int, current: int, unit: str = "") -> str:
+        scale = 1024 if unit else 1
+        text = f"{name}: {current / scale:.0f}{unit} (+{(current - base) / scale:.0f}{unit}"
+        if sessions > 0:
+            text += f", {(current - base) / sessions / scale:.1f}{unit} per session"
+        return text + ")"
+
+    lines = [
+        f"footprint of {now.sessions} sessions, pid {os.getpid()}:",
+        line("threads", baseline.threads, now.threads),
+        line("fds", baseline.fds, now.fds),
+        line("rss", baseline.rss, now.rss, "KB"),
+        line("virtual memory", baseline.vm, now.vm, "KB"),
+        line("children rss", baseline.children_rss, now.children_rss, "KB") + f", {now.children} processes",
+    ]
+    if now.traced is not None:
+        lines.append(line("python allocated", baseline.traced or 0, now.traced, "KB"))
+        lines.extend(f"  {size / 1024:.0f}KB {site}" for site, size in now.top_allocations)
+    return "\n".join(lines)
@@ -0,0 +1,109 @@
+import logging
+import queue
+import socket
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Tuple
+
+from lobbyboy.exceptions import HandshakeTimeoutException
+from lobbyboy.socket_handle import SocketHandlerThread
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HandlerPoolStats:
+    # connections accepted by the pool, including the ones still waiting in queue.
+    accepted: int = 0
+    # connections waiting for a free worker right now.
+    queued: int = 0
+    # connections doing handshake right now.
+    handshaking: int = 0
+    # connections dropped because the queue is full.
+    rejected: int = 0
+    # connections dropped because they didn't open a shell before deadline.
+    timed_out: int = 0
+
+
+class HandlerPool:
+    """
+    A fixed number of workers do the handshake (ssh negotiation, auth and waiting for the shell request)
+    for the accepted connections, others wait in a bounded queue.
+
+    Once the client gets a shell, the session leaves the pool and keeps going in its own handler thread,
+    so users choosing servers or waiting for a new server won't hold a worker.
+    """
+
+    def __init__(
+        self,
+        handler_factory: Callable[[socket.socket, Tuple], SocketHandlerThread],
+        max_workers: int,
+        queue_size: int,
+        handshake_timeout: int,
+    ):
+        self.handler_factory = handler_factory
+        self.max_workers = max_workers
+        self.handshake_timeout = handshake_timeout
+        self._queue: "queue.Queue[Tuple[socket.socket, Tuple, float]]" = queue.Queue(maxsize=queue_size)
+        self._stats = HandlerPoolStats()
+        self._stats_lock = threading.Lock()
+
+    @property
+    def stats(self) -> HandlerPoolStats:
+        with self._stats_lock:
+            return HandlerPoolStats(**asdict(self._stats))
+
+    def start(self):
+        for idx in range(self.max_workers):
+            threading.Thread(target=self._work, name=f"handshake-worker-{idx}", daemon=True).start()
+        logger.info(f"started {self.max_workers} handshake workers, queue size: {self._queue.maxsize}.")
+
+    def submit(self, sock: socket.socket, address: Tuple) -> bool:
+        try:
+            self._queue.put_nowait((sock, address, time.monotonic() + self.handshake_timeout))
+        except queue.Full:
+            sock.close()
+            with self._stats_lock:
+                self._stats.rejected += 1
+            logger.warning(f"too many connections waiting for handshake, reject {address}, stats: {self.stats}")
+            return False
+        with self._stats_lock:
+            self._stats.accepted += 1
+            self._stats.queued += 1
+        return True
+
+    def _work(self):
+        while 1:
+            sock, address, deadline = self._queue.get()
+            with self._stats_lock:
+                self._stats.queued -= 1
+                self._stats.handshaking += 1
+            try:
+                self._handshake(sock, address, deadline)
+            except Exception:  # noqa
+                logger.critical(f"*** Handshake with {address} error.", exc_info=True)
+                sock.close()
+            finally:
+                with self._stats_lock:
+                    self._stats.handshaking -= 1
+
+    def _handshake(self, sock: socket.socket, address: Tuple, deadline: float):
+        if time.monotonic() >= deadline:
+            self._shed(sock, address, "in queue")
+            return
+
+        handler = self.handler_factory(sock, address)
+        try:
+            ready = handler.handshake(deadline)
+        except HandshakeTimeoutException as e:
+            self._shed(sock, address, str(e))
+            return
+        if ready:
+            handler.start()
+
+    def _shed(self, sock: socket.socket, address: Tuple, reason: str):
+        sock.close()
+        with self._stats_lock:
+            self._stats.timed_out += 1
+        logger.warning(f"connection {address} reached handshake deadline ({reason}), drop it, stats: {self.stats}")
@@ -0,0 +1,75 @@
+import logging
+import socket
+import threading
+from binascii import hexlify
+from io import StringIO
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+
+import paramiko
+from paramiko.transport import Transport
+
+from lobbyboy.utils import KeyTypeSupport, confirm_ssh_key_pair, file_signature
+
+logger = logging.getLogger(__name__)
+
+# host key file name and key class of every host key type we can serve.
+# Clients choose the host key from the ones we serve, ed25519 and ecdsa are much cheaper to sign with than rsa.
+HOST_KEYS: Dict[KeyTypeSupport, Tuple[str, Type[paramiko.PKey]]] = {
+    KeyTypeSupport.ED25519: ("ssh_host_ed25519_key", paramiko.Ed25519Key),
+    KeyTypeSupport.ECDSA: ("ssh_host_ecdsa_key", paramiko.ECDSAKey),
+    KeyTypeSupport.RSA: ("ssh_host_rsa_key", paramiko.RSAKey),
+}
+
+
+class HandshakeContext:
+    """
+    Things that every server ``Transport`` needs before handshake, they are prepared once per process:
+
+    - DH group exchange moduli, paramiko keeps them on the ``Transport`` class.
+    - parsed host keys of ``key_types``, they are re-read only when the key files change.
+    - the host name for GSS-API.
+    """
+
+    def __init__(self, data_dir: Path, key_types: Iterable[KeyTypeSupport] = tuple(HOST_KEYS)):
+        self.data_dir: Path = data_dir
+        self.key_types: List[KeyTypeSupport] = list(key_types)
+        self.gss_host: str = socket.getfqdn()
+        self.gex_supported: bool = Transport.load_server_moduli()
+        if not self.gex_supported:
+            logger.error("(Failed to load moduli -- gex will be unsupported.)")
+        self._lock = threading.Lock()
+        self._host_keys: List[paramiko.PKey] = []
+        self._host_keys_signature: Optional[Tuple] = None
+        self.host_keys()
+
+    def _signature(self) -> Tuple:
+        return tuple(file_signature(self.data_dir.joinpath(HOST_KEYS[key_type][0])) for key_type in self.key_types)
+
+    def host_keys(self) -> List[paramiko.PKey]:
+        """parsed host keys, costs only a few ``stat`` calls when key files are unchanged."""
+        signature = self._signature()
+        if signature == self._host_keys_signature:
+            return self._host_keys
+
+        with self._lock:
+            if signature != self._host_keys_signature:
+                self._load_host_keys()
+        return self._host_keys
+
+    def _load_host_keys(self):
+        host_keys = []
+        for key_type in self.key_types:
+            key_name, key_cls = HOST_KEYS[key_type]
+            pri, _ = confirm_ssh_key_pair(key_type=key_type, save_path=self.data_dir, key_name=key_name)
+            host_key = key_cls.from_private_key(StringIO(pri))
+            logger.info(f"Read host key {key_name}: " + hexlify(host_key.get_fingerprint()).decode())
+            host_keys.append(host_key)
+        # key files may be generated just now, take the signature after that.
+        self._host_keys_signature = self._signature()
+        self._host_keys = host_keys
+
+    def prepare(self, t: Transport):
+        t.set_gss_host(self.gss_host)
+        for host_key in self.host_keys():
+            t.add_server_key(host_key)
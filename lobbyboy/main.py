@@ -2,18 +2,31 @@
 
 import argparse
 import logging
+import os
+import resource
+import signal
 import socket
 import sys
 import threading
 import traceback
+from functools import partial
 from pathlib import Path
-from typing import Dict
+from typing import Callable, Dict
 
-from lobbyboy.config import LBConfig
+from lobbyboy import footprint
+from lobbyboy.config import LBConfig, LBConfigWatcher
+from lobbyboy.handler_pool import HandlerPool
+from lobbyboy.handshake import HandshakeContext
 from lobbyboy.provider import BaseProvider
+from lobbyboy.registry import server_registry
+from lobbyboy.relay import RelayEngine
 from lobbyboy.server_killer import ServerKiller
 from lobbyboy.socket_handle import SocketHandlerThread
-from lobbyboy.utils import confirm_ssh_key_pair, to_seconds
+from lobbyboy.spawner import spawner
+from lobbyboy.throttle import SourceThrottle, reject
+from lobbyboy.upstream import upstream_pool
+from lobbyboy.utils import to_seconds
+from lobbyboy.workers import WorkerSupervisor, share_session_counter
 
 # TODO generate all keys when start, if key not exist.
 # TODO fix server threading problems (no sleep!)
@@ -27,16 +40,18 @@ def setup_logs(level=logging.DEBUG):
     """send paramiko logs to a logfile,
     if they're not already going somewhere"""
 
-    frm = "%(levelname)-.3s [%(asctime)s.%(msecs)03d] thr=%(thread)d %(name)s:%(lineno)d: %(message)s"
+    frm = "%(levelname)-.3s [%(asctime)s.%(msecs)03d] pid=%(process)d thr=%(thread)d %(name)s:%(lineno)d: %(message)s"
     handler = logging.StreamHandler()
     handler.setFormatter(logging.Formatter(frm, "%Y%m%d-%H:%M:%S"))
     logging.basicConfig(level=level, handlers=[handler])
 
 
-def prepare_socket(listen_ip: str, listen_port: int) -> socket:
+def prepare_socket(listen_ip: str, listen_port: int, reuse_port: bool = False) -> socket:
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         logger.info("start listen on %s:%s...", listen_ip, listen_port)
         sock.bind((listen_ip, listen_port))
     except Exception as e:
@@ -54,21 +69,137 @@ def prepare_socket(listen_ip: str, listen_port: int) -> socket:
     return sock
 
 
-def runserver(sock: socket, conf: LBConfig, providers: Dict[str, BaseProvider]):
+def raise_fd_limit():
+    """every session holds a few fds (the user's socket, a pipe of the channel, the pty or upstream)."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        logger.info(f"raised open files limit from {soft} to {hard}.")
+
+
+def report_footprint_on_signal(relay: RelayEngine):
+    """log what the sessions of this process cost on SIGUSR1, compared with now (no session yet)."""
+    baseline = footprint.take(len(relay.sessions))
+
+    def report(signum, frame):
+        logger.info(footprint.report(baseline, footprint.take(len(relay.sessions))))
+
+    signal.signal(signal.SIGUSR1, report)
+
+
+def runserver(sock: socket, pool: HandlerPool, throttle: SourceThrottle):
     while 1:
         try:
             client, address = sock.accept()
         except Exception as e:
             logger.error(f"*** Accept new socket failed: {e}")
             continue
+        if not throttle.allow(address[0]):
+            # before anything else, a scanner or brute-forcer costs us only this.
+            reject(client)
+            logger.debug(f"reject connection from {address}, throttle stats: {throttle.stats}")
+            continue
         logger.info(f"get a connection, from address: {address}")
-        SocketHandlerThread(client, address, conf, providers).start()
+        pool.submit(client, address)
+
+
+def serve(
+    config: LBConfig, providers: Dict[str, BaseProvider], handshake_context: HandshakeContext, sock: socket = None
+):
+    """Accept and handle connections, in the main process, or in every worker process."""
+    if sock is None:
+        # every worker listens on the same port by itself, the kernel balances connections among them.
+        sock = prepare_socket(config.listen_ip, config.listen_port, reuse_port=True)
+
+    # All user sessions are relayed by this one thread.
+    relay = RelayEngine(
+        scrollback_size=config.detach_scrollback_size,
+        global_rate=config.bandwidth.global_rate,
+        global_burst=config.bandwidth.global_burst,
+        bulk_threshold=config.bandwidth.bulk_threshold,
+    )
+    relay.start()
+
+    if config.spawn_helper:
+        spawner.start()
+
+    # commands, scp and sftp always go through the pool, with or without ``splice_upstream``.
+    upstream_pool.idle_timeout = to_seconds(config.upstream_idle_timeout)
+    upstream_pool.start()
+
+    # Bans are shared with other worker processes via the bans file.
+    throttle = SourceThrottle(
+        max_connections=config.throttle.max_connections,
+        max_auth_failures=config.throttle.max_auth_failures,
+        window=to_seconds(config.throttle.window),
+        ban_time=to_seconds(config.throttle.ban_time),
+        max_addresses=config.throttle.max_addresses,
+        bans_file=config.bans_path,
+        trusted_addresses=config.throttle.trusted_addresses,
+    )
+
+    # Users and keys can be changed without restarting, connections read them from here.
+    config_watcher = LBConfigWatcher(config)
+    pool = HandlerPool(
+        handler_factory=partial(
+            SocketHandlerThread,
+            config_watcher=config_watcher,
+            providers=providers,
+            relay=relay,
+            handshake_context=handshake_context,
+            throttle=throttle,
+        ),
+        max_workers=config.max_handshakes,
+        queue_size=config.handshake_queue_size,
+        handshake_timeout=to_seconds(config.handshake_timeout),
+    )
+    pool.start()
+
+    report_footprint_on_signal(relay)
+    runserver(sock, pool, throttle)
+
+
+def run_workers(
+    workers: int,
+    cpu_affinity: bool,
+    config: LBConfig,
+    providers: Dict[str, BaseProvider],
+    handshake_context: HandshakeContext,
+    patrol: Callable[[], None],
+):
+    """Serve in ``workers`` processes, so ssh crypto of sessions runs on multiple CPUs."""
+    # Session counts must be the same in all workers and the killer.
+    share_session_counter()
+
+    sock = None
+    if not hasattr(socket, "SO_REUSEPORT"):
+        # all workers accept from the one socket inherited from here.
+        sock = prepare_socket(config.listen_ip, config.listen_port)
+
+    cpus = sorted(os.sched_getaffinity(0)) if cpu_affinity else []
+    supervisor = WorkerSupervisor()
+    supervisor.add("server-killer", patrol)
+    for idx in range(workers):
+        supervisor.add(
+            f"worker-{idx}",
+            partial(serve, config, providers, handshake_context, sock),
+            cpu=cpus[idx % len(cpus)] if cpus else None,
+        )
+    supervisor.run()
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", "--config", dest="config_path", help="config file path", required=True)
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1, help="number of worker processes, default 1 (no worker process)"
+    )
+    parser.add_argument(
+        "--cpu-affinity", action="store_true", help="pin every worker process to one CPU, for --workers > 1"
+    )
     args = parser.parse_args()
+    if args.cpu_affinity and not hasattr(os, "sched_setaffinity"):
+        parser.error("--cpu-affinity is not supported on this platform.")
 
     # Load config.
     config: LBConfig = LBConfig.load(Path(args.config_path))
@@ -84,22 +215,29 @@ def main():
 
     # Setup log.
     setup_logs(logging.getLevelName(config.log_level))
-    confirm_ssh_key_pair(config.data_dir, key_name="ssh_host_rsa_key")
+    # Before any thread is started.
+    if config.thread_stack_size:
+        threading.stack_size(config.thread_stack_size)
+    raise_fd_limit()
+    # Load moduli and host keys (generate them if not exist) once for all connections.
+    handshake_context = HandshakeContext(config.data_dir, config.host_key_type_list)
+
+    # Set killer.
+    killer = ServerKiller(providers, server_registry(config), config.detached_session_keeps_server)
+    patrol = partial(killer.patrol, to_seconds(config.min_destroy_interval))
+
+    if args.workers > 1:
+        run_workers(args.workers, args.cpu_affinity, config, providers, handshake_context, patrol)
+        return
 
     # Prepare socket.
     sock: socket = prepare_socket(config.listen_ip, config.listen_port)
 
-    # Set killer.
-    killer = ServerKiller(providers, config.servers_db_path)
-    killer_thread = threading.Thread(
-        target=killer.patrol,
-        args=(to_seconds(config.min_destroy_interval),),
-        daemon=True,
-    )
+    killer_thread = threading.Thread(target=patrol, daemon=True)
     killer_thread.start()
     logger.info(f"started server_killer thread: {killer_thread}")
 
-    runserver(sock, config, providers)
+    serve(config, providers, handshake_context, sock)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,64 @@
+import fcntl
+import gzip
+import json
+import logging
+import os
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from lobbyboy.utils import encoder_factory
+
+logger = logging.getLogger(__name__)
+
+# raw payloads of all servers of a provider, in the provider's workspace.
+PAYLOADS_FILE = "raw_servers.jsonl.gz"
+
+
+class PayloadStore:
+    """
+    Raw payloads of servers (what a vendor's SDK returns when the server is created), for audit.
+
+    All payloads of a provider are in one file, every payload is appended as a gzip member of its own, a JSON line
+    ``{"server_name": ..., "payload": ...}``. ``save`` returns where the payload is, ``[offset, size]``, for
+    ``load`` to read it alone, nothing is read until then. The whole file is still one gzip stream,
+    ``gzip -dc`` or ``export`` reads all payloads.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def save(self, server_name: str, payload: Dict) -> List[int]:
+        line = json.dumps({"server_name": server_name, "payload": payload}, default=encoder_factory()) + "\n"
+        data = gzip.compress(line.encode())
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            # worker processes append at the same time, the offset must be where this payload goes.
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            offset = os.fstat(fd).st_size
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        return [offset, len(data)]
+
+    def load(self, location: List[int]) -> Dict:
+        offset, size = location
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read(size)
+        # a gzip member, with header and trailer.
+        return json.loads(zlib.decompress(data, wbits=16 + zlib.MAX_WBITS))["payload"]
+
+    def export(self) -> Iterator[Tuple[str, Dict]]:
+        """(server_name, payload) of all payloads, in the order they were saved."""
+        if not self.path.exists():
+            return
+        with gzip.open(self.path, "rt") as f:
+            try:
+                for line in f:
+                    record = json.loads(line)
+                    yield record["server_name"], record["payload"]
+            except (EOFError, OSError, ValueError, KeyError) as e:
+                # the last payload may be torn by a crash.
+                logger.warning(f"stop reading {self.path} at an invalid payload: {e}")
@@ -6,13 +6,16 @@ import time
 from abc import ABC, abstractmethod
 from datetime import datetime
 from pathlib import Path
-from typing import Callable, Dict, List
+from typing import Any, Callable, Dict, List
 
 from paramiko.channel import Channel
 
 from lobbyboy.config import LBConfigProvider, LBServerMeta
-from lobbyboy.exceptions import NoAvailableNameException
+from lobbyboy.exceptions import NoAvailableNameException, ProviderException
+from lobbyboy.payloads import PAYLOADS_FILE, PayloadStore
+from lobbyboy.upstream import UpstreamAddress
 from lobbyboy.utils import KeyTypeSupport, confirm_ssh_key_pair, send_to_channel
+from lobbyboy.workspace import WorkspaceAllocator
 
 logger = logging.getLogger(__name__)
 SERVER_FILE = "server.json"
@@ -20,27 +23,29 @@ SERVER_FILE = "server.json"
 
 class BaseProvider(ABC):
     config = LBConfigProvider
+    # whether lobbyboy can ssh to servers of this provider by itself (see ``upstream_address``),
+    # set to False if the servers can only be reached via ``ssh_server_command``.
+    splice_capable: bool = True
 
     def __init__(self, name: str, config: LBConfigProvider, workspace: Path):
         self.name: str = name
         self.provider_config: LBConfigProvider = config
         self.workspace: Path = workspace
+        self.workspaces = WorkspaceAllocator(workspace)
+        self.payloads = PayloadStore(workspace.joinpath(PAYLOADS_FILE))
 
     def generate_default_server_name(self):
         server_name = datetime.now().strftime("%Y-%m-%d-%H%M")
         if self.provider_config.server_name_prefix:
             server_name = f"{self.provider_config.server_name_prefix}-{server_name}"
 
-        for suffix in ["", *string.ascii_lowercase]:
-            _server_name = f"{server_name}{suffix}"
-            server_workspace = self.workspace.joinpath(_server_name)
-            if not server_workspace.exists():
-                server_workspace.mkdir(parents=True)
-                return _server_name
-        raise NoAvailableNameException(f"{self.name}'s server {server_name}[a-z] already exist!")
+        allocated = self.workspaces.allocate(f"{server_name}{suffix}" for suffix in ["", *string.ascii_lowercase])
+        if allocated is None:
+            raise NoAvailableNameException(f"{self.name}'s server {server_name}[a-z] already exist!")
+        return allocated[0]
 
     def get_server_workspace(self, server_name: str) -> Path:
-        return self.workspace.joinpath(server_name)
+        return self.workspaces.workspace(server_name)
 
     @staticmethod
     def time_process_action(
@@ -99,6 +104,32 @@ class BaseProvider(ABC):
             logger.debug(f"load server data from {_path}")
             return json.load(f)
 
+    def save_payload(self, server_name: str, payload: Dict, **fields) -> Dict[str, Any]:
+        """
+        Keep the raw payload of a new server in ``payloads``.
+
+        Args:
+            server_name: the new server
+            payload: what the vendor's SDK returns, saved compressed, only read by ``load_payload``
+            fields: small fields to keep with the server, e.g. ``id=...`` for ``destroy_server``
+
+        Returns:
+            dict: ``provider_data`` of the server's ``LBServerMeta``
+        """
+        return {**fields, "payload": self.payloads.save(server_name, payload)}
+
+    def load_payload(self, meta: LBServerMeta) -> Dict:
+        """the raw payload of the server, from ``server.json`` in its workspace if it was saved there."""
+        if "payload" in meta.provider_data:
+            return self.payloads.load(meta.provider_data["payload"])
+        return self.load_raw_server(meta.workspace)
+
+    def provider_field(self, meta: LBServerMeta, name: str) -> Any:
+        """a field kept by ``save_payload``, servers created before that have it in their raw payload only."""
+        if name in meta.provider_data:
+            return meta.provider_data[name]
+        return self.load_payload(meta)[name]
+
     def is_available(self) -> bool:
         """
         Returns:
@@ -117,6 +148,43 @@ class BaseProvider(ABC):
         """
         ...
 
+    def create_server_from_template(self, channel: Channel, template: str) -> LBServerMeta:
+        """
+        Create a server without asking the user anything, for ``ssh provider+template@lobbyboy``.
+
+        Providers asking the user how to create a server should override this, see ``choose_template``.
+
+        Args:
+            channel: paramiko channel
+            template: the template given by user, may be empty
+
+        Returns:
+            LBServerMeta: server meta info
+        """
+        if template:
+            raise ProviderException(f"provider {self.name} has no templates, use `{self.name}+` instead.")
+        return self.create_server(channel)
+
+    @staticmethod
+    def choose_template(templates: List[str], template: str) -> str:
+        """
+        Args:
+            templates: favorite templates of the provider
+            template: one of ``templates``, or its number in the menu (starts from 1), the first one if empty
+
+        Returns:
+            str: the chosen template
+        """
+        if not template:
+            if not templates:
+                raise ProviderException("there are no favorite templates, please create the server with a shell.")
+            return templates[0]
+        if template.isdigit() and 1 <= int(template) <= len(templates):
+            return templates[int(template) - 1]
+        if template in templates:
+            return template
+        raise ProviderException(f"template {template} is not found, favorite templates: {', '.join(templates)}.")
+
     @abstractmethod
     def destroy_server(self, meta: LBServerMeta, channel: Channel = None) -> bool:
         """
@@ -169,6 +237,22 @@ class BaseProvider(ABC):
         logger.info(f"returning ssh command: {command}")
         return command
 
+    def upstream_address(self, meta: LBServerMeta) -> UpstreamAddress:
+        """
+        Returns:
+            UpstreamAddress: the address and key used to ssh to this server without ``ssh_server_command``.
+        """
+        return UpstreamAddress(
+            host=meta.server_host,
+            port=meta.server_port,
+            user=meta.server_user,
+            key_path=self.default_private_key_path(meta.workspace),
+        )
+
+    def can_splice(self, meta: LBServerMeta) -> bool:
+        # extra args like ``ProxyCommand`` are only understood by the ssh command.
+        return self.splice_capable and not meta.ssh_extra_args
+
     def get_bill(self): ...
 
     def check_command(self, command: List[str]) -> bool:
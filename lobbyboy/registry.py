@@ -0,0 +1,398 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, Iterator, Mapping, Optional
+from typing import OrderedDict as typeOrderedDict
+from typing import Set, Tuple
+
+from lobbyboy.config import (
+    LBConfig,
+    LBServerMeta,
+    load_local_servers,
+    save_local_servers,
+    servers_db_file_lock,
+    update_local_servers,
+)
+from lobbyboy.utils import atomic_write, encoder_factory
+
+logger = logging.getLogger(__name__)
+
+# seconds a writer waits for another process holding the write lock of the sqlite registry.
+SQLITE_BUSY_TIMEOUT = 30
+# ``PRAGMA user_version`` of the sqlite registry, 0 means the schema is not created yet.
+SQLITE_SCHEMA_VERSION = 1
+
+# the journal is compacted into the snapshot once it has this many records.
+JOURNAL_COMPACT_AFTER = 1000
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS servers (
+    server_name TEXT PRIMARY KEY,
+    provider_name TEXT NOT NULL,
+    created_timestamp INTEGER NOT NULL,
+    meta TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS servers_provider ON servers (provider_name, created_timestamp);
+CREATE INDEX IF NOT EXISTS servers_created ON servers (created_timestamp);
+"""
+
+
+class ServerRegistry(Mapping[str, LBServerMeta], ABC):
+    """
+    The servers lobbyboy knows, shared by all worker processes and the server killer.
+
+    A registry is a read-only mapping of server name -> ``LBServerMeta``, in the order the servers were added,
+    changed by ``add`` and ``remove``.
+    """
+
+    @abstractmethod
+    def servers(
+        self, provider_name: Optional[str] = None, created_until: Optional[int] = None
+    ) -> typeOrderedDict[str, LBServerMeta]:
+        """
+        Args:
+            provider_name: only servers of this provider if given.
+            created_until: only servers created at or before this timestamp if given.
+        """
+        ...
+
+    @abstractmethod
+    def get(self, server_name: str, default: Optional[LBServerMeta] = None) -> Optional[LBServerMeta]:
+        """the server of the name, ``default`` if there is none."""
+        ...
+
+    @abstractmethod
+    def add(self, meta: LBServerMeta):
+        """add a server, or replace the one of the same name."""
+        ...
+
+    @abstractmethod
+    def remove(self, meta: LBServerMeta):
+        """remove the server of the same name, nothing happens if there is none."""
+        ...
+
+    def provider_names(self) -> Set[str]:
+        """providers having servers."""
+        return {meta.provider_name for meta in self.servers().values()}
+
+    def __getitem__(self, server_name: str) -> LBServerMeta:
+        meta = self.get(server_name)
+        if meta is None:
+            raise KeyError(server_name)
+        return meta
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.servers())
+
+    def __len__(self) -> int:
+        return len(self.servers())
+
+
+class JsonServerRegistry(ServerRegistry):
+    """All servers in one JSON file, every read parses the whole file and every change writes it again."""
+
+    def __init__(self, servers_db_path: Path):
+        self.servers_db_path = servers_db_path
+        # the file lock of ``update_local_servers`` is for processes, threads of one process take this one as well.
+        self._lock = threading.Lock()
+
+    def servers(
+        self, provider_name: Optional[str] = None, created_until: Optional[int] = None
+    ) -> typeOrderedDict[str, LBServerMeta]:
+        servers = load_local_servers(self.servers_db_path)
+        if provider_name is None and created_until is None:
+            return servers
+        return OrderedDict(
+            (name, meta)
+            for name, meta in servers.items()
+            if (provider_name is None or meta.provider_name == provider_name)
+            and (created_until is None or meta.created_timestamp <= created_until)
+        )
+
+    def get(self, server_name: str, default: Optional[LBServerMeta] = None) -> Optional[LBServerMeta]:
+        return self.servers().get(server_name, default)
+
+    def add(self, meta: LBServerMeta):
+        with self._lock:
+            update_local_servers(self.servers_db_path, new=[meta])
+
+    def remove(self, meta: LBServerMeta):
+        with self._lock:
+            update_local_servers(self.servers_db_path, deleted=[meta])
+
+
+class SQLiteServerRegistry(ServerRegistry):
+    """
+    Servers in a sqlite database in WAL mode, looked up by the indexes on name, provider and creation time.
+
+    Readers never block on writers and never wait for each other, writers of all processes take turns.
+    Every thread of every process has its own connection. The first process opening the database creates it,
+    importing the servers of the JSON registry (``servers_file``) if there is one, the JSON file is left as it is.
+    """
+
+    def __init__(self, db_path: Path, json_path: Optional[Path] = None):
+        self.db_path = db_path
+        self.json_path = json_path
+        self._local = threading.local()
+        # connections of the parent process of a forked worker, they must not be used or closed by the worker.
+        self._inherited = []
+        self._prepare()
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        pid_connection: Optional[Tuple[int, sqlite3.Connection]] = getattr(self._local, "connection", None)
+        if pid_connection is None or pid_connection[0] != os.getpid():
+            if pid_connection is not None:
+                self._inherited.append(pid_connection[1])
+            connection = sqlite3.connect(str(self.db_path), timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # in WAL mode, the last commits may be lost on power failure but the database is never corrupted.
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = pid_connection = (os.getpid(), connection)
+        return pid_connection[1]
+
+    def _prepare(self):
+        connection = self._connection
+        if connection.execute("PRAGMA user_version").fetchone()[0] == SQLITE_SCHEMA_VERSION:
+            return
+        # other processes may start at the same time, only one of them creates the schema and migrates.
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if connection.execute("PRAGMA user_version").fetchone()[0] != SQLITE_SCHEMA_VERSION:
+                for statement in SQLITE_SCHEMA.split(";"):
+                    if statement.strip():
+                        connection.execute(statement)
+                migrated = self._migrate(connection)
+                connection.execute(f"PRAGMA user_version = {SQLITE_SCHEMA_VERSION}")
+                if migrated:
+                    logger.info(f"{migrated} servers of {self.json_path} have been imported into {self.db_path}.")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _migrate(self, connection: sqlite3.Connection) -> int:
+        if self.json_path is None or not self.json_path.exists():
+            return 0
+        servers = load_local_servers(self.json_path)
+        connection.executemany(
+            "INSERT OR IGNORE INTO servers VALUES (?, ?, ?, ?)", [self._row(meta) for meta in servers.values()]
+        )
+        return len(servers)
+
+    @staticmethod
+    def _row(meta: LBServerMeta) -> Tuple[str, str, int, str]:
+        content = json.dumps(asdict(meta), default=encoder_factory())
+        return meta.server_name, meta.provider_name, meta.created_timestamp, content
+
+    @staticmethod
+    def _meta(content: str) -> LBServerMeta:
+        return LBServerMeta(**json.loads(content))
+
+    def servers(
+        self, provider_name: Optional[str] = None, created_until: Optional[int] = None
+    ) -> typeOrderedDict[str, LBServerMeta]:
+        conditions, params = [], []
+        if provider_name is not None:
+            conditions.append("provider_name = ?")
+            params.append(provider_name)
+        if created_until is not None:
+            conditions.append("created_timestamp <= ?")
+            params.append(created_until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._connection.execute(f"SELECT server_name, meta FROM servers {where} ORDER BY rowid", params)
+        return OrderedDict((name, self._meta(content)) for name, content in rows)
+
+    def get(self, server_name: str, default: Optional[LBServerMeta] = None) -> Optional[LBServerMeta]:
+        row = self._connection.execute("SELECT meta FROM servers WHERE server_name = ?", (server_name,)).fetchone()
+        return self._meta(row[0]) if row else default
+
+    def add(self, meta: LBServerMeta):
+        # keep the rowid of a replaced server, so it stays where it was in the order.
+        self._connection.execute(
+            "INSERT INTO servers VALUES (?, ?, ?, ?) ON CONFLICT (server_name) DO UPDATE SET "
+            "provider_name = excluded.provider_name, created_timestamp = excluded.created_timestamp, "
+            "meta = excluded.meta",
+            self._row(meta),
+        )
+
+    def remove(self, meta: LBServerMeta):
+        self._connection.execute("DELETE FROM servers WHERE server_name = ?", (meta.server_name,))
+
+    def provider_names(self) -> Set[str]:
+        return {name for (name,) in self._connection.execute("SELECT DISTINCT provider_name FROM servers")}
+
+    def __contains__(self, server_name) -> bool:
+        row = self._connection.execute("SELECT 1 FROM servers WHERE server_name = ?", (server_name,)).fetchone()
+        return row is not None
+
+    def __iter__(self) -> Iterator[str]:
+        rows = self._connection.execute("SELECT server_name FROM servers ORDER BY rowid").fetchall()
+        return (name for (name,) in rows)
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM servers").fetchone()[0]
+
+
+class JournalServerRegistry(ServerRegistry):
+    """
+    All servers in memory, shared by every thread, changes are appended to a journal.
+
+    A change is one line of JSON appended to ``<servers_file>.journal``, ``{"add": <meta>}`` or
+    ``{"remove": <server name>}``. Once the journal has ``compact_after`` records, all servers are written to
+    ``servers_file`` (the snapshot, in the format of the JSON registry) and the journal is started again.
+
+    Other processes append to the same journal, a read applies their records first, it costs a ``stat`` when
+    there are none. A process rebuilds its servers from the snapshot and the journal when it starts, or when
+    another process has compacted the journal. A record torn by a crash at the end of the journal is truncated.
+    """
+
+    def __init__(self, servers_db_path: Path, compact_after: int = JOURNAL_COMPACT_AFTER):
+        self.servers_db_path = servers_db_path
+        self.journal_path = servers_db_path.with_name(f"{servers_db_path.name}.journal")
+        self.compact_after = compact_after
+        self._servers: typeOrderedDict[str, LBServerMeta] = OrderedDict()
+        self._journal_fd: Optional[int] = None
+        self._journal_inode: Optional[int] = None
+        # bytes of the journal applied, always the end of a record, and how many records they are.
+        self._offset = 0
+        self._records = 0
+        self._lock = threading.RLock()
+        with self._lock, servers_db_file_lock(self.servers_db_path):
+            self._load()
+
+    def _load(self):
+        """rebuild from the snapshot and the journal, with ``servers_db_file_lock`` held."""
+        self._servers = load_local_servers(self.servers_db_path) if self.servers_db_path.exists() else OrderedDict()
+        self._open_journal()
+        self._follow(repair=True)
+
+    def _open_journal(self):
+        if self._journal_fd is not None:
+            os.close(self._journal_fd)
+        self._journal_fd = os.open(self.journal_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._journal_inode = os.fstat(self._journal_fd).st_ino
+        self._offset = self._records = 0
+
+    def _follow(self, repair: bool = False):
+        """
+        Apply the records appended since last time.
+
+        Args:
+            repair: truncate a record without its newline at the end of the journal, torn by a crash, only with
+                ``servers_db_file_lock`` held, when no other process can be writing a record.
+
+        Complete records which can't be read are skipped, the records after them are still applied.
+        """
+        size = os.fstat(self._journal_fd).st_size
+        if size == self._offset:
+            return
+        data = os.pread(self._journal_fd, size - self._offset, self._offset)
+        # a record being written by another process has no newline yet.
+        complete = data[: data.rfind(b"\n") + 1]
+        for line in complete.splitlines(keepends=True):
+            try:
+                self._apply(json.loads(line))
+            except (ValueError, TypeError, KeyError) as e:
+                logger.error(f"skip invalid record of {self.journal_path} at {self._offset}: {e}")
+            self._offset += len(line)
+            self._records += 1
+        if repair and self._offset < size:
+            logger.warning(f"truncate {size - self._offset} bytes of a torn record at the end of {self.journal_path}.")
+            os.ftruncate(self._journal_fd, self._offset)
+
+    def _apply(self, record: Dict):
+        if "add" in record:
+            meta = LBServerMeta(**record["add"])
+            self._servers[meta.server_name] = meta
+        else:
+            self._servers.pop(record["remove"], None)
+
+    def _refresh(self, repair: bool = False):
+        try:
+            inode = os.stat(self.journal_path).st_ino
+        except FileNotFoundError:
+            inode = None
+        if inode == self._journal_inode:
+            self._follow(repair)
+        elif repair:
+            self._load()
+        else:
+            # compacted by another process.
+            with servers_db_file_lock(self.servers_db_path):
+                self._load()
+
+    def _append(self, record: Dict):
+        with self._lock, servers_db_file_lock(self.servers_db_path):
+            self._refresh(repair=True)
+            line = json.dumps(record, default=encoder_factory()).encode() + b"\n"
+            os.write(self._journal_fd, line)
+            self._offset += len(line)
+            self._records += 1
+            self._apply(record)
+            if self._records >= self.compact_after:
+                self._compact()
+
+    def _compact(self):
+        """with ``servers_db_file_lock`` held, records replayed again after a crash here change nothing."""
+        save_local_servers(self.servers_db_path, self._servers)
+        atomic_write(self.journal_path, "")
+        self._open_journal()
+        logger.info(f"journal of {self.servers_db_path} compacted, {len(self._servers)} servers.")
+
+    def servers(
+        self, provider_name: Optional[str] = None, created_until: Optional[int] = None
+    ) -> typeOrderedDict[str, LBServerMeta]:
+        with self._lock:
+            self._refresh()
+            return OrderedDict(
+                (name, meta)
+                for name, meta in self._servers.items()
+                if (provider_name is None or meta.provider_name == provider_name)
+                and (created_until is None or meta.created_timestamp <= created_until)
+            )
+
+    def get(self, server_name: str, default: Optional[LBServerMeta] = None) -> Optional[LBServerMeta]:
+        with self._lock:
+            self._refresh()
+            return self._servers.get(server_name, default)
+
+    def add(self, meta: LBServerMeta):
+        self._append({"add": asdict(meta)})
+
+    def remove(self, meta: LBServerMeta):
+        self._append({"remove": meta.server_name})
+
+    def __contains__(self, server_name) -> bool:
+        return self.get(server_name) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._servers)
+
+
+_registries: Dict[Tuple[str, Path], ServerRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def server_registry(config: LBConfig) -> ServerRegistry:
+    """the registry of ``servers_backend``, one per process, shared by every connection."""
+    key = (config.servers_backend, config.servers_db_path)
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            if config.servers_backend == "sqlite":
+                registry = SQLiteServerRegistry(config.servers_db_path.with_suffix(".sqlite3"), config.servers_db_path)
+            elif config.servers_backend == "journal":
+                registry = JournalServerRegistry(config.servers_db_path)
+            else:
+                registry = JsonServerRegistry(config.servers_db_path)
+            _registries[key] = registry
+    return registry
@@ -0,0 +1,715 @@
+import errno
+import logging
+import os
+import selectors
+import signal
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import partial
+from subprocess import Popen, TimeoutExpired
+from typing import Callable, Deque, Dict, Optional, Set
+
+from paramiko.channel import Channel
+
+from lobbyboy.bandwidth import DEFAULT_BULK_THRESHOLD, TokenBucket, TrafficMeter
+
+logger = logging.getLogger(__name__)
+
+# how many bytes we try to read from one endpoint at a time, at first, and at least.
+DEFAULT_READ_SIZE = 10240
+# reads grow up to this size while they keep filling what is asked for, one ssh packet of the default size.
+DEFAULT_MAX_READ_SIZE = 32 * 1024
+# stop reading from one side when the other side has this many bytes not written yet.
+DEFAULT_MAX_PENDING = 256 * 1024
+# paramiko channels have no writable fd to poll, so stalled sends are retried on this interval (seconds).
+CHANNEL_SEND_RETRY_INTERVAL = 0.02
+# how long we wait for the proxy process to exit after hanging up its terminal (seconds).
+PROCESS_EXIT_TIMEOUT = 5
+# bytes of the server's output kept for a detached session, the user sees them when they come back.
+DEFAULT_SCROLLBACK_SIZE = 64 * 1024
+# how long a handler thread waits for the relay thread to reattach its session (seconds).
+REATTACH_TIMEOUT = 10
+
+
+class RelayEndpoint:
+    """
+    One side of a relayed session.
+
+    ``read`` returns ``None`` when there is nothing to read right now and ``b""`` on EOF,
+    ``write`` returns how many bytes were accepted (maybe 0), it takes any bytes-like object.
+    """
+
+    __slots__ = ()
+    # whether the readiness of writing can be polled from ``fileno``
+    poll_writable = False
+    # whether reads grow and shrink with what the endpoint has, see ``RelayEngine``.
+    adaptive_reads = True
+
+    def fileno(self) -> int:
+        raise NotImplementedError
+
+    def read(self, size: int) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def read_into(self, buf: memoryview) -> Optional[memoryview]:
+        """
+        Like ``read``, returns the bytes read as a view, ``None`` or an empty view on EOF.
+
+        Endpoints that can read into ``buf`` return a slice of it, the others return a view of what they read.
+        """
+        data = self.read(len(buf))
+        return None if data is None else memoryview(data)
+
+    def write(self, data: bytes) -> int:
+        raise NotImplementedError
+
+    def read_stderr(self, size: int) -> Optional[bytes]:
+        """for endpoints having a separate stderr stream, e.g. a command running on the server."""
+        return None
+
+    def write_stderr(self, data: bytes) -> int:
+        raise NotImplementedError
+
+    def shutdown_write(self):
+        """tell the other end that there is nothing more to write, used by half-closed sessions."""
+        pass
+
+    def is_closed(self) -> bool:
+        """whether the endpoint has gone, not only reached EOF."""
+        return False
+
+    def close(self):
+        pass
+
+
+class PtyEndpoint(RelayEndpoint):
+    """
+    The master side of a PTY, whose slave side is used by the proxy process,
+    a ``Popen`` or a ``SpawnedProcess`` of ``lobbyboy.spawner``.
+    """
+
+    __slots__ = ("master_fd", "process")
+    poll_writable = True
+    # the kernel hands out at most 4KB of a pty per read, reading more at a time only costs the bookkeeping.
+    adaptive_reads = False
+
+    def __init__(self, master_fd: int, process: Popen):
+        self.master_fd = master_fd
+        self.process = process
+        os.set_blocking(master_fd, False)
+
+    def fileno(self) -> int:
+        return self.master_fd
+
+    def read(self, size: int) -> Optional[bytes]:
+        try:
+            return os.read(self.master_fd, size)
+        except BlockingIOError:
+            return None
+        except OSError as e:
+            # EIO: every process on the slave side has gone.
+            if e.errno != errno.EIO:
+                logger.warning(f"read from pty {self.master_fd} failed: {e}")
+            return b""
+
+    def read_into(self, buf: memoryview) -> Optional[memoryview]:
+        try:
+            return buf[: os.readv(self.master_fd, [buf])]
+        except BlockingIOError:
+            return None
+        except OSError as e:
+            if e.errno != errno.EIO:
+                logger.warning(f"read from pty {self.master_fd} failed: {e}")
+            return buf[:0]
+
+    def write(self, data: bytes) -> int:
+        try:
+            return os.write(self.master_fd, data)
+        except BlockingIOError:
+            return 0
+
+    def close(self):
+        if self.process.poll() is None:
+            logger.info(f"hang up proxy process {self.process.pid}...")
+            try:
+                os.killpg(self.process.pid, signal.SIGHUP)
+                self.process.wait(PROCESS_EXIT_TIMEOUT)
+            except ProcessLookupError:
+                pass
+            except TimeoutExpired:
+                logger.warning(f"proxy process {self.process.pid} ignored SIGHUP, kill it.")
+                os.killpg(self.process.pid, signal.SIGKILL)
+                self.process.wait()
+        os.close(self.master_fd)
+
+
+class ChannelEndpoint(RelayEndpoint):
+    __slots__ = ("channel",)
+
+    def __init__(self, channel: Channel):
+        self.channel = channel
+        self.channel.settimeout(0.0)
+
+    def fileno(self) -> int:
+        return self.channel.fileno()
+
+    def read(self, size: int) -> Optional[bytes]:
+        try:
+            return self.channel.recv(size)
+        except socket.timeout:
+            return None
+        except OSError:
+            return b""
+
+    def write(self, data: bytes) -> int:
+        try:
+            return self.channel.send(data)
+        except socket.timeout:
+            return 0
+
+    def write_stderr(self, data: bytes) -> int:
+        try:
+            return self.channel.send_stderr(data)
+        except socket.timeout:
+            return 0
+
+    def shutdown_write(self):
+        self.channel.shutdown_write()
+
+    def is_closed(self) -> bool:
+        return self.channel.closed
+
+    def close(self):
+        # give the channel back to the blocking world, lobbyboy may still talk to user via it.
+        self.channel.settimeout(None)
+
+
+class RelaySession:
+    """
+    Bytes from ``downstream`` (the user) are written to ``upstream`` (the server), and vice versa.
+
+    A ``half_close`` session (a command running on the server) keeps going after the user's EOF, the EOF is
+    passed on to the server, and the session ends when the server side reaches EOF. The stderr of
+    ``upstream`` is relayed to the stderr of ``downstream`` as well.
+
+    A session with ``on_detach`` is detached instead of closed when the user has gone: ``upstream`` is kept,
+    its latest output is kept as scrollback, until the session is ``reattach``-ed to a new ``downstream``
+    or closed by ``RelayEngine.close``.
+
+    Bytes read from ``upstream`` are taken from ``limiter`` if given, see ``lobbyboy.bandwidth``. What the user
+    sends is never held back, a throttled ``cat`` can still be stopped by Ctrl-C.
+    """
+
+    __slots__ = (
+        "downstream",
+        "upstream",
+        "on_close",
+        "pending",
+        "stderr",
+        "half_close",
+        "read_eof",
+        "write_shut",
+        "on_detach",
+        "detached",
+        "limiter",
+        "meter",
+        "throttled",
+        "read_sizes",
+        "eof",
+        "last_activity",
+    )
+
+    def __init__(
+        self,
+        downstream: ChannelEndpoint,
+        upstream: RelayEndpoint,
+        on_close: Callable[["RelaySession"], None] = None,
+        half_close: bool = False,
+        on_detach: Callable[["RelaySession"], None] = None,
+        limiter: Optional[TokenBucket] = None,
+    ):
+        self.downstream = downstream
+        self.upstream = upstream
+        self.on_close = on_close
+        # bytes waiting to be written to the endpoint
+        self.pending: Dict[RelayEndpoint, bytearray] = {downstream: bytearray(), upstream: bytearray()}
+        # stderr bytes of upstream waiting to be written to downstream
+        self.stderr = bytearray()
+        self.half_close = half_close
+        # endpoints we have got EOF from, but the session is still going.
+        self.read_eof: Set[RelayEndpoint] = set()
+        # endpoints we have passed the EOF on to.
+        self.write_shut: Set[RelayEndpoint] = set()
+        self.on_detach = on_detach
+        self.detached = False
+        self.limiter = limiter
+        self.meter = TrafficMeter()
+        # how many times the session has been held back by the session or global limit.
+        self.throttled = 0
+        # how many bytes to read from the endpoint at a time, adapted to how much it has to give.
+        self.read_sizes: Dict[RelayEndpoint, int] = {}
+        self.eof = False
+        # time.monotonic() when bytes were relayed last time.
+        self.last_activity = time.monotonic()
+
+    def peer(self, endpoint: RelayEndpoint) -> RelayEndpoint:
+        return self.upstream if endpoint is self.downstream else self.downstream
+
+    @property
+    def last_active_at(self) -> float:
+        """time.time() based ``last_activity``, to be compared across processes."""
+        return time.time() - (time.monotonic() - self.last_activity)
+
+
+class RelayEngine(threading.Thread):
+    """
+    A single thread relays every session, it only wakes up when some fd is ready.
+
+    The handler thread hands its session off by ``attach`` and exits, when one side of the session
+    reaches EOF, the session is closed in a short-lived thread and ``on_close`` is called from there.
+
+    Sessions moving more than ``bulk_threshold`` bytes per second recently are bulk sessions, the others
+    (typing, full-screen programs) are interactive ones. Interactive sessions are relayed first in every round,
+    and only bulk sessions are held back when all sessions together exceed ``global_rate``.
+
+    Bytes are read into one buffer of the engine and written to the other side from there, only what the other
+    side can not take right now is copied to the pending buffer of the session. Reads of an endpoint double
+    while they fill what is asked for, up to ``max_read_size``, and halve when they return much less,
+    PTYs are always read ``read_size`` at a time.
+    """
+
+    def __init__(
+        self,
+        read_size: int = DEFAULT_READ_SIZE,
+        max_read_size: int = DEFAULT_MAX_READ_SIZE,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        scrollback_size: int = DEFAULT_SCROLLBACK_SIZE,
+        global_rate: int = 0,
+        global_burst: int = 0,
+        bulk_threshold: int = DEFAULT_BULK_THRESHOLD,
+    ):
+        super().__init__(name="relay-engine", daemon=True)
+        self.read_size = read_size
+        self.max_read_size = max(max_read_size, read_size)
+        # every read goes here first, sessions are relayed one at a time by the relay thread.
+        self._read_buffer = memoryview(bytearray(self.max_read_size))
+        self.max_pending = max_pending
+        self.scrollback_size = scrollback_size
+        self.global_limiter = TokenBucket(global_rate, global_burst)
+        self.bulk_threshold = bulk_threshold
+        # how many times sessions have been held back, by their own limit or the global one.
+        self.throttle_counts: Dict[str, int] = {"session": 0, "global": 0}
+        # sessions not read from until the time (time.monotonic() based).
+        self._throttled: Dict[RelaySession, float] = {}
+        self._selector = selectors.DefaultSelector()
+        # sessions are changed by the relay thread only, other threads ask it to do so from here.
+        self._incoming: Deque[Callable[[], None]] = deque()
+        self._stalled: Set[RelaySession] = set()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self.sessions: Set[RelaySession] = set()
+
+    def attach(self, session: RelaySession):
+        self._call_soon(partial(self._attach, session))
+
+    def reattach(
+        self,
+        session: RelaySession,
+        downstream: ChannelEndpoint,
+        on_close: Callable[[RelaySession], None] = None,
+        on_detach: Callable[[RelaySession], None] = None,
+        typed_ahead: bytes = b"",
+    ) -> bool:
+        """
+        Resume a detached session with a new user channel, the scrollback is written to it first,
+        ``typed_ahead`` (what the user has sent after the menus) is written to the upstream.
+
+        Returns:
+            bool: False if the session has been closed, e.g. the server has gone, nothing is changed then.
+
+        Raises:
+            TimeoutError: the relay thread has not done it in ``REATTACH_TIMEOUT`` seconds, nothing is changed then.
+        """
+        if not self.is_alive():
+            raise TimeoutError("relay engine is not running")
+        result = Future()
+
+        def run():
+            # the handler thread has given up waiting.
+            if not result.set_running_or_notify_cancel():
+                return
+            try:
+                result.set_result(self._reattach(session, downstream, on_close, on_detach, typed_ahead))
+            except Exception as e:  # noqa
+                result.set_exception(e)
+
+        self._call_soon(run)
+        try:
+            return result.result(REATTACH_TIMEOUT)
+        except FutureTimeoutError:
+            if result.cancel():
+                raise TimeoutError(f"relay engine did not reattach the session in {REATTACH_TIMEOUT} seconds")
+            # the relay thread is reattaching it right now.
+            return result.result()
+
+    def close(self, session: RelaySession):
+        self._call_soon(partial(self._close, session))
+
+    def _call_soon(self, call: Callable[[], None]):
+        self._incoming.append(call)
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except BlockingIOError:
+            # the pipe is full, relay thread will wake up anyway.
+            pass
+
+    def run(self):
+        logger.info("relay engine started.")
+        while 1:
+            try:
+                self.poll()
+            except Exception:  # noqa
+                logger.critical("*** relay engine error.", exc_info=True)
+
+    def poll(self):
+        timeout = CHANNEL_SEND_RETRY_INTERVAL if self._stalled else None
+        if self._throttled:
+            wait = max(min(self._throttled.values()) - time.monotonic(), 0)
+            timeout = wait if timeout is None else min(timeout, wait)
+        events = self._selector.select(timeout)
+        if len(events) > 1:
+            now = time.monotonic()
+            events.sort(key=lambda event: event[0].data is not None and self._is_bulk(event[0].data[0], now))
+        for key, _ in events:
+            if key.fd == self._wakeup_r:
+                self._accept_incoming()
+                continue
+            session, endpoint = key.data
+            if session.eof:
+                continue
+            self._transfer(session, endpoint)
+
+        if self._throttled:
+            now = time.monotonic()
+            for session, until in list(self._throttled.items()):
+                if until <= now:
+                    del self._throttled[session]
+                    self._update_interest(session)
+
+        for session in list(self._stalled):
+            if not session.eof:
+                self._flush(session, session.downstream)
+                self._flush(session, session.upstream)
+                self._flush_stderr(session)
+                self._update_interest(session)
+
+    def _accept_incoming(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self._incoming:
+            self._incoming.popleft()()
+
+    def _attach(self, session: RelaySession):
+        self.sessions.add(session)
+        self._update_interest(session)
+        logger.info(f"relay engine attached a new session, {len(self.sessions)} sessions now.")
+
+    def _detach(self, session: RelaySession):
+        """the user has gone, keep the upstream and its output until the user comes back."""
+        if session.detached:
+            return
+        session.detached = True
+        try:
+            self._selector.unregister(session.downstream)
+        except KeyError:
+            pass
+        self._trim_scrollback(session)
+        self._update_interest(session)
+        logger.info(f"relay session detached, {len(self.sessions)} sessions now.")
+        threading.Thread(target=session.on_detach, args=(session,), name="relay-detach", daemon=True).start()
+
+    def _reattach(
+        self,
+        session: RelaySession,
+        downstream: ChannelEndpoint,
+        on_close: Callable[[RelaySession], None],
+        on_detach: Callable[[RelaySession], None],
+        typed_ahead: bytes,
+    ) -> bool:
+        if session.eof:
+            return False
+        session.pending[session.upstream].extend(typed_ahead)
+        scrollback = session.pending.pop(session.downstream)
+        session.read_sizes.pop(session.downstream, None)
+        session.downstream = downstream
+        session.pending[downstream] = scrollback
+        session.on_close, session.on_detach = on_close, on_detach
+        session.detached = False
+        logger.info(f"relay session reattached, with {len(scrollback)} bytes of scrollback.")
+        self._flush(session, downstream)
+        self._update_interest(session)
+        return True
+
+    def _trim_scrollback(self, session: RelaySession):
+        scrollback = session.pending[session.downstream]
+        if len(scrollback) > self.scrollback_size:
+            del scrollback[: len(scrollback) - self.scrollback_size]
+
+    def _transfer(self, session: RelaySession, endpoint: RelayEndpoint):
+        if endpoint is not session.upstream and (session.detached or endpoint is not session.downstream):
+            # the user's channel has gone, events of it in the same round are stale.
+            return
+        if session.pending[endpoint] and endpoint.poll_writable:
+            self._flush(session, endpoint)
+            if session.eof:
+                return
+
+        size = self._allowance(session, endpoint)
+        if not size:
+            self._update_interest(session)
+            return
+        peer = session.peer(endpoint)
+        if endpoint is session.upstream and len(session.stderr) < self.max_pending:
+            data = endpoint.read_stderr(size)
+            if data:
+                self._account(session, len(data), limited=True)
+                session.stderr.extend(data)
+                self._flush_stderr(session)
+                if session.eof:
+                    return
+        if endpoint not in session.read_eof and len(session.pending[peer]) < self.max_pending:
+            data = endpoint.read_into(self._read_buffer[:size])
+            if data is not None and not data:
+                if session.half_close and endpoint is session.downstream and not endpoint.is_closed():
+                    # the user has sent everything, e.g. the end of a file to upload, the command goes on.
+                    session.read_eof.add(endpoint)
+                    self._flush(session, peer)
+                elif session.on_detach and endpoint is session.downstream:
+                    self._detach(session)
+                    return
+                else:
+                    self._close(session)
+                    return
+            elif data:
+                self._account(session, len(data), limited=endpoint is session.upstream)
+                self._forward(session, peer, data)
+                if session.eof:
+                    return
+                self._adapt_read_size(session, endpoint, len(data))
+        self._update_interest(session)
+
+    def _is_bulk(self, session: RelaySession, now: float) -> bool:
+        return session.meter.rate(now) > self.bulk_threshold
+
+    def _allowance(self, session: RelaySession, endpoint: RelayEndpoint) -> int:
+        """how many bytes can be read from the endpoint of the session now, 0 if it is throttled."""
+        now = time.monotonic()
+        size = session.read_sizes.get(endpoint, self.read_size)
+        if endpoint is session.downstream:
+            return size
+        if session.limiter is not None:
+            tokens = session.limiter.allowance(now)
+            if not tokens:
+                return self._throttle(session, "session", now + session.limiter.wait_time(now))
+            size = min(size, int(tokens))
+        if not self.global_limiter.unlimited and self._is_bulk(session, now):
+            tokens = self.global_limiter.allowance(now)
+            if not tokens:
+                return self._throttle(session, "global", now + self.global_limiter.wait_time(now))
+            size = min(size, int(tokens))
+        return size
+
+    def _adapt_read_size(self, session: RelaySession, endpoint: RelayEndpoint, nbytes: int):
+        """read more at a time while both sides keep up, less when the endpoint has less or the peer falls behind."""
+        if not endpoint.adaptive_reads:
+            return
+        size = session.read_sizes.get(endpoint, self.read_size)
+        if session.pending[session.peer(endpoint)] or nbytes < size // 4:
+            size = max(size // 2, self.read_size)
+        elif nbytes >= size:
+            size = min(size * 2, self.max_read_size)
+        session.read_sizes[endpoint] = size
+
+    def _throttle(self, session: RelaySession, reason: str, until: float) -> int:
+        self._throttled[session] = until
+        session.throttled += 1
+        self.throttle_counts[reason] += 1
+        return 0
+
+    def _account(self, session: RelaySession, nbytes: int, limited: bool):
+        """``limited`` for bytes of the server, the user's bytes only tell whether the session is bulk."""
+        now = time.monotonic()
+        session.last_activity = now
+        session.meter.add(nbytes, now)
+        if not limited:
+            return
+        if session.limiter is not None:
+            session.limiter.consume(nbytes, now)
+        # interactive bytes count as well, so bulk sessions get what is left.
+        self.global_limiter.consume(nbytes, now)
+
+    def _forward(self, session: RelaySession, endpoint: RelayEndpoint, data: memoryview):
+        """
+        Write ``data`` to the endpoint right away, only what it can not take now is copied to its pending buffer.
+        """
+        buf = session.pending[endpoint]
+        if not buf and not (session.detached and endpoint is session.downstream):
+            try:
+                written = self._write(endpoint, data)
+            except OSError as e:
+                self._write_failed(session, endpoint, str(e))
+                return
+            data = data[written:]
+        if data:
+            buf.extend(data)
+            if session.detached:
+                self._trim_scrollback(session)
+
+    @staticmethod
+    def _write(endpoint: RelayEndpoint, data: memoryview) -> int:
+        """write as much of ``data`` as the endpoint takes now, the rest of a short write is written again."""
+        total = 0
+        while total < len(data):
+            written = endpoint.write(data[total:])
+            if not written:
+                break
+            total += written
+        return total
+
+    def _write_failed(self, session: RelaySession, endpoint: RelayEndpoint, error: str):
+        logger.info(f"write to relay endpoint failed: {error}")
+        if session.on_detach and endpoint is session.downstream:
+            self._detach(session)
+        else:
+            self._close(session)
+
+    def _flush(self, session: RelaySession, endpoint: RelayEndpoint):
+        if session.detached and endpoint is session.downstream:
+            return
+        buf = session.pending[endpoint]
+        if buf:
+            error = None
+            try:
+                with memoryview(buf) as view:
+                    written = self._write(endpoint, view)
+            except OSError as e:
+                # handled out of here, views of ``buf`` are kept by the traceback, it can not be resized till then.
+                error = str(e)
+            if error is not None:
+                self._write_failed(session, endpoint, error)
+                return
+            del buf[:written]
+        if not buf and session.peer(endpoint) in session.read_eof and endpoint not in session.write_shut:
+            # everything before the EOF has been written, pass the EOF on.
+            session.write_shut.add(endpoint)
+            try:
+                endpoint.shutdown_write()
+            except OSError as e:
+                logger.info(f"shutdown write of relay endpoint failed: {e}")
+                self._close(session)
+
+    def _flush_stderr(self, session: RelaySession):
+        buf = session.stderr
+        while buf:
+            try:
+                written = session.downstream.write_stderr(buf)
+            except OSError as e:
+                logger.info(f"write stderr to relay endpoint failed: {e}")
+                self._close(session)
+                return
+            if not written:
+                break
+            del buf[:written]
+
+    def _update_interest(self, session: RelaySession):
+        if session.eof:
+            return
+        stalled = False
+        for endpoint in (session.downstream, session.upstream):
+            if session.detached and endpoint is session.downstream:
+                continue
+            events = 0
+            readable = (
+                endpoint not in session.read_eof and len(session.pending[session.peer(endpoint)]) < self.max_pending
+            )
+            if session.detached:
+                # output is kept as scrollback, the server is never blocked by a user who has gone.
+                readable = True
+            if session in self._throttled and endpoint is session.upstream:
+                readable = False
+            if endpoint is session.upstream and len(session.stderr) >= self.max_pending:
+                readable = False
+            if readable:
+                events |= selectors.EVENT_READ
+            if session.pending[endpoint]:
+                if endpoint.poll_writable:
+                    events |= selectors.EVENT_WRITE
+                else:
+                    stalled = True
+            self._set_events(endpoint, events, session)
+        if session.stderr:
+            stalled = True
+
+        if stalled:
+            self._stalled.add(session)
+        else:
+            self._stalled.discard(session)
+
+    def _set_events(self, endpoint: RelayEndpoint, events: int, session: RelaySession):
+        try:
+            key = self._selector.get_key(endpoint)
+        except KeyError:
+            key = None
+        if key is None:
+            if events:
+                self._selector.register(endpoint, events, (session, endpoint))
+        elif not events:
+            self._selector.unregister(endpoint)
+        elif key.events != events:
+            self._selector.modify(endpoint, events, (session, endpoint))
+
+    def _close(self, session: RelaySession):
+        if session.eof:
+            return
+        session.eof = True
+        for endpoint in (session.downstream, session.upstream):
+            try:
+                self._selector.unregister(endpoint)
+            except KeyError:
+                pass
+        self._stalled.discard(session)
+        self._throttled.pop(session, None)
+        self.sessions.discard(session)
+        logger.info(f"relay session closed, throttled {session.throttled} times, {len(self.sessions)} sessions left.")
+        threading.Thread(target=self._finish, args=(session,), name="relay-finish", daemon=True).start()
+
+    @staticmethod
+    def _finish(session: RelaySession):
+        try:
+            session.downstream.close()
+            leftover = session.pending[session.downstream]
+            if leftover:
+                session.downstream.channel.sendall(bytes(leftover))
+            # the server may write to stderr right before it exits.
+            stderr = session.upstream.read_stderr(DEFAULT_MAX_PENDING)
+            while stderr:
+                session.stderr.extend(stderr)
+                stderr = session.upstream.read_stderr(DEFAULT_MAX_PENDING)
+            if session.stderr:
+                session.downstream.channel.sendall_stderr(bytes(session.stderr))
+        except Exception as e:  # noqa
+            logger.info(f"can not flush leftover data to user: {e}")
+        try:
+            session.upstream.close()
+        finally:
+            if session.on_close:
+                session.on_close(session)
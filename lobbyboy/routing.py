@@ -0,0 +1,88 @@
+"""
+Route a session to a server without the menus, for scripts and for ``scp``, ``rsync`` or ``sftp``
+which can not answer them.
+
+The target is one of:
+
+- ``my-server``: enter the available server ``my-server``;
+- ``provider+template``: create a new server from a favorite template of the provider, the template
+  can be omitted (``provider+``) for providers which don't ask how to create servers.
+
+It can be given in the username: ``ssh Gustave@my-server@lobbyboy``, ``ssh @my-server@lobbyboy``
+or ``ssh provider+template@lobbyboy`` (the user is the owner of the public key then), in the
+``LOBBYBOY_TARGET`` environment variable (``SendEnv`` of OpenSSH), or at the beginning of the command:
+``ssh lobbyboy @my-server uname -a``.
+
+If none is given and there is only one available server, commands go to it.
+"""
+
+from dataclasses import dataclass
+from typing import Mapping, Optional, Tuple
+
+from lobbyboy.config import LBServerMeta
+from lobbyboy.exceptions import RoutingException
+
+TARGET_SEPARATOR = "@"
+TEMPLATE_SEPARATOR = "+"
+TARGET_ENV_NAME = "LOBBYBOY_TARGET"
+
+
+@dataclass(frozen=True)
+class Target:
+    server_name: Optional[str] = None
+    provider_name: Optional[str] = None
+    template: str = ""
+
+    @classmethod
+    def parse(cls, text: str) -> Optional["Target"]:
+        """``"my-server"`` -> ``Target(server_name="my-server")``, ``"do+1"`` -> ``Target("do", "1")``"""
+        if not text:
+            return None
+        provider_name, sep, template = text.partition(TEMPLATE_SEPARATOR)
+        if sep:
+            return cls(provider_name=provider_name, template=template)
+        return cls(server_name=text)
+
+    def __str__(self):
+        if self.server_name is not None:
+            return self.server_name
+        return f"{self.provider_name}{TEMPLATE_SEPARATOR}{self.template}"
+
+
+def split_username(login: str) -> Tuple[str, Optional[Target]]:
+    """
+    ``"Gustave@my-server"`` -> ``("Gustave", Target(server_name="my-server"))``,
+    ``"@my-server"`` and ``"do+1"`` have an empty username, ``"Gustave"`` -> ``("Gustave", None)``
+    """
+    username, sep, target = login.partition(TARGET_SEPARATOR)
+    if not sep and TEMPLATE_SEPARATOR in login:
+        username, target = "", login
+    return username, Target.parse(target)
+
+
+def split_command(command: bytes) -> Tuple[Optional[Target], bytes]:
+    """``b"@my-server uname -a"`` -> ``(Target(server_name="my-server"), b"uname -a")``"""
+    if not command.startswith(TARGET_SEPARATOR.encode()):
+        return None, command
+    target, _, command = command[1:].partition(b" ")
+    return Target.parse(target.decode()), command.lstrip(b" ")
+
+
+def find_server(servers: Mapping[str, LBServerMeta], server_name: Optional[str]) -> LBServerMeta:
+    """
+    Raises:
+        RoutingException: if the server is not available, or no server is given but there are
+            more or less than one available servers.
+    """
+    if server_name is None:
+        if len(servers) == 1:
+            return next(iter(servers.values()))
+        raise RoutingException(
+            f"there are {len(servers)} available servers, choose one by `ssh <user>@<server>@lobbyboy` "
+            f"or `ssh lobbyboy @<server> <command>`."
+        )
+    if server_name not in servers:
+        raise RoutingException(
+            f"server {server_name} is not available, available servers: {', '.join(servers) or 'none'}."
+        )
+    return servers[server_name]
@@ -1,7 +1,50 @@
+import argparse
+import json
 import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+from lobbyboy.config import LBConfig
+from lobbyboy.payloads import PAYLOADS_FILE, PayloadStore
+from lobbyboy.provider import SERVER_FILE
+from lobbyboy.throttle import load_bans
+from lobbyboy.utils import humanize_seconds
 
 
 def print_example_config():
     example_config_file = os.path.dirname(__file__) + "/conf/lobbyboy_config.toml"
     with open(example_config_file, "r") as conf:
         print(conf.read())
+
+
+def print_bans():
+    parser = argparse.ArgumentParser(description="print the source addresses banned by lobbyboy now.")
+    parser.add_argument("-c", "--config", dest="config_path", help="config file path", required=True)
+    args = parser.parse_args()
+
+    config = LBConfig.load(Path(args.config_path))
+    now = time.time()
+    bans = sorted((ban.until, address, ban) for address, ban in load_bans(config.bans_path).items() if ban.until > now)
+    for until, address, ban in bans:
+        banned_until = datetime.fromtimestamp(until).isoformat(sep=" ", timespec="seconds")
+        print(f"{address}\tuntil {banned_until} ({humanize_seconds(int(until - now))} left)\t{ban.failures} failures")
+    print(f"{len(bans)} addresses banned.")
+
+
+def export_raw_servers():
+    parser = argparse.ArgumentParser(description="print the raw payloads of all servers ever created, as JSON lines.")
+    parser.add_argument("-c", "--config", dest="config_path", help="config file path", required=True)
+    parser.add_argument("providers", nargs="*", help="only servers of these providers")
+    args = parser.parse_args()
+
+    config = LBConfig.load(Path(args.config_path))
+    for provider_name in args.providers or config.provider:
+        workspace = config.data_dir.joinpath(provider_name)
+        # servers created before the payload store have theirs in their workspaces.
+        for path in sorted(workspace.rglob(SERVER_FILE)):
+            with open(path) as f:
+                payload = json.load(f)
+            print(json.dumps({"provider": provider_name, "server_name": path.parent.name, "payload": payload}))
+        for server_name, payload in PayloadStore(workspace.joinpath(PAYLOADS_FILE)).export():
+            print(json.dumps({"provider": provider_name, "server_name": server_name, "payload": payload}))
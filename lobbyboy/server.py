@@ -1,4 +1,3 @@
-import base64
 import fcntl
 import logging
 import os
@@ -7,12 +6,14 @@ import signal
 import struct
 import termios
 import threading
-from binascii import hexlify
+from typing import Callable, Optional, Tuple
 
 import paramiko
 
-from lobbyboy.config import LBConfig
-from lobbyboy.exceptions import NoTTYException, UnsupportedPrivateKeyTypeException
+from lobbyboy.config import LBConfigWatcher
+from lobbyboy.exceptions import NoTTYException
+from lobbyboy.routing import TARGET_ENV_NAME, Target, split_username
+from lobbyboy.upstream import UpstreamChannelEndpoint
 
 logger = logging.getLogger(__name__)
 
@@ -23,18 +24,69 @@ def set_window_size(fd, row, col, xpix=0, ypix=0):
 
 
 class Server(paramiko.ServerInterface):
-    def __init__(self, config: LBConfig):
-        self.pty_event = threading.Event()
-        self.shell_event = threading.Event()
-        self.config = config
+    def __init__(
+        self,
+        config_watcher: LBConfigWatcher,
+        on_authenticated: Callable[[str], None] = None,
+    ):
+        # whether the client has asked for a pty, and for a shell, a command or a subsystem, see ``wait_for``.
+        self.pty_requested = self.shell_requested = False
+        # one condition for both, every connection keeps its ``Server`` as long as the session goes.
+        self._requested = threading.Condition()
+        self.config_watcher = config_watcher
+        # called with the username once the user is authenticated, when the first channel is being opened.
+        # ``check_auth_*`` can't tell it: paramiko asks them about a public key before (or without) checking its
+        # signature, and channels can only be opened after the transport is authenticated.
+        self.on_authenticated = on_authenticated
+        self._channel_opened = False
+        self.username: Optional[str] = None
+        # where the user wants to go without the menus, see ``lobbyboy.routing``.
+        self.target: Optional[Target] = None
+        # set if the client asks for a command or subsystem instead of a shell, e.g. scp, rsync or sftp.
+        self.exec_command: Optional[bytes] = None
+        self.subsystem: Optional[str] = None
+        self.term = "vt100"
         self.window_width = self.window_height = 0
+        self.window_pixel_width = self.window_pixel_height = 0
         self.proxy_subprocess_pid = None
-        self.client_exec = None
-        self.client_exec_provider = None
+        # set when the user's channel is spliced to a shell channel on the server, see ``lobbyboy.upstream``.
+        self.upstream: Optional[UpstreamChannelEndpoint] = None
         self.master_fd = self.slave_fd = None
+        # the id of the session in ``session_counter``, once it goes to a server.
+        self.session_id: Optional[str] = None
+
+    def wait_for(self, request: str, timeout: float) -> bool:
+        """wait until the client has asked for ``request``, "pty" or "shell"."""
+        with self._requested:
+            return self._requested.wait_for(lambda: getattr(self, f"{request}_requested"), timeout)
+
+    def _set_requested(self, request: str):
+        with self._requested:
+            setattr(self, f"{request}_requested", True)
+            self._requested.notify_all()
+
+    @property
+    def interactive(self) -> bool:
+        return self.exec_command is None and self.subsystem is None
+
+    def route(self, login: str) -> Tuple[str, Optional[Target]]:
+        # users in config may have "@" or "+" in their names.
+        if login in self.config_watcher.config.user:
+            return login, None
+        return split_username(login)
+
+    def authenticated(self, username: str, target: Optional[Target] = None) -> int:
+        # the last accepted check is the one that authenticates the user, paramiko ignores any check after it.
+        self.username = username
+        self.target = target
+        return paramiko.common.AUTH_SUCCESSFUL
 
     def check_channel_request(self, kind, channel_id):
         if kind == "session":
+            if not self._channel_opened:
+                self._channel_opened = True
+                if self.on_authenticated:
+                    self.on_authenticated(self.username)
             return paramiko.common.OPEN_SUCCEEDED
         return paramiko.common.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
 
@@ -42,48 +94,31 @@ class Server(paramiko.ServerInterface):
         logger.warning(
             "Using password for authentication is considered unsafe in production, please use a publickey instead."
         )
-        config = self.config.reload()
+        config = self.config_watcher.config
+        username, target = self.route(username)
         if username in config.user and password == config.user[username].password:
-            return paramiko.common.AUTH_SUCCESSFUL
+            return self.authenticated(username, target)
         return paramiko.common.AUTH_FAILED
 
-    @staticmethod
-    def _get_key_class(key_type):
-        # TODO
-        key_cls = {
-            "ssh-rsa": paramiko.RSAKey,
-            "ssh-dss": paramiko.DSSKey,
-            "ssh-ecdsa": paramiko.ECDSAKey,
-            "ssh-ed25519": paramiko.Ed25519Key,
-        }
-        if key_type in key_cls:
-            return key_cls[key_type]
-        raise UnsupportedPrivateKeyTypeException(f"Unknown key type {key_type}")
-
-    def try_auth(self, key, user, key_str) -> bool:
-        key_type = key.get_name().lower()
-        key_cls = self._get_key_class(key_type)
-
-        accept_key = key_cls(data=base64.b64decode(key_str))
-        k = hexlify(accept_key.get_fingerprint()).decode()
-        logger.info(f"try to auth {user} with key {k}")
-        success = key == accept_key
-        if success:
-            logger.info(f"accept auth {user} with key {k}")
-        return success
-
     def check_auth_publickey(self, username: str, key: paramiko.PKey):  # noqa
+        username, target = self.route(username)
         use_key_type = key.get_name()
         logger.info(f"try to auth {username} with key type {use_key_type}...")
-        config = self.config.reload()
-        ssh_key_paris = config.user[username].auth_key_pairs()
-        for key_type, key_data in ssh_key_paris:
-            if use_key_type != key_type:
-                continue
-            success = self.try_auth(key, username, key_data)
-            if success:
-                return paramiko.common.AUTH_SUCCESSFUL
-        logger.info(f"Can not auth {username} with any key.")
+        key_index = self.config_watcher.config.authorized_key_index
+        key_blob = key.asbytes()
+        fingerprint = key_index.fingerprint(key_blob)
+        if username and key_index.accept(username, use_key_type, key_blob):
+            logger.info(f"accept auth {username} with key {fingerprint}")
+            return self.authenticated(username, target)
+
+        owners = key_index.users_of(key_blob)
+        if not username:
+            # e.g. ``ssh @my-server@lobbyboy``, the user is who the key belongs to.
+            for owner in owners:
+                if key_index.accept(owner, use_key_type, key_blob):
+                    logger.info(f"accept auth {owner}, the owner of key {fingerprint}")
+                    return self.authenticated(owner, target)
+        logger.info(f"Can not auth {username} with key {fingerprint}, owners of this key: {owners or 'nobody'}.")
         return paramiko.common.AUTH_FAILED
 
     def check_auth_gssapi_with_mic(self, username, gss_authenticated=paramiko.common.AUTH_FAILED, cc_file=None):
@@ -102,14 +137,14 @@ class Server(paramiko.ServerInterface):
             <http://www.unix.com/man-page/all/3/krb5_kuserok/>`_
         """
         if gss_authenticated == paramiko.common.AUTH_SUCCESSFUL:
-            return paramiko.common.AUTH_SUCCESSFUL
+            return self.authenticated(*self.route(username))
         return paramiko.common.AUTH_FAILED
 
     def check_auth_gssapi_keyex(self, username, gss_authenticated=paramiko.common.AUTH_FAILED, cc_file=None):
         # TODO
         if gss_authenticated == paramiko.common.AUTH_SUCCESSFUL:
             logger.info("gss auth success")
-            return paramiko.common.AUTH_SUCCESSFUL
+            return self.authenticated(*self.route(username))
         return paramiko.common.AUTH_FAILED
 
     def enable_auth_gssapi(self):
@@ -120,11 +155,29 @@ class Server(paramiko.ServerInterface):
 
     def check_channel_shell_request(self, channel):
         logger.info("client request shell...")
-        self.pty_event.wait(timeout=10)
-        if not self.pty_event.is_set():
+        if not self.wait_for("pty", timeout=10):
             logger.error("Client never ask a tty, can not allocate shell...")
             raise NoTTYException("No TTY")
-        self.shell_event.set()
+        self._set_requested("shell")
+        return True
+
+    def check_channel_env_request(self, channel, name, value):
+        if name != TARGET_ENV_NAME.encode():
+            return False
+        self.target = Target.parse(value.decode())
+        logger.info(f"client request target {self.target} by env.")
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        logger.info(f"client request exec: {command!r}")
+        self.exec_command = command
+        self._set_requested("shell")
+        return True
+
+    def check_channel_subsystem_request(self, channel, name):
+        logger.info(f"client request subsystem: {name}")
+        self.subsystem = name
+        self._set_requested("shell")
         return True
 
     def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
@@ -132,14 +185,20 @@ class Server(paramiko.ServerInterface):
             f"Client request pty..., term={term} width={width}, height={height}, "
             f"pixelwidth={pixelwidth}, pixelheight={pixelheight}"
         )
-        self.master_fd, self.slave_fd = pty.openpty()
-        logger.debug(f"user's pty ready, master_fd={self.master_fd}, slave_fd={self.slave_fd}")
-
+        # the local pty is opened only if we need to run a proxy process, see ``open_pty``.
+        self.term = term
         self.window_width, self.window_height = width, height
-        set_window_size(self.master_fd, self.window_height, self.window_width, pixelwidth, pixelheight)
-        self.pty_event.set()
+        self.window_pixel_width, self.window_pixel_height = pixelwidth, pixelheight
+        self._set_requested("pty")
         return True
 
+    def open_pty(self):
+        self.master_fd, self.slave_fd = pty.openpty()
+        logger.debug(f"user's pty ready, master_fd={self.master_fd}, slave_fd={self.slave_fd}")
+        set_window_size(
+            self.master_fd, self.window_height, self.window_width, self.window_pixel_width, self.window_pixel_height
+        )
+
     def check_channel_window_change_request(self, channel, width, height, pixelwidth, pixelheight):
         logger.debug(
             f"client send window size change request... "
@@ -147,9 +206,27 @@ class Server(paramiko.ServerInterface):
             f"my proxy_subprocess_pid={self.proxy_subprocess_pid}, master_fd={self.master_fd}"
         )
         self.window_width, self.window_height = width, height
+        self.window_pixel_width, self.window_pixel_height = pixelwidth, pixelheight
+        if self.upstream is not None:
+            try:
+                self.upstream.resize(width, height, pixelwidth, pixelheight)
+            except paramiko.SSHException as e:
+                logger.debug(f"can not resize upstream pty: {e}")
+            return True
+        if self.master_fd is None:
+            return True
         set_window_size(self.master_fd, self.window_height, self.window_width, pixelwidth, pixelheight)
 
         if self.proxy_subprocess_pid is not None:
             logger.debug(f"send signal to {self.proxy_subprocess_pid}")
-            os.kill(self.proxy_subprocess_pid, signal.SIGWINCH)
+            try:
+                os.kill(self.proxy_subprocess_pid, signal.SIGWINCH)
+            except ProcessLookupError:
+                logger.debug(f"proxy subprocess {self.proxy_subprocess_pid} already exited.")
         return True
+
+    def close_pty(self):
+        for fd in (self.master_fd, self.slave_fd):
+            if fd is not None:
+                os.close(fd)
+        self.master_fd = self.slave_fd = None
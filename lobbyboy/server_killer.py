@@ -1,21 +1,17 @@
 import logging
 import time
-from pathlib import Path
-from typing import Dict, OrderedDict, Tuple
+from typing import Dict, Tuple
 
 from paramiko import Channel
 
-from lobbyboy.config import (
-    LBConfigProvider,
-    LBServerMeta,
-    load_local_servers,
-    update_local_servers,
-)
+from lobbyboy.config import LBConfigProvider, LBServerMeta
 from lobbyboy.provider import BaseProvider
+from lobbyboy.registry import ServerRegistry
+from lobbyboy.upstream import upstream_pool
 from lobbyboy.utils import (
-    active_session,
-    available_server_db_lock,
+    detached_session_counter,
     humanize_seconds,
+    session_counter,
     to_seconds,
 )
 
@@ -23,33 +19,55 @@ logger = logging.getLogger(__name__)
 
 
 class ServerKiller:
-    def __init__(self, watched_providers: Dict[str, BaseProvider], servers_db_path: Path):
-        self.servers_db_path: Path = servers_db_path
+    def __init__(
+        self,
+        watched_providers: Dict[str, BaseProvider],
+        registry: ServerRegistry,
+        detached_session_keeps_server: bool = True,
+    ):
+        self.registry: ServerRegistry = registry
         self.watched_providers: Dict[str, BaseProvider] = watched_providers
+        self.detached_session_keeps_server = detached_session_keeps_server
 
     def patrol(self, cycle_sec: int = 1 * 60):
+        """check all servers every ``cycle_sec``, and a server as soon as its last session has ended."""
         while 1:
             logger.info(f"killer start a new {cycle_sec} seconds round...")
             self.check_all_live_servers()
-            time.sleep(cycle_sec)
+            deadline = time.monotonic() + cycle_sec
+            while time.monotonic() < deadline:
+                for server_name in session_counter.wait_idle(deadline - time.monotonic()):
+                    self.check_server(server_name)
+
+    def check_server(self, server_name: str):
+        meta = self.registry.get(server_name)
+        provider = self.watched_providers.get(meta.provider_name) if meta else None
+        if not provider:
+            return
+        need_to_be_destroy, reason = self.need_destroy(provider, meta)
+        logger.info(f"{server_name} has no sessions now, need to be destroyed? {need_to_be_destroy}, reason: {reason}.")
+        if need_to_be_destroy:
+            self.destroy(provider, meta)
 
     def check_all_live_servers(self):
-        metas: OrderedDict[str, LBServerMeta] = load_local_servers(self.servers_db_path)
-
-        for server_name, meta in metas.items():
-            provider: BaseProvider
-            provider = self.watched_providers.get(meta.provider_name)
-            if not provider:
-                logger.error(f"can't find provider of server {meta.server_name}, destroy check failed.")
-                raise Exception
-
-            need_to_be_destroy, reason = self.need_destroy(provider, meta)
-            logger.info(f"{server_name} need to be destroyed? {need_to_be_destroy}, reason: {reason}.")
-            if need_to_be_destroy:
-                self.destroy(provider, meta)
-
-    @classmethod
-    def need_destroy(cls, provider: BaseProvider, meta: LBServerMeta) -> Tuple[bool, str]:
+        unknown = self.registry.provider_names() - set(self.watched_providers)
+        if unknown:
+            logger.error(f"can't find provider {', '.join(sorted(unknown))} of servers, destroy check failed.")
+            raise Exception
+
+        now = int(time.time())
+        provider: BaseProvider
+        for provider_name, provider in self.watched_providers.items():
+            # servers younger than min_life_to_live are never destroyed, don't even load them.
+            min_life_to_live_in_sec = max(to_seconds(provider.provider_config.min_life_to_live), 0)
+            metas = self.registry.servers(provider_name=provider_name, created_until=now - min_life_to_live_in_sec)
+            for server_name, meta in metas.items():
+                need_to_be_destroy, reason = self.need_destroy(provider, meta)
+                logger.info(f"{server_name} need to be destroyed? {need_to_be_destroy}, reason: {reason}.")
+                if need_to_be_destroy:
+                    self.destroy(provider, meta)
+
+    def need_destroy(self, provider: BaseProvider, meta: LBServerMeta) -> Tuple[bool, str]:
         """
         check if a provider's server need to be destroyed or not.
 
@@ -61,8 +79,9 @@ class ServerKiller:
             tuple, (need_to_be_destroy: bool, reason: str)
         """
         # check whether there is an activity session first
-        active_sessions = active_session.get(meta.server_name, [])
-        active_session_cnt = len(active_sessions)
+        active_session_cnt = session_counter.count(meta.server_name)
+        if not self.detached_session_keeps_server:
+            active_session_cnt -= detached_session_counter.count(meta.server_name)
         if active_session_cnt > 0:
             return False, f"still have {active_session_cnt} active sessions."
 
@@ -98,5 +117,6 @@ class ServerKiller:
         if not meta.manage:
             raise Exception(f"destroy failed, provider {provider.name} server {meta.server_name} not manage by me!")
         provider.destroy_server(meta, channel)
-        with available_server_db_lock:
-            update_local_servers(self.servers_db_path, deleted=[meta])
+        # sessions of this server have gone, don't keep a connection to a server which doesn't exist.
+        upstream_pool.discard(meta)
+        self.registry.remove(meta)
@@ -1,55 +1,98 @@
 import logging
 import os
-import select
 import socket
 import threading
-from binascii import hexlify
-from io import StringIO
+import time
+from functools import partial
 from subprocess import Popen
 from typing import Dict, Optional, OrderedDict, Tuple
 
 import paramiko
-from paramiko.channel import Channel
 from paramiko.transport import Transport
 
 from lobbyboy import __version__
+from lobbyboy.bandwidth import TokenBucket, session_limiter
+from lobbyboy.channel_writer import BufferedChannel, StderrChannel
 from lobbyboy.config import (
     LBConfig,
+    LBConfigWatcher,
     LBServerMeta,
-    load_local_servers,
-    update_local_servers,
 )
+from lobbyboy.detach import DetachedSession, detached_sessions
 from lobbyboy.exceptions import (
+    HandshakeTimeoutException,
+    LobbyBoyException,
     NoProviderException,
     ProviderException,
+    RoutingException,
+    SpawnerException,
+    UpstreamException,
     UserCancelException,
 )
+from lobbyboy.handshake import HandshakeContext
 from lobbyboy.provider import BaseProvider
+from lobbyboy.registry import ServerRegistry, server_registry
+from lobbyboy.relay import (
+    ChannelEndpoint,
+    PtyEndpoint,
+    RelayEndpoint,
+    RelayEngine,
+    RelaySession,
+)
+from lobbyboy.routing import Target, find_server, split_command
 from lobbyboy.server import Server
 from lobbyboy.server_killer import ServerKiller
+from lobbyboy.spawner import spawner
+from lobbyboy.throttle import SourceThrottle
+from lobbyboy.transport_profile import (
+    apply_user_profile,
+    create_transport,
+    rekey_for_user,
+)
+from lobbyboy.upstream import (
+    UpstreamChannelEndpoint,
+    UpstreamExecEndpoint,
+    upstream_pool,
+)
 from lobbyboy.utils import (
     DoGSSAPIKeyExchange,
-    KeyTypeSupport,
-    active_session,
-    active_session_lock,
-    available_server_db_lock,
     choose_option,
-    confirm_ssh_key_pair,
+    humanize_seconds,
     send_to_channel,
+    session_counter,
+    take_typed_ahead,
+    to_seconds,
 )
 
 logger = logging.getLogger(__name__)
 
 
 class SocketHandlerThread(threading.Thread):
-    def __init__(self, sock: socket, address, config: LBConfig, providers: Dict[str, BaseProvider]) -> None:
+    def __init__(
+        self,
+        sock: socket,
+        address,
+        config_watcher: LBConfigWatcher,
+        providers: Dict[str, BaseProvider],
+        relay: RelayEngine,
+        handshake_context: HandshakeContext,
+        throttle: Optional[SourceThrottle] = None,
+    ) -> None:
         super().__init__()
         self.socket_client = sock
         self.client_address = address
-        self.config = config
+        self.config_watcher: LBConfigWatcher = config_watcher
+        # every connection works with the latest config snapshot when it comes.
+        self.config: LBConfig = config_watcher.config
         self.providers: Dict[str, BaseProvider] = providers
-        self.killer = ServerKiller(providers, config.servers_db_path)
-        self.channel: Optional[Channel] = None
+        self.relay: RelayEngine = relay
+        self.handshake_context: HandshakeContext = handshake_context
+        self.throttle: Optional[SourceThrottle] = throttle
+        self.transport: Optional[Transport] = None
+        self.server: Optional[Server] = None
+        self.registry: ServerRegistry = server_registry(self.config)
+        self.killer = ServerKiller(providers, self.registry, self.config.detached_session_keeps_server)
+        self.channel: Optional[BufferedChannel] = None
 
     def choose_providers(self) -> BaseProvider:
         if not self.providers:
@@ -71,7 +114,7 @@ class SocketHandlerThread(threading.Thread):
         return list(self.providers.values())[user_input]
 
     def choose_server(self) -> LBServerMeta:
-        available_servers: OrderedDict[str, LBServerMeta] = load_local_servers(self.config.servers_db_path)
+        available_servers: OrderedDict[str, LBServerMeta] = self.registry.servers()
         if not available_servers:
             send_to_channel(self.channel, "There is no available servers, provision a new server...")
             return self._ask_user_to_create_server()
@@ -80,8 +123,13 @@ class SocketHandlerThread(threading.Thread):
         meta: LBServerMeta
         for meta in available_servers.values():
             server_desc = f"{meta.provider_name} {meta.server_name} {meta.server_host}"
-            sessions_cnt = len(active_session.get(meta.server_name, []))
-            options.append(f"Enter {server_desc} ({sessions_cnt} active sessions)")
+            sessions_cnt = session_counter.count(meta.server_name)
+            last_activity = session_counter.last_activity(meta.server_name)
+            if sessions_cnt or last_activity is None:
+                options.append(f"Enter {server_desc} ({sessions_cnt} active sessions)")
+            else:
+                idle = humanize_seconds(max(int(time.time() - last_activity), 0))
+                options.append(f"Enter {server_desc} (0 active sessions, idle for {idle})")
         user_input = choose_option(
             self.channel,
             options,
@@ -97,53 +145,98 @@ class SocketHandlerThread(threading.Thread):
     def _ask_user_to_create_server(self) -> LBServerMeta:
         provider: BaseProvider = self.choose_providers()
         meta: LBServerMeta = provider.create_server(self.channel)
+        self.registry.add(meta)
+        return meta
 
-        with available_server_db_lock:
-            update_local_servers(self.config.servers_db_path, new=[meta])
+    def find_target(self, target: Target, channel) -> LBServerMeta:
+        """the server the user asked for without the menus, ``provider+template`` creates a new one."""
+        if target.server_name is not None:
+            return find_server(self.registry, target.server_name)
+        provider = self.providers.get(target.provider_name)
+        if not provider:
+            raise NoProviderException(
+                f"provider {target.provider_name} is not available, available providers: {', '.join(self.providers)}."
+            )
+        meta = provider.create_server_from_template(channel, target.template)
+        self.registry.add(meta)
         return meta
 
-    def _create_proxy_process(self, slave_fd) -> Tuple[Popen, LBServerMeta]:
-        # if has available servers, prompt login or create
+    def _connect_upstream(self, server: Server) -> Tuple[RelayEndpoint, LBServerMeta]:
+        # if the user told us where to go, go there
+        # else if has available servers, prompt login or create
         # if no, create, and redirect
-        meta: LBServerMeta = self.choose_server()
+        meta: LBServerMeta
+        if server.target is not None:
+            meta = self.find_target(server.target, self.channel)
+        else:
+            meta = self.choose_server()
         provider = self.providers.get(meta.provider_name)
         if not provider:
             raise NoProviderException(f"not find provider for server {meta.server_name}")
 
-        ssh_command_units = provider.ssh_server_command(meta)
-        ssh_command = " ".join(str(i) for i in ssh_command_units)
-        logger.info(f"ssh to server {meta.server_name} {meta.server_host}: {ssh_command}")
         send_to_channel(
             self.channel,
             f"Redirect you to {meta.provider_name} server: {meta.server_name} ({meta.server_host})...",
         )
-        proxy_subprocess = Popen(
-            ssh_command,
-            shell=True,
-            preexec_fn=os.setsid,
-            stdin=slave_fd,
-            stdout=slave_fd,
-            stderr=slave_fd,
-            universal_newlines=True,
-        )
-        with active_session_lock:
-            active_session.setdefault(meta.server_name, []).append(self.channel.get_transport())
-        return proxy_subprocess, meta
-
-    def prepare_server(self, t: Transport, key_type: KeyTypeSupport = KeyTypeSupport.RSA) -> Optional[Server]:
+        upstream = None
+        if self.config.splice_upstream and provider.can_splice(meta):
+            upstream = self._splice_upstream(server, provider, meta)
+        if upstream is None:
+            upstream = self._create_proxy_process(server, provider, meta)
+        server.session_id = session_counter.add(meta.server_name)
+        return upstream, meta
+
+    def _splice_upstream(
+        self, server: Server, provider: BaseProvider, meta: LBServerMeta
+    ) -> Optional[UpstreamChannelEndpoint]:
         try:
-            t.load_server_moduli()
-        except:  # noqa
-            logger.error("(Failed to load moduli -- gex will be unsupported.)")
-            raise
-
-        pri, _ = confirm_ssh_key_pair(key_type=key_type, save_path=self.config.data_dir, key_name="ssh_host_rsa_key")
-        host_key = paramiko.RSAKey.from_private_key(StringIO(pri))
+            upstream = upstream_pool.open_shell(
+                meta,
+                provider.upstream_address(meta),
+                term=server.term,
+                width=server.window_width,
+                height=server.window_height,
+                width_pixels=server.window_pixel_width,
+                height_pixels=server.window_pixel_height,
+            )
+        except (UpstreamException, OSError) as e:
+            logger.warning(f"can not splice to server {meta.server_name}, use ssh command instead: {e}")
+            return None
+        logger.info(f"spliced to server {meta.server_name} {meta.server_host}.")
+        server.upstream = upstream
+        return upstream
+
+    def _create_proxy_process(self, server: Server, provider: BaseProvider, meta: LBServerMeta) -> PtyEndpoint:
+        ssh_command_units = provider.ssh_server_command(meta)
+        ssh_command = " ".join(str(i) for i in ssh_command_units)
+        logger.info(f"ssh to server {meta.server_name} {meta.server_host}: {ssh_command}")
+        server.open_pty()
+        proxy_subprocess = None
+        if spawner.running:
+            try:
+                proxy_subprocess = spawner.spawn(ssh_command, server.slave_fd)
+            except SpawnerException as e:
+                logger.warning(f"{e}, spawn it by lobbyboy itself.")
+        if proxy_subprocess is None:
+            proxy_subprocess = Popen(
+                ssh_command,
+                shell=True,
+                start_new_session=True,
+                stdin=server.slave_fd,
+                stdout=server.slave_fd,
+                stderr=server.slave_fd,
+            )
+        logger.info(f"proxy subprocess created, pid={proxy_subprocess.pid}")
+        server.proxy_subprocess_pid = proxy_subprocess.pid
+        # only the proxy subprocess holds the slave side now, so we get EOF from master_fd once it exits.
+        os.close(server.slave_fd)
+        server.slave_fd = None
+        return PtyEndpoint(server.master_fd, proxy_subprocess)
 
-        logger.info("Read host key: " + hexlify(host_key.get_fingerprint()).decode())
-        t.add_server_key(host_key)
+    def prepare_server(self, t: Transport, deadline: float) -> Optional[Server]:
+        self.handshake_context.prepare(t)
 
-        server = Server(self.config)
+        server = Server(self.config_watcher, on_authenticated=partial(self.tune_transport, t))
         try:
             t.start_server(server=server)
         except paramiko.SSHException:
@@ -151,88 +244,365 @@ class SocketHandlerThread(threading.Thread):
             logger.error(f"close the transport now... {t}")
             return
 
-        self.channel = t.accept(timeout=20)
-        if self.channel is None:
+        channel = t.accept(timeout=max(deadline - time.monotonic(), 0))
+        self.account_auth(t)
+        if channel is None:
             logger.error("Client never open a new channel, close transport now...")
             return
+        self.channel = BufferedChannel(channel)
         return server
 
-    def prepare_shell_env(self, server: Server, t: Transport) -> Tuple[Optional[LBServerMeta], Optional[Popen]]:
-        server.shell_event.wait()
-        if not server.shell_event.is_set():
-            logger.warning("Client never asked for a shell, I am going to end this ssh session now...")
-            send_to_channel(
-                self.channel,
-                "*** Client never asked for a shell. Server will end session...",
-            )
-            return None, None
-
+    def prepare_shell_env(self, server: Server, t: Transport) -> Tuple[Optional[LBServerMeta], Optional[RelayEndpoint]]:
         logger.info(f"transport peer name: {t.getpeername()}")
-        proxy_subprocess = lb_server = None
+        upstream = lb_server = None
         try:
-            proxy_subprocess, lb_server = self._create_proxy_process(server.slave_fd)
+            upstream, lb_server = self._connect_upstream(server)
         except UserCancelException:
             logger.warning("user input Ctrl-C or Ctrl-D during the input.")
             send_to_channel(self.channel, "Got EOF, closing session...")
         except ProviderException as e:
             logger.warning(f"got exceptions from provider: {e}")
             send_to_channel(self.channel, f"LobbyBoy got exceptions from provider: {e}")
+        except RoutingException as e:
+            logger.warning(f"can not route to {server.target}: {e}")
+            send_to_channel(self.channel, f"LobbyBoy: {e}")
         except Exception as e:
             logger.warning(f"got exceptions: {e}")
             send_to_channel(self.channel, f"LobbyBoy got exceptions: {e}")
             raise
 
-        if not (proxy_subprocess and lb_server):
+        if not (upstream and lb_server):
             return None, None
 
-        logger.info(f"proxy subprocess created, pid={proxy_subprocess.pid}")
-        server.proxy_subprocess_pid = proxy_subprocess.pid
-
         send_to_channel(self.channel, int(server.window_width) * "=")
-        return lb_server, proxy_subprocess
-
-    def user_using(self, server: Server, proxy_subprocess: Popen):
-        channel_fd = self.channel.fileno()
-        master_fd = server.master_fd
-        while proxy_subprocess.poll() is None:
-            r, *_ = select.select([master_fd, channel_fd], [], [], 0.1)
-            if master_fd in r:
-                send_to_channel(self.channel, os.read(master_fd, 10240), suffix=b"")
-            elif channel_fd in r:
-                os.write(master_fd, self.channel.recv(10240))
-
-    def cleanup(self, t: Transport = None, meta: LBServerMeta = None, check_destroy: bool = False):
-        if t and meta:
-            self.remove_server_session(t, meta.server_name)
-            if check_destroy:
-                self.destroy_server_if_needed(meta)
+        return lb_server, upstream
+
+    def hand_off(self, server: Server, t: Transport, lb_server: LBServerMeta, upstream: RelayEndpoint):
+        """hand the session off to the relay engine, this thread can exit after that."""
+        # the user sees everything lobbyboy said before the server's output.
+        self.channel.flush()
+        session = RelaySession(
+            downstream=ChannelEndpoint(self.channel.channel),
+            upstream=upstream,
+            on_close=partial(self.finish_session, server, t, lb_server),
+            on_detach=self._on_detach(server, t, lb_server),
+            limiter=self._session_limiter(server),
+        )
+        # e.g. a script sends the menu answer and its first command in one write.
+        session.pending[upstream].extend(take_typed_ahead(self.channel))
+        self.relay.attach(session)
+        logger.info(f"session of {self.client_address} has been handed off to relay engine.")
+
+    def _session_limiter(self, server: Server) -> Optional[TokenBucket]:
+        profile = self.config.bandwidth_profile(server.username)
+        return session_limiter(profile.session_rate, profile.session_burst)
+
+    def _on_detach(self, server: Server, t: Transport, lb_server: LBServerMeta):
+        if to_seconds(self.config.detach_grace_period) <= 0:
+            return None
+        return partial(self.detach_session, server, t, lb_server)
+
+    def detach_session(self, server: Server, t: Transport, lb_server: LBServerMeta, session: RelaySession):
+        """the user's connection has dropped, keep the session for them to resume."""
+        grace_period = to_seconds(self.config.detach_grace_period)
+        logger.info(f"detach session of {server.username} on {lb_server.server_name} for {grace_period}s.")
+        detached_sessions.add(
+            DetachedSession(server.username, lb_server, session, server), grace_period, on_expire=self.relay.close
+        )
+        self.cleanup(t)
+
+    def resume_detached_session(self, server: Server, t: Transport) -> bool:
+        """
+        Resume a detached session of the user, it is chosen from the menu, or by ``ssh user@server@lobbyboy``.
+
+        Returns:
+            bool: True if a session has been resumed, this thread can exit then.
+        """
+        candidates = detached_sessions.of_user(server.username)
+        if server.target is not None:
+            candidates = [d for d in candidates if d.meta.server_name == server.target.server_name][:1]
+        elif candidates:
+            now = time.monotonic()
+            options = ["Start a new session..."]
+            for d in candidates:
+                detached_for = humanize_seconds(int(now - d.detached_at))
+                options.append(
+                    f"Resume {d.meta.provider_name} {d.meta.server_name} {d.meta.server_host} "
+                    f"(detached {detached_for} ago)"
+                )
+            user_input = choose_option(
+                self.channel, options, option_prompt=f"You have {len(candidates)} detached sessions:"
+            )
+            candidates = candidates[user_input - 1 : user_input] if user_input else []
+        if not candidates:
+            return False
+
+        detached = candidates[0]
+        meta = detached.meta
+        if not detached_sessions.claim(detached):
+            send_to_channel(self.channel, f"The session on {meta.server_name} has been closed.")
+            return False
+        send_to_channel(self.channel, f"Resume your session on {meta.provider_name} server: {meta.server_name}...")
+        self.channel.flush()
+
+        # window changes of this connection go to the pty or upstream of the session now.
+        old = detached.server
+        server.upstream, server.master_fd, server.proxy_subprocess_pid = (
+            old.upstream,
+            old.master_fd,
+            old.proxy_subprocess_pid,
+        )
+        try:
+            resumed = self.relay.reattach(
+                detached.session,
+                ChannelEndpoint(self.channel.channel),
+                on_close=partial(self.finish_session, server, t, meta),
+                on_detach=self._on_detach(server, t, meta),
+                typed_ahead=take_typed_ahead(self.channel),
+            )
+        except Exception:  # noqa
+            # it has been claimed and nobody can resume it any more, the relay closes it with its upstream.
+            server.upstream = server.master_fd = server.proxy_subprocess_pid = None
+            self.relay.close(detached.session)
+            raise
+        if not resumed:
+            server.upstream = server.master_fd = server.proxy_subprocess_pid = None
+            self.channel.settimeout(None)
+            send_to_channel(self.channel, f"The session on {meta.server_name} has been closed.")
+            return False
+        server.session_id = old.session_id
+        server.check_channel_window_change_request(
+            self.channel,
+            server.window_width,
+            server.window_height,
+            server.window_pixel_width,
+            server.window_pixel_height,
+        )
+        logger.info(f"session of {server.username} on {meta.server_name} has been resumed by {self.client_address}.")
+        return True
+
+    def route(self, server: Server) -> Tuple[LBServerMeta, BaseProvider]:
+        """find the server for a command or subsystem, without asking the user."""
+        target = server.target
+        if server.exec_command is not None:
+            command_target, server.exec_command = split_command(server.exec_command)
+            target = command_target or target
+        if target is None:
+            meta = find_server(self.registry, None)
+        else:
+            meta = self.find_target(target, StderrChannel(self.channel))
+        provider = self.providers.get(meta.provider_name)
+        if not provider:
+            raise NoProviderException(f"not find provider for server {meta.server_name}")
+        if not provider.can_splice(meta):
+            raise RoutingException(
+                f"can not run commands on {meta.provider_name} server {meta.server_name}, "
+                f"please enter it with a shell."
+            )
+        return meta, provider
+
+    def passthrough(self, server: Server, t: Transport):
+        """
+        Relay a command or subsystem to the server, it has no pty and is binary-safe,
+        only the server's output goes to the user's stdout (lobbyboy talks on stderr).
+        """
+        pty = None
+        if server.pty_requested:
+            pty = (
+                server.term,
+                server.window_width,
+                server.window_height,
+                server.window_pixel_width,
+                server.window_pixel_height,
+            )
+        try:
+            meta, provider = self.route(server)
+            upstream = upstream_pool.open_exec(
+                meta,
+                provider.upstream_address(meta),
+                command=server.exec_command,
+                subsystem=server.subsystem,
+                pty=pty,
+            )
+        except (LobbyBoyException, OSError) as e:
+            logger.warning(f"can not pass {server.subsystem or server.exec_command!r} through: {e}")
+            self.tell_user(f"LobbyBoy: {e}")
+            self.channel.send_exit_status(255)
+            self.cleanup(t, server=server)
+            return
+
+        logger.info(f"pass {server.subsystem or server.exec_command!r} through to server {meta.server_name}.")
+        server.upstream = upstream
+        server.session_id = session_counter.add(meta.server_name)
+        session = RelaySession(
+            downstream=ChannelEndpoint(self.channel.channel),
+            upstream=upstream,
+            on_close=partial(self.finish_passthrough, server, t, meta),
+            half_close=True,
+            limiter=self._session_limiter(server),
+        )
+        self.relay.attach(session)
+
+    def finish_passthrough(self, server: Server, t: Transport, meta: LBServerMeta, session: RelaySession):
+        server.upstream = None
+        upstream: UpstreamExecEndpoint = session.upstream
+        try:
+            session_counter.remove(server.session_id, session.last_active_at, notify=False)
+            self.destroy_server_if_needed(meta)
+        except Exception:  # noqa
+            logger.critical("*** Finish passthrough error.", exc_info=True)
+        exit_status = upstream.exit_status
+        if not self.channel.closed:
+            # no exit status means the command was killed by a signal, ssh exits with 255 then.
+            self.channel.send_exit_status(255 if exit_status is None else exit_status)
+        self.cleanup(t)
+
+    def finish_session(self, server: Server, t: Transport, lb_server: LBServerMeta, session: RelaySession):
+        # master_fd or the upstream connection has been closed by relay engine.
+        server.master_fd = None
+        server.upstream = None
+        detached_sessions.discard(session)
+        try:
+            # this thread checks whether the server should be destroyed, the killer needn't.
+            session_counter.remove(server.session_id, session.last_active_at, notify=False)
+            self.tell_user(f"LobbyBoy: SSH to remote server {lb_server.server_name} closed.")
+            self.cleanup(t, meta=lb_server, check_destroy=True)
+        except Exception:  # noqa
+            logger.critical("*** Finish session error.", exc_info=True)
+            self.cleanup(t)
+
+    def cleanup(
+        self, t: Transport = None, meta: LBServerMeta = None, check_destroy: bool = False, server: Server = None
+    ):
+        if server:
+            server.close_pty()
+            # the session (if it has gone to a server) ends with the connection, unless it is handed off.
+            session_counter.remove(server.session_id)
+        if t and meta and check_destroy:
+            self.destroy_server_if_needed(meta)
 
         if self.channel:
             self.channel.shutdown(0)
         if t:
             t.close()
 
+    def tell_user(self, message: str):
+        """the user may have left already, e.g. closed the terminal, sessions still need to be cleaned up then."""
+        if not self.channel or self.channel.closed:
+            return
+        try:
+            if self.server and not self.server.interactive:
+                # stdout of commands and subsystems belongs to the server.
+                self.channel.sendall_stderr(f"{message}\r\n".encode())
+            else:
+                send_to_channel(self.channel, message)
+        except OSError as e:
+            logger.info(f"can not tell user {message!r}: {e}")
+
     def destroy_server_if_needed(self, server: LBServerMeta):
         provider = self.providers[server.provider_name]
         need_destroy, reason = self.killer.need_destroy(provider, server)
-        send_to_channel(self.channel, f"LobbyBoy: This server {reason}.")
+        interactive = self.server is None or self.server.interactive
         if not need_destroy:
+            # scp or sftp users don't care, unless the server is going to be destroyed.
+            if interactive:
+                self.tell_user(f"LobbyBoy: This server {reason}.")
             return
+        self.tell_user(f"LobbyBoy: This server {reason}.")
+
+        self.tell_user(f"LobbyBoy: I will destroy {server.server_name}({server.server_host}) now!")
+        channel = self.channel if self.channel and not self.channel.closed and interactive else None
+        self.killer.destroy(provider, server, channel)
+        self.tell_user(f"LobbyBoy: Server {server.server_name}({server.server_host}) has been destroyed.")
+
+    def handshake(self, deadline: float) -> bool:
+        """
+        Negotiate with the client and wait until it asks for a shell, this is run by workers of ``HandlerPool``.
+
+        Args:
+            deadline: time.monotonic() based, client must open a shell before it.
+
+        Returns:
+            bool: True if the client is ready for a shell, this thread should be started then.
+
+        Raises:
+            HandshakeTimeoutException: if the client didn't ask for a shell before the deadline.
+        """
+        logger.info(f"start handshake with {self.client_address}, my thread id={threading.get_ident()}")
+        t = self.transport = create_transport(self.socket_client, self.config.transport, gss_kex=DoGSSAPIKeyExchange)
+        # paramiko's timeouts bound every step, not the whole negotiation, e.g. a client sending its banner, or
+        # key exchange packets slowly, the transport is closed at the deadline, which ends any step waiting.
+        watchdog = threading.Timer(max(deadline - time.monotonic(), 0), self._handshake_expired, args=(t,))
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            ready = self._handshake(t, deadline)
+        finally:
+            watchdog.cancel()
+        if ready and not t.is_active():
+            # closed by the watchdog right before it was cancelled.
+            self.cleanup(t, server=self.server)
+            raise HandshakeTimeoutException("handshake not finished before deadline")
+        return ready
+
+    def _handshake(self, t: Transport, deadline: float) -> bool:
+        try:
+            self.server = self.prepare_server(t, deadline)
+        except Exception:  # noqa
+            logger.critical("*** Handshake error.", exc_info=True)
+            self.cleanup(t)
+            return False
 
-        send_to_channel(self.channel, f"LobbyBoy: I will destroy {server.server_name}({server.server_host}) now!")
-        self.killer.destroy(provider, server, self.channel)
-        send_to_channel(
-            self.channel,
-            f"LobbyBoy: Server {server.server_name}({server.server_host}) has been destroyed.",
-        )
+        if not (self.server and self.channel):
+            self.cleanup(t, server=self.server)
+            if time.monotonic() >= deadline:
+                raise HandshakeTimeoutException("client never opened a new channel")
+            return False
 
-    @staticmethod
-    def remove_server_session(transport: Transport, server_name: str):
-        peer_name = transport.getpeername()
-        with active_session_lock:
-            sessions = active_session.get(server_name)
-            if sessions:
-                active_session[server_name] = list(filter(lambda x: x.getpeername() != peer_name, sessions))
+        if not self.server.wait_for("shell", max(deadline - time.monotonic(), 0)):
+            logger.warning("Client never asked for a shell, I am going to end this ssh session now...")
+            send_to_channel(
+                self.channel,
+                "*** Client never asked for a shell. Server will end session...",
+            )
+            self.cleanup(t, server=self.server)
+            raise HandshakeTimeoutException("client never asked for a shell")
+
+        try:
+            rekey_for_user(t, self.config.transport, self.config.transport_profile(self.server.username))
+        except paramiko.SSHException as e:
+            logger.warning(f"renegotiate keys with {self.client_address} failed: {e}")
+            self.cleanup(t, server=self.server)
+            if time.monotonic() >= deadline:
+                raise HandshakeTimeoutException("client never finished renegotiating keys")
+            return False
+        return True
+
+    def _handshake_expired(self, t: Transport):
+        logger.warning(f"handshake with {self.client_address} reached deadline, close the transport.")
+        t.close()
+
+    def account_auth(self, t: Transport):
+        """
+        Tell the throttle how auth of this connection ended, once the client has opened a channel or given up.
+
+        Only the final result counts, ``check_auth_*`` of ``Server`` accept a public key before paramiko checks its
+        signature (or without one, if the client only asks), failures are what paramiko has sent to the client.
+        """
+        if self.throttle is None:
+            return
+        if t.is_authenticated():
+            self.throttle.auth_succeeded(self.client_address[0])
+            return
+        failures = getattr(t.auth_handler, "auth_fail_count", 0)
+        if failures:
+            self.throttle.auth_failed(self.client_address[0], failures)
+
+    def tune_transport(self, t: Transport, username: str):
+        profile = self.config.transport_profile(username)
+        if profile is not self.config.transport:
+            logger.info(f"apply transport profile of user {username}: {profile}")
+            apply_user_profile(t, profile)
 
     def run(self):
         logger.info(
@@ -241,27 +611,26 @@ class SocketHandlerThread(threading.Thread):
             f"address: {self.client_address}, "
             f"my thread id={threading.get_ident()}"
         )
-        t = Transport(self.socket_client, gss_kex=DoGSSAPIKeyExchange)
+        t, server = self.transport, self.server
         try:
-            t.set_gss_host(socket.getfqdn())
-            server = self.prepare_server(t)
-            if not (server and self.channel):
-                self.cleanup(t)
+            if not server.interactive:
+                self.passthrough(server, t)
                 return
-
             send_to_channel(self.channel, f"Welcome to LobbyBoy {__version__}!")
-            lb_server, proxy_subprocess = self.prepare_shell_env(server, t)
-            if not (proxy_subprocess and lb_server):
-                logger.error("failed to create proxy subprocess or lb_server")
-                self.cleanup(t, meta=lb_server)
+            try:
+                if self.resume_detached_session(server, t):
+                    return
+            except UserCancelException:
+                send_to_channel(self.channel, "Got EOF, closing session...")
+                self.cleanup(t, server=server)
+                return
+            lb_server, upstream = self.prepare_shell_env(server, t)
+            if not (upstream and lb_server):
+                logger.error("failed to connect upstream or lb_server")
+                self.cleanup(t, meta=lb_server, server=server)
                 return
 
-            self.user_using(server, proxy_subprocess)
-            send_to_channel(
-                self.channel,
-                f"LobbyBoy: SSH to remote server {lb_server.server_name} closed.",
-            )
-            self.cleanup(t, meta=lb_server, check_destroy=True)
+            self.hand_off(server, t, lb_server, upstream)
         except Exception:  # noqa
             logger.critical("*** Socket thread error.", exc_info=True)
-            self.cleanup(t)
+            self.cleanup(t, server=server)
@@ -0,0 +1,254 @@
+"""
+A small, single-threaded helper process which spawns the proxy processes (``ssh`` to the servers) for lobbyboy.
+
+Forking lobbyboy itself, a big process with many threads, copies the page tables of the whole interpreter
+for every proxy process, and ``preexec_fn`` is not safe with threads. The helper is started once at boot by
+``Spawner.start`` (``python -m lobbyboy.spawner``), then handler threads send it the command and the slave side
+of the session's PTY over a UNIX socket, it spawns the process and tells the pid back, and the exit status once
+the process exits.
+
+Messages are JSON over a ``SOCK_SEQPACKET`` socket pair, file descriptors are passed with ``SCM_RIGHTS``:
+
+- lobbyboy: ``{"id": 1, "command": "ssh ..."}`` with the PTY's slave fd;
+- helper: ``{"id": 1, "pid": 1234}`` or ``{"id": 1, "error": "..."}``;
+- helper: ``{"exited": 1234, "returncode": 0}``.
+"""
+
+import array
+import itertools
+import json
+import logging
+import os
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional, Set, Tuple
+
+from lobbyboy.exceptions import SpawnerException
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_SIZE = 64 * 1024
+# seconds to wait for the helper to spawn a process.
+SPAWN_TIMEOUT = 10
+# seconds between two checks of a process, if the helper has gone and can not tell its exit.
+ORPHAN_POLL_INTERVAL = 0.1
+
+
+def send_message(sock: socket.socket, message: dict, fds: List[int] = ()):
+    ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))] if fds else []
+    sock.sendmsg([json.dumps(message).encode()], ancillary)
+
+
+def recv_message(sock: socket.socket) -> Tuple[Optional[dict], List[int]]:
+    """receive a message and the fds passed with it, the message is None once the peer has gone."""
+    fds = array.array("i")
+    data, ancillary, _, _ = sock.recvmsg(MAX_MESSAGE_SIZE, socket.CMSG_SPACE(fds.itemsize))
+    for level, kind, payload in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(payload[: len(payload) - len(payload) % fds.itemsize])
+    return (json.loads(data) if data else None), list(fds)
+
+
+class SpawnedProcess:
+    """The ``Popen`` look-alike of a process spawned by the helper, what ``PtyEndpoint`` needs of it."""
+
+    __slots__ = ("pid", "args", "returncode", "_spawner", "_exited")
+
+    def __init__(self, pid: int, args: str, spawner: "Spawner"):
+        self.pid = pid
+        self.args = args
+        self.returncode: Optional[int] = None
+        self._spawner = spawner
+        self._exited = threading.Event()
+
+    def _set_returncode(self, returncode: int):
+        self.returncode = returncode
+        self._exited.set()
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None and not self._spawner.running:
+            # nobody reaps it for us any more, it is gone once the pid is.
+            try:
+                os.kill(self.pid, 0)
+            except ProcessLookupError:
+                self._set_returncode(-1)
+        return self.returncode
+
+    def wait(self, timeout: float = None) -> int:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            wait = ORPHAN_POLL_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    raise subprocess.TimeoutExpired(self.args, timeout)
+            self._exited.wait(wait)
+        return self.returncode
+
+
+class Spawner:
+    """lobbyboy's side of the helper, ``spawn`` can be called from any thread."""
+
+    def __init__(self):
+        self._process: Optional[subprocess.Popen] = None
+        self._sock: Optional[socket.socket] = None
+        self._send_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._requests: Dict[int, Tuple[str, Future]] = {}
+        # requests timed out, their processes are killed once the helper tells their pids.
+        self._abandoned: Set[int] = set()
+        self._processes: Dict[int, SpawnedProcess] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._sock is not None
+
+    def start(self):
+        ours, helpers = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        # in its own session, so Ctrl-C of lobbyboy doesn't reach it, it exits once lobbyboy has gone.
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "lobbyboy.spawner", str(helpers.fileno())],
+            pass_fds=(helpers.fileno(),),
+            start_new_session=True,
+        )
+        helpers.close()
+        self._sock = ours
+        threading.Thread(target=self._read_replies, name="spawner-reader", daemon=True).start()
+        logger.info(f"spawn helper started, pid={self._process.pid}")
+
+    def spawn(self, command: str, fd: int, timeout: float = SPAWN_TIMEOUT) -> SpawnedProcess:
+        """run ``command`` with the shell in a new session, ``fd`` as its stdin, stdout and stderr."""
+        request_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            # ``_lost`` sets it to None, a closed socket only fails to send.
+            sock = self._sock
+            if sock is None:
+                raise SpawnerException("spawn helper is not running.")
+            self._requests[request_id] = command, future
+        try:
+            with self._send_lock:
+                send_message(sock, {"id": request_id, "command": command}, [fd])
+            return future.result(timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                if not future.done():
+                    self._abandoned.add(request_id)
+            if not future.done():
+                raise SpawnerException(f"spawn helper didn't spawn {command!r} in {timeout}s.")
+            # replied just now.
+            return future.result()
+        except OSError as e:
+            raise SpawnerException(f"spawn helper failed to spawn {command!r}: {e!r}")
+        finally:
+            with self._lock:
+                self._requests.pop(request_id, None)
+
+    def _read_replies(self):
+        while True:
+            try:
+                message, _ = recv_message(self._sock)
+            except OSError as e:
+                logger.error(f"can not read from spawn helper: {e}")
+                message = None
+            if message is None:
+                break
+            if "exited" in message:
+                with self._lock:
+                    process = self._processes.pop(message["exited"], None)
+                if process is not None:
+                    process._set_returncode(message["returncode"])
+                continue
+            with self._lock:
+                if message["id"] in self._abandoned:
+                    self._abandoned.discard(message["id"])
+                    if "pid" in message:
+                        self._kill_abandoned(message["pid"])
+                    continue
+                command, future = self._requests.get(message["id"], (None, None))
+                if future is None:
+                    continue
+                # under the lock, a timed out ``spawn`` either gets the result, or abandons the request.
+                if "pid" in message:
+                    process = self._processes[message["pid"]] = SpawnedProcess(message["pid"], command, self)
+                    future.set_result(process)
+                else:
+                    future.set_exception(SpawnerException(message["error"]))
+        self._lost()
+
+    @staticmethod
+    def _kill_abandoned(pid: int):
+        """the requester has given up and spawned the process by itself on the same PTY."""
+        logger.warning(f"spawn helper spawned {pid} too late, kill it.")
+        try:
+            # in a session of its own, the group has the same id.
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _lost(self):
+        logger.error("spawn helper has gone, proxy processes are spawned by lobbyboy itself from now on.")
+        with self._lock:
+            self._sock.close()
+            self._sock = None
+            requests, self._requests = self._requests, {}
+            self._abandoned.clear()
+            self._processes.clear()
+        for _, future in requests.values():
+            future.set_exception(SpawnerException("spawn helper has gone."))
+
+
+spawner = Spawner()
+
+
+def serve_spawn_requests(sock: socket.socket):
+    """the helper's main loop, it runs until lobbyboy has gone."""
+    children: Dict[int, subprocess.Popen] = {}
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda *_: None)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    selector.register(wakeup_r, selectors.EVENT_READ)
+
+    while True:
+        for key, _ in selector.select():
+            if key.fd == wakeup_r:
+                os.read(wakeup_r, 4096)
+                continue
+            message, fds = recv_message(sock)
+            if message is None:
+                return
+            try:
+                process = subprocess.Popen(
+                    message["command"], shell=True, start_new_session=True, stdin=fds[0], stdout=fds[0], stderr=fds[0]
+                )
+            except (OSError, IndexError) as e:
+                send_message(sock, {"id": message["id"], "error": repr(e)})
+            else:
+                children[process.pid] = process
+                send_message(sock, {"id": message["id"], "pid": process.pid})
+            finally:
+                for fd in fds:
+                    os.close(fd)
+        for pid, process in list(children.items()):
+            if process.poll() is not None:
+                del children[pid]
+                send_message(sock, {"exited": pid, "returncode": process.returncode})
+
+
+if __name__ == "__main__":
+    try:
+        serve_spawn_requests(socket.socket(fileno=int(sys.argv[1])))
+    except (BrokenPipeError, ConnectionResetError):
+        pass
@@ -0,0 +1,211 @@
+import fcntl
+import ipaddress
+import json
+import logging
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Deque, Dict, Iterable, Optional, Tuple
+
+from lobbyboy.utils import atomic_write, file_signature
+
+logger = logging.getLogger(__name__)
+
+# the ban file is checked for bans made by other processes at most this often (seconds).
+BANS_RELOAD_INTERVAL = 1.0
+
+
+@dataclass
+class Ban:
+    # time.time() based, the ban is kept across restarts.
+    until: float
+    # failed auth attempts that got the address banned.
+    failures: int
+
+
+@dataclass
+class ThrottleStats:
+    # connections closed right after accept, because their address is banned.
+    banned: int = 0
+    # connections closed right after accept, because their address opened too many connections recently.
+    rate_limited: int = 0
+    # addresses banned by this process.
+    bans: int = 0
+
+
+class SourceThrottle:
+    """
+    Connections are checked by their source address right after ``accept``, before any ssh work is done.
+
+    - an address can open ``max_connections`` connections in a sliding ``window``.
+    - an address failing auth ``max_auth_failures`` times in ``window`` is banned for ``ban_time``.
+
+    At most ``max_addresses`` addresses are tracked, the least recently seen ones are forgotten first.
+    Bans are kept in ``bans_file`` (JSON, address -> ``Ban``), shared by worker processes and restarts.
+    0 for ``max_connections`` or ``max_auth_failures`` means no limit.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 0,
+        max_auth_failures: int = 0,
+        window: float = 60,
+        ban_time: float = 3600,
+        max_addresses: int = 10000,
+        bans_file: Optional[Path] = None,
+        trusted_addresses: Iterable[str] = (),
+    ):
+        self.max_connections = max_connections
+        self.max_auth_failures = max_auth_failures
+        self.window = window
+        self.ban_time = ban_time
+        self.max_addresses = max_addresses
+        self.bans_file = bans_file
+        self.trusted_networks = [ipaddress.ip_network(a, strict=False) for a in trusted_addresses]
+        self.stats = ThrottleStats()
+        # accept times (time.monotonic() based) of recent connections of an address, and its failed auth attempts.
+        self._connections: "OrderedDict[str, Deque[float]]" = OrderedDict()
+        self._failures: "OrderedDict[str, Deque[float]]" = OrderedDict()
+        self._bans: "OrderedDict[str, Ban]" = OrderedDict()
+        self._bans_signature: Optional[Tuple] = None
+        self._bans_checked_at = 0.0
+        # connections are accepted by one thread, auth failures come from handshake workers.
+        self._lock = threading.Lock()
+        self._reload_bans()
+
+    @property
+    def bans(self) -> Dict[str, Ban]:
+        """addresses banned now."""
+        now = time.time()
+        with self._lock:
+            return {address: ban for address, ban in self._bans.items() if ban.until > now}
+
+    def allow(self, address: str) -> bool:
+        """whether a connection from ``address`` can go on, called for every accepted connection."""
+        if self._trusted(address):
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if now - self._bans_checked_at >= BANS_RELOAD_INTERVAL:
+                self._bans_checked_at = now
+                self._reload_bans()
+            ban = self._bans.get(address)
+            if ban is not None:
+                if ban.until > time.time():
+                    self.stats.banned += 1
+                    return False
+                del self._bans[address]
+            if not self.max_connections:
+                return True
+            recent = self._recent(self._connections, address, now, self.max_connections)
+            if len(recent) >= self.max_connections:
+                self.stats.rate_limited += 1
+                return False
+            recent.append(now)
+            return True
+
+    def auth_failed(self, address: str, failures: int = 1):
+        if not self.max_auth_failures or self._trusted(address):
+            return
+        now = time.monotonic()
+        with self._lock:
+            recent = self._recent(self._failures, address, now, self.max_auth_failures)
+            recent.extend([now] * min(failures, self.max_auth_failures))
+            if len(recent) < self.max_auth_failures:
+                return
+            del self._failures[address]
+            self._ban(address, Ban(until=time.time() + self.ban_time, failures=len(recent)))
+        logger.warning(f"{address} failed auth {len(recent)} times in {self.window}s, banned for {self.ban_time}s.")
+
+    def auth_succeeded(self, address: str):
+        with self._lock:
+            self._failures.pop(address, None)
+
+    def _trusted(self, address: str) -> bool:
+        if not self.trusted_networks:
+            return False
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_networks)
+
+    def _recent(self, table: "OrderedDict[str, Deque[float]]", address: str, now: float, size: int) -> Deque[float]:
+        """times in ``window`` of an address, the table is kept within ``max_addresses``."""
+        recent = table.get(address)
+        if recent is None:
+            recent = table[address] = deque(maxlen=size)
+            if len(table) > self.max_addresses:
+                table.popitem(last=False)
+        else:
+            table.move_to_end(address)
+        while recent and now - recent[0] >= self.window:
+            recent.popleft()
+        return recent
+
+    def _ban(self, address: str, ban: Ban):
+        self._bans[address] = ban
+        self._bans.move_to_end(address)
+        self._trim_bans()
+        self.stats.bans += 1
+        if self.bans_file is not None:
+            self._save_bans(address, ban)
+
+    def _trim_bans(self):
+        now = time.time()
+        for address in [address for address, ban in self._bans.items() if ban.until <= now]:
+            del self._bans[address]
+        while len(self._bans) > self.max_addresses:
+            self._bans.popitem(last=False)
+
+    def _reload_bans(self):
+        """take the bans made by other processes, the file is read only when it has changed."""
+        if self.bans_file is None:
+            return
+        signature = file_signature(self.bans_file)
+        if signature is None or signature == self._bans_signature:
+            return
+        self._bans_signature = signature
+        for address, ban in load_bans(self.bans_file).items():
+            if address not in self._bans or self._bans[address].until < ban.until:
+                self._bans[address] = ban
+        self._trim_bans()
+
+    def _save_bans(self, address: str, ban: Ban):
+        with open(self.bans_file.with_name(f"{self.bans_file.name}.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._reload_bans()
+                self._bans[address] = ban
+                self._trim_bans()
+                atomic_write(self.bans_file, json.dumps({a: asdict(b) for a, b in self._bans.items()}, indent=2))
+                self._bans_signature = file_signature(self.bans_file)
+            except OSError as e:
+                logger.error(f"can not save bans to {self.bans_file}: {e}")
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_bans(bans_file: Path) -> Dict[str, Ban]:
+    try:
+        with open(bans_file) as f:
+            return {address: Ban(**ban) for address, ban in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+    except (JSONDecodeError, TypeError) as e:
+        logger.error(f"Error when reading bans file {bans_file}, {e}")
+        return {}
+
+
+def reject(sock: socket.socket):
+    """close at once with a reset, a rejected connection leaves nothing behind, not even TIME_WAIT."""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+    except OSError:
+        pass
+    sock.close()
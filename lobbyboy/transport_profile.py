@@ -0,0 +1,79 @@
+import logging
+import socket
+from typing import List, Sequence
+
+from paramiko.transport import Transport
+
+from lobbyboy.config import LBConfigTransport
+from lobbyboy.utils import to_seconds
+
+logger = logging.getLogger(__name__)
+
+
+def tune_socket(sock: socket.socket, profile: LBConfigTransport):
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(profile.tcp_nodelay))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, int(profile.tcp_keepalive))
+    except OSError as e:
+        # e.g. not a TCP socket
+        logger.debug(f"can not tune socket {sock}: {e}")
+
+
+def _preferred(kind: str, wanted: List[str], supported: Sequence[str]) -> List[str]:
+    preferred = [name for name in wanted if name in supported]
+    ignored = [name for name in wanted if name not in supported]
+    if ignored:
+        logger.warning(f"{kind} {', '.join(ignored)} not supported, supported: {', '.join(supported)}.")
+    return preferred
+
+
+def _apply_algorithms(t: Transport, profile: LBConfigTransport):
+    # paramiko's ``_preferred_*`` are everything it supports, in its default order.
+    options = t.get_security_options()
+    if profile.ciphers:
+        ciphers = _preferred("cipher", profile.ciphers, Transport._preferred_ciphers)
+        if ciphers:
+            options.ciphers = ciphers
+    if profile.macs:
+        macs = _preferred("MAC", profile.macs, Transport._preferred_macs)
+        if macs:
+            options.digests = macs
+    t.use_compression(profile.compression)
+
+
+def create_transport(sock: socket.socket, profile: LBConfigTransport, gss_kex: bool) -> Transport:
+    """create the server ``Transport`` for an accepted connection with the global transport profile."""
+    tune_socket(sock, profile)
+    kwargs = {}
+    if profile.window_size:
+        kwargs["default_window_size"] = profile.window_size
+    if profile.max_packet_size:
+        kwargs["default_max_packet_size"] = profile.max_packet_size
+    t = Transport(sock, gss_kex=gss_kex, **kwargs)
+    _apply_algorithms(t, profile)
+    t.set_keepalive(to_seconds(profile.keepalive_interval))
+    return t
+
+
+def apply_user_profile(t: Transport, profile: LBConfigTransport):
+    """
+    Apply the transport profile of the authenticated user, it is called before the user opens any channel,
+    so the window and packet size take effect on the user's channels.
+
+    Ciphers, MACs and compression are negotiated before authentication, they are changed by ``rekey_for_user``.
+    """
+    if profile.window_size:
+        t.default_window_size = profile.window_size
+    if profile.max_packet_size:
+        t.default_max_packet_size = profile.max_packet_size
+    tune_socket(t.sock, profile)
+    t.set_keepalive(to_seconds(profile.keepalive_interval))
+
+
+def rekey_for_user(t: Transport, base: LBConfigTransport, profile: LBConfigTransport):
+    """renegotiate keys if the user prefers other ciphers, MACs or compression than the global profile."""
+    if (profile.ciphers, profile.macs, profile.compression) == (base.ciphers, base.macs, base.compression):
+        return
+    _apply_algorithms(t, profile)
+    t.renegotiate_keys()
+    logger.info(f"renegotiated keys for user profile, cipher: {t.local_cipher}, compression: {profile.compression}")
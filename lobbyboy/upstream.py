@@ -0,0 +1,332 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import paramiko
+from paramiko.channel import Channel
+
+from lobbyboy.config import LBServerMeta
+from lobbyboy.exceptions import UpstreamException
+from lobbyboy.relay import ChannelEndpoint
+
+logger = logging.getLogger(__name__)
+
+# seconds to wait for the server to connect, show its banner and authenticate us.
+UPSTREAM_CONNECT_TIMEOUT = 30
+# masters without any session are closed after this many seconds.
+DEFAULT_IDLE_TIMEOUT = 10 * 60
+# seconds between two rounds of health check, masters send keepalive on the same interval.
+HEALTH_CHECK_INTERVAL = 30
+# seconds to wait for the exit status of a command after its output ends.
+EXIT_STATUS_TIMEOUT = 5
+
+
+@dataclass
+class UpstreamAddress:
+    """Where and how lobbyboy ssh to a provider's server by itself."""
+
+    host: str
+    port: int
+    user: str
+    key_path: Path
+
+
+class UpstreamChannelEndpoint(ChannelEndpoint):
+    """A shell channel on the provider's server, the master connection is released when it is closed."""
+
+    __slots__ = ("release",)
+
+    def __init__(self, channel: Channel, release: Callable[[], None]):
+        super().__init__(channel)
+        self.release = release
+
+    def resize(self, width: int, height: int, width_pixels: int = 0, height_pixels: int = 0):
+        """forward the window-change request of the user to the server."""
+        self.channel.resize_pty(width=width, height=height, width_pixels=width_pixels, height_pixels=height_pixels)
+
+    def close(self):
+        self.channel.close()
+        self.release()
+
+
+class UpstreamExecEndpoint(UpstreamChannelEndpoint):
+    """
+    A command or subsystem (e.g. sftp) channel on the provider's server, it has no pty,
+    so stdout and stderr are separated and EOF of the user is passed on to the command.
+    """
+
+    __slots__ = ("exit_status",)
+
+    def __init__(self, channel: Channel, release: Callable[[], None]):
+        super().__init__(channel, release)
+        self.exit_status: Optional[int] = None
+
+    def read_stderr(self, size: int) -> Optional[bytes]:
+        if self.channel.recv_stderr_ready():
+            return self.channel.recv_stderr(size)
+        return None
+
+    def shutdown_write(self):
+        self.channel.shutdown_write()
+
+    def close(self):
+        if self.channel.status_event.wait(EXIT_STATUS_TIMEOUT):
+            self.exit_status = self.channel.exit_status
+        super().close()
+
+
+class UpstreamMaster:
+    """
+    One ssh connection to a server, like the ``ControlMaster`` of OpenSSH,
+    shells of all sessions entering this server are opened as channels on it.
+    """
+
+    __slots__ = ("address", "client", "sessions", "idle_since")
+
+    def __init__(self, address: UpstreamAddress, client: paramiko.SSHClient):
+        self.address = address
+        self.client = client
+        self.sessions = 0
+        self.idle_since = time.monotonic()
+
+    @classmethod
+    def connect(cls, address: UpstreamAddress, timeout: float = UPSTREAM_CONNECT_TIMEOUT) -> "UpstreamMaster":
+        client = paramiko.SSHClient()
+        # the same as ``StrictHostKeyChecking=no`` of ``BaseProvider.ssh_server_command``.
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        logger.info(f"connect to {address.user}@{address.host}:{address.port} with key {address.key_path}")
+        try:
+            client.connect(
+                address.host,
+                port=address.port,
+                username=address.user,
+                key_filename=str(address.key_path),
+                timeout=timeout,
+                banner_timeout=timeout,
+                auth_timeout=timeout,
+                allow_agent=False,
+                look_for_keys=False,
+            )
+        except (paramiko.SSHException, OSError) as e:
+            client.close()
+            raise UpstreamException(f"can not connect to {address.host}:{address.port}: {e}") from e
+        client.get_transport().set_keepalive(HEALTH_CHECK_INTERVAL)
+        return cls(address, client)
+
+    def is_alive(self) -> bool:
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def open_shell(self, term: str, width: int, height: int, width_pixels: int = 0, height_pixels: int = 0) -> Channel:
+        return self.client.invoke_shell(
+            term=term, width=width, height=height, width_pixels=width_pixels, height_pixels=height_pixels
+        )
+
+    def open_exec(
+        self, command: Optional[bytes] = None, subsystem: Optional[str] = None, pty: Optional[Tuple] = None
+    ) -> Channel:
+        """
+        Args:
+            command: command to execute, or
+            subsystem: name of the subsystem to invoke.
+            pty: ``(term, width, height, width_pixels, height_pixels)`` if the user asked for a pty.
+        """
+        channel = self.client.get_transport().open_session(timeout=UPSTREAM_CONNECT_TIMEOUT)
+        try:
+            if pty is not None:
+                channel.get_pty(*pty)
+            if subsystem is not None:
+                channel.invoke_subsystem(subsystem)
+            else:
+                channel.exec_command(command)
+        except Exception:  # noqa
+            channel.close()
+            raise
+        return channel
+
+    def close(self):
+        self.client.close()
+
+
+class UpstreamPool:
+    """
+    Keep one master connection per server, new sessions open a channel on it instead of a new connection.
+
+    Masters are closed when they have been idle for ``idle_timeout`` seconds, when their connection is broken,
+    or when the server is destroyed (``discard``).
+    """
+
+    def __init__(self, idle_timeout: int = DEFAULT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._masters: Dict[Tuple[str, str], UpstreamMaster] = {}
+        self._lock = threading.Lock()
+        # one lock per server, so only one master is connecting for the server at a time,
+        # with how many sessions are using it, it is dropped once none is.
+        self._connect_locks: Dict[Tuple[str, str], Tuple[threading.Lock, int]] = {}
+        self._checker: Optional[threading.Thread] = None
+
+    @staticmethod
+    def key(meta: LBServerMeta) -> Tuple[str, str]:
+        return meta.provider_name, meta.server_name
+
+    def start(self):
+        """check the health of masters and expire idle ones in background."""
+        if self._checker is None:
+            self._checker = threading.Thread(target=self._check_forever, name="upstream-pool", daemon=True)
+            self._checker.start()
+
+    def _check_forever(self):
+        while 1:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            try:
+                self.check()
+            except Exception:  # noqa
+                logger.critical("*** upstream pool check error.", exc_info=True)
+
+    def check(self):
+        """close masters which are broken, or have no session for ``idle_timeout`` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            for key, master in list(self._masters.items()):
+                if not master.is_alive():
+                    reason = "connection broken"
+                elif not master.sessions and now - master.idle_since >= self.idle_timeout:
+                    reason = f"idle for {int(now - master.idle_since)}s"
+                else:
+                    continue
+                del self._masters[key]
+                logger.info(f"close upstream master of {key}: {reason}.")
+                master.close()
+
+    def _master(self, meta: LBServerMeta, address: UpstreamAddress) -> Tuple[UpstreamMaster, bool]:
+        key = self.key(meta)
+        with self._lock:
+            connect_lock, users = self._connect_locks.get(key, (None, 0))
+            if connect_lock is None:
+                connect_lock = threading.Lock()
+            self._connect_locks[key] = connect_lock, users + 1
+        try:
+            with connect_lock:
+                return self._get_or_connect(key, address)
+        finally:
+            with self._lock:
+                connect_lock, users = self._connect_locks[key]
+                if users > 1:
+                    self._connect_locks[key] = connect_lock, users - 1
+                else:
+                    del self._connect_locks[key]
+
+    def _get_or_connect(self, key: Tuple[str, str], address: UpstreamAddress) -> Tuple[UpstreamMaster, bool]:
+        """with the connect lock of the server held."""
+        with self._lock:
+            master = self._masters.get(key)
+            if master is not None and master.is_alive() and master.address == address:
+                master.sessions += 1
+                return master, True
+            if master is not None:
+                del self._masters[key]
+        if master is not None:
+            logger.info(f"upstream master of {key} is stale, reconnect.")
+            master.close()
+
+        master = UpstreamMaster.connect(address)
+        with self._lock:
+            self._masters[key] = master
+            master.sessions += 1
+        return master, False
+
+    def _release(self, master: UpstreamMaster):
+        with self._lock:
+            master.sessions -= 1
+            if not master.sessions:
+                master.idle_since = time.monotonic()
+
+    def open_shell(
+        self,
+        meta: LBServerMeta,
+        address: UpstreamAddress,
+        term: str,
+        width: int,
+        height: int,
+        width_pixels: int = 0,
+        height_pixels: int = 0,
+    ) -> UpstreamChannelEndpoint:
+        """
+        Open a shell on the server, on the master connection of it if there is one.
+
+        Raises:
+            UpstreamException: if we can not connect, authenticate or get a shell.
+        """
+        channel, master = self._open_channel(
+            meta, address, "shell", lambda m: m.open_shell(term, width, height, width_pixels, height_pixels)
+        )
+        return UpstreamChannelEndpoint(channel, release=lambda: self._release(master))
+
+    def open_exec(
+        self,
+        meta: LBServerMeta,
+        address: UpstreamAddress,
+        command: Optional[bytes] = None,
+        subsystem: Optional[str] = None,
+        pty: Optional[Tuple] = None,
+    ) -> UpstreamExecEndpoint:
+        """
+        Execute a command, or invoke a subsystem on the server, see ``UpstreamMaster.open_exec``.
+
+        Raises:
+            UpstreamException: if we can not connect, authenticate or the server refused the request.
+        """
+        what = f"subsystem {subsystem}" if subsystem is not None else "command"
+        channel, master = self._open_channel(meta, address, what, lambda m: m.open_exec(command, subsystem, pty))
+        return UpstreamExecEndpoint(channel, release=lambda: self._release(master))
+
+    def _open_channel(
+        self, meta: LBServerMeta, address: UpstreamAddress, what: str, open_channel: Callable[[UpstreamMaster], Channel]
+    ) -> Tuple[Channel, UpstreamMaster]:
+        master, reused = self._master(meta, address)
+        try:
+            channel = open_channel(master)
+        except (paramiko.SSHException, OSError, EOFError) as e:
+            self._release(master)
+            if not reused:
+                self._drop_unused(meta, master)
+            # a live master means the server refused the request, other sessions are fine on it.
+            if not reused or master.is_alive():
+                raise UpstreamException(f"can not open {what} on {address.host}:{address.port}: {e}") from e
+            # the master looked alive, but the server has gone, e.g. rebooted.
+            logger.info(f"open {what} on upstream master of {self.key(meta)} failed: {e}, reconnect.")
+            self.discard(meta)
+            return self._open_channel(meta, address, what, open_channel)
+
+        logger.info(f"opened {what} on {'existing' if reused else 'new'} upstream master of {self.key(meta)}.")
+        return channel, master
+
+    def _drop_unused(self, meta: LBServerMeta, master: UpstreamMaster):
+        """close a new master nobody could use, unless other sessions have got channels on it meanwhile."""
+        with self._lock:
+            if master.sessions or self._masters.get(self.key(meta)) is not master:
+                return
+            del self._masters[self.key(meta)]
+        logger.info(f"close upstream master of {self.key(meta)}: no channel opened on it.")
+        master.close()
+
+    def discard(self, meta: LBServerMeta):
+        """close the master of the server, e.g. the server is destroyed."""
+        with self._lock:
+            master = self._masters.pop(self.key(meta), None)
+        if master is not None:
+            logger.info(f"discard upstream master of {self.key(meta)}.")
+            master.close()
+
+    def close(self):
+        with self._lock:
+            masters, self._masters = list(self._masters.values()), {}
+        for master in masters:
+            master.close()
+
+
+# one pool per process, shared by the handler threads and the server killer.
+upstream_pool = UpstreamPool()
@@ -1,20 +1,26 @@
+import codecs
 import importlib
 import logging
 import os
 import re
 import socket
 import threading
+import time
+import uuid
 from dataclasses import asdict, is_dataclass
 from datetime import date, datetime, timedelta
 from decimal import Decimal
 from enum import Enum, unique
 from io import StringIO
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Type, Union
 
 import paramiko
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
 from paramiko.channel import Channel
 
+from lobbyboy.channel_writer import BufferedChannel
 from lobbyboy.exceptions import (
     CantEnsureBytesException,
     TimeStrParseTypeException,
@@ -26,9 +32,6 @@ logger = logging.getLogger(__name__)
 
 
 DoGSSAPIKeyExchange = True
-active_session: Dict[str, List[paramiko.Transport]] = {}
-available_server_db_lock = threading.Lock()
-active_session_lock = threading.Lock()
 
 UNIT_SEC_PAIRS = {
     "s": 1,
@@ -38,6 +41,132 @@ UNIT_SEC_PAIRS = {
 }
 
 
+class SessionCounter:
+    """
+    Active sessions of every server, each session is known by a unique id, see ``new_session_id``.
+
+    Adding or removing a session, and counting the sessions of a server, cost the same however many sessions
+    there are. Removing a session twice, or one never added, changes nothing. A server's last activity is kept
+    when its sessions end, and ``wait_idle`` tells whoever waits (the server killer) about servers whose last
+    session has ended.
+
+    Sessions are kept with the pid of their process, so the sessions of a dead worker process can be dropped
+    by ``forget``. In multi-process mode, ``share`` makes every call go to one counter living in the manager
+    process, so all workers and the server killer see the same numbers.
+    """
+
+    def __init__(self):
+        # session_id -> (server_name, pid)
+        self._sessions: Dict[str, Tuple[str, int]] = {}
+        # server_name -> sessions
+        self._counts: Dict[str, int] = {}
+        # pid -> session ids
+        self._pid_sessions: Dict[int, Set[str]] = {}
+        # server_name -> time.time() of the last activity of its ended sessions.
+        self._last_activity: Dict[str, float] = {}
+        # servers whose last session has ended, waiting to be taken by ``wait_idle``.
+        self._idle: Dict[str, None] = {}
+        self._lock = threading.Lock()
+        self._idle_changed = threading.Condition(self._lock)
+        self._shared: Optional["SessionCounter"] = None
+
+    def share(self, shared: "SessionCounter"):
+        self._shared = shared
+
+    def add(self, server_name: str, session_id: str = None, pid: int = None) -> str:
+        """
+        Returns:
+            str: the session id, a new one if not given.
+        """
+        session_id = session_id or new_session_id()
+        pid = pid or os.getpid()
+        if self._shared is not None:
+            return self._shared.add(server_name, session_id, pid)
+        with self._lock:
+            if session_id in self._sessions:
+                return session_id
+            self._sessions[session_id] = (server_name, pid)
+            self._counts[server_name] = self._counts.get(server_name, 0) + 1
+            self._pid_sessions.setdefault(pid, set()).add(session_id)
+            self._idle.pop(server_name, None)
+        return session_id
+
+    def remove(self, session_id: Optional[str], last_activity: float = None, notify: bool = True) -> int:
+        """
+        Args:
+            last_activity: time.time() of the last bytes of the session, now if not given.
+            notify: tell ``wait_idle`` if it is the last session of its server, callers checking the server
+                by themselves don't.
+
+        Returns:
+            int: how many sessions its server still has.
+        """
+        if session_id is None:
+            return 0
+        last_activity = last_activity or time.time()
+        if self._shared is not None:
+            return self._shared.remove(session_id, last_activity, notify)
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return 0
+            server_name, pid = session
+            self._pid_sessions[pid].discard(session_id)
+            if not self._pid_sessions[pid]:
+                del self._pid_sessions[pid]
+            self._last_activity[server_name] = max(self._last_activity.get(server_name, 0), last_activity)
+            return self._decrease(server_name, notify)
+
+    def _decrease(self, server_name: str, notify: bool) -> int:
+        count = self._counts[server_name] - 1
+        if count:
+            self._counts[server_name] = count
+            return count
+        del self._counts[server_name]
+        if notify:
+            self._idle[server_name] = None
+            self._idle_changed.notify_all()
+        return 0
+
+    def count(self, server_name: str) -> int:
+        if self._shared is not None:
+            return self._shared.count(server_name)
+        return self._counts.get(server_name, 0)
+
+    def last_activity(self, server_name: str) -> Optional[float]:
+        """time.time() of the last activity of the server's ended sessions, None if none has ended."""
+        if self._shared is not None:
+            return self._shared.last_activity(server_name)
+        return self._last_activity.get(server_name)
+
+    def wait_idle(self, timeout: float) -> List[str]:
+        """wait until the last session of some servers has ended, those servers are returned and forgotten."""
+        if self._shared is not None:
+            return self._shared.wait_idle(timeout)
+        with self._lock:
+            self._idle_changed.wait_for(lambda: self._idle, timeout)
+            idle, self._idle = list(self._idle), {}
+        return idle
+
+    def forget(self, pid: int):
+        """drop all sessions of process ``pid``."""
+        if self._shared is not None:
+            return self._shared.forget(pid)
+        with self._lock:
+            for session_id in self._pid_sessions.pop(pid, ()):
+                server_name, _ = self._sessions.pop(session_id)
+                self._decrease(server_name, notify=True)
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+session_counter = SessionCounter()
+# detached sessions are counted in ``session_counter`` as well, see ``lobbyboy.detach``.
+detached_session_counter = SessionCounter()
+
+
 def encoder_factory(
     date_fmt: str = "%Y-%m-%d",
     dt_fmt: str = "%Y-%m-%d %H:%M:%S",
@@ -167,55 +296,245 @@ def choose_option(
     ask user to choose one option from channel
     """
     logger.info(f"need user to choose from {options}\nprompt: {option_prompt}")
-    send_to_channel(channel, option_prompt or "Available options:")
-    for index, option in enumerate(options):
-        send_to_channel(channel, f"{index:>3} - {option}")
+    menu = [option_prompt or "Available options:"]
+    menu.extend(f"{index:>3} - {option}" for index, option in enumerate(options))
+    # the whole menu goes in one write.
+    send_to_channel(channel, "\r\n".join(menu))
     _ask_prompt = ask_prompt or f"Please enter the number of choice[{0}-{len(options) - 1}]: "
     send_to_channel(channel, _ask_prompt, suffix=b"")
 
-    result = read_user_input_line(channel)
-    try:
+    while 1:
+        result = read_user_input_line(channel)
         if result == "" and default is not None:
             # User hits enter directly
             num_selected = default
         else:
-            num_selected = int(result)
+            try:
+                num_selected = int(result)
+            except ValueError:
+                num_selected = -1
         if 0 <= num_selected < len(options):
             logger.info(f"user choose {result} for option {option_prompt}")
             send_to_channel(channel, f"You selected: {options[num_selected]}")
             return num_selected
-        raise Exception(f"user choose {result} for option {option_prompt}, but it's out of range")
-    except Exception:  # noqa
+
         logger.error(f"user choose {result} for option {option_prompt} invalid, re-choose...")
-        send_to_channel(channel, f"unknown choice, please choose again [{0}-{len(options) - 1}]")
-        return choose_option(channel, options, option_prompt=option_prompt, ask_prompt=ask_prompt)
+        send_to_channel(channel, f"unknown choice, please choose again [{0}-{len(options) - 1}]: ", suffix=b"")
+
+
+# keys we handle in escape sequences, see [ANSI escape code](https://en.wikipedia.org/wiki/ANSI_escape_code)
+# CSI sequences are keyed by parameters + final byte, SS3 sequences by the final byte.
+ESCAPE_SEQUENCE_KEYS = {
+    b"D": "left",
+    b"C": "right",
+    b"H": "home",
+    b"F": "end",
+    b"1~": "home",
+    b"7~": "home",
+    b"4~": "end",
+    b"8~": "end",
+    b"3~": "delete",
+}
+CONTROL_KEYS = {
+    b"\x01": "home",  # Ctrl-A
+    b"\x05": "end",  # Ctrl-E
+    b"\x02": "left",  # Ctrl-B
+    b"\x06": "right",  # Ctrl-F
+    b"\x08": "backspace",  # Ctrl-H
+    b"\x7f": "backspace",
+    b"\x15": "kill_head",  # Ctrl-U
+    b"\x0b": "kill_tail",  # Ctrl-K
+}
+# give up a CSI sequence that has no final byte after this many bytes.
+MAX_ESCAPE_SEQUENCE_LENGTH = 16
 
 
-def read_user_input_line(channel) -> str:
-    # TODO do not support del
-    # receive user input correctly: see [ANSI escape code](https://en.wikipedia.org/wiki/ANSI_escape_code)
-    chars = []
-    while 1:
-        content = channel.recv(1)
-        logger.debug(f"channel recv: {content}")
-        if content in [b"\x04", b"\x03"]:
-            raise UserCancelException()
-        elif content == b"\r":
-            send_to_channel(channel)
-            break
-        elif content in [b"\x7f"]:
-            send_to_channel(channel, "\x08\x1b[K", suffix=b"")
-            continue
-        else:
-            send_to_channel(channel, content, suffix=b"")
-            chars.append(content)
-    return b"".join(chars).decode()
+def _move_cursor(n: int) -> str:
+    if n > 0:
+        return f"\x1b[{n}C"
+    if n < 0:
+        return f"\x1b[{-n}D"
+    return ""
+
+
+def _parse_escape_sequence(buf: bytearray, pos: int) -> Tuple[int, Optional[str]]:
+    """
+    Returns:
+        tuple(int, str): (length of the sequence at ``pos``, the key it stands for),
+                         length is 0 if the sequence is not complete yet.
+    """
+    if len(buf) < pos + 2:
+        return 0, None
+    kind = buf[pos + 1 : pos + 2]
+    if kind == b"O":
+        if len(buf) < pos + 3:
+            return 0, None
+        return 3, ESCAPE_SEQUENCE_KEYS.get(bytes(buf[pos + 2 : pos + 3]))
+    if kind != b"[":
+        # a lone ESC, leave the byte after it alone.
+        return 1, None
+    for end in range(pos + 2, min(len(buf), pos + MAX_ESCAPE_SEQUENCE_LENGTH)):
+        if 0x40 <= buf[end] <= 0x7E:
+            return end + 1 - pos, ESCAPE_SEQUENCE_KEYS.get(bytes(buf[pos + 2 : end + 1]))
+    if len(buf) >= pos + MAX_ESCAPE_SEQUENCE_LENGTH:
+        return MAX_ESCAPE_SEQUENCE_LENGTH, None
+    return 0, None
+
+
+class LineEditor:
+    """
+    Read lines typed by user from a channel.
+
+    Every ``recv`` takes all the bytes available, so a paste comes in at once, and their echo is sent back
+    in one write. Arrow keys, Home/End, Delete, backspace and Ctrl-A/E/B/F/U/K edit the line, other escape
+    sequences (up/down, bracketed paste markers...) are dropped. Bytes after Enter are kept for the next line.
+    """
+
+    __slots__ = ("_pending", "_skip_lf", "_decoder", "_line", "_cursor")
+    recv_size = 1024
+
+    def __init__(self):
+        self._pending = bytearray()
+        # "\r\n" is one Enter, even if "\n" comes in the next recv.
+        self._skip_lf = False
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._line: List[str] = []
+        self._cursor = 0
+
+    def read_line(self, channel: Channel) -> str:
+        self._line, self._cursor = [], 0
+        while 1:
+            echo, done = self._process()
+            if echo:
+                send_to_channel(channel, echo, suffix=b"")
+            if done:
+                return "".join(self._line)
+            content = channel.recv(self.recv_size)
+            logger.debug(f"channel recv {len(content)} bytes.")
+            if not content:
+                # channel closed
+                raise UserCancelException()
+            self._pending.extend(content)
+
+    def typed_ahead(self) -> bytes:
+        """bytes received after the last line, they belong to whoever reads the channel next."""
+        data, self._pending = bytes(self._pending), bytearray()
+        if self._skip_lf and data[:1] == b"\n":
+            data = data[1:]
+        self._skip_lf = False
+        return data
+
+    def _process(self) -> Tuple[str, bool]:
+        """handle pending bytes, returns the echo of them, and whether a line is finished."""
+        buf, pos, echo = self._pending, 0, []
+        try:
+            while pos < len(buf):
+                byte = bytes(buf[pos : pos + 1])
+                if self._skip_lf:
+                    self._skip_lf = False
+                    if byte == b"\n":
+                        pos += 1
+                        continue
+                if byte in (b"\x03", b"\x04"):
+                    pos += 1
+                    raise UserCancelException()
+                if byte in (b"\r", b"\n"):
+                    pos += 1
+                    self._skip_lf = byte == b"\r"
+                    echo.append("\r\n")
+                    return "".join(echo), True
+                if byte == b"\x1b":
+                    length, key = _parse_escape_sequence(buf, pos)
+                    if not length:
+                        break
+                    pos += length
+                    if key:
+                        echo.append(self._edit(key))
+                    continue
+                if byte in CONTROL_KEYS:
+                    pos += 1
+                    echo.append(self._edit(CONTROL_KEYS[byte]))
+                    continue
+                if buf[pos] < 0x20:
+                    pos += 1
+                    continue
+                end = pos + 1
+                while end < len(buf) and buf[end] >= 0x20 and buf[end] != 0x7F:
+                    end += 1
+                echo.append(self._insert(self._decoder.decode(bytes(buf[pos:end]))))
+                pos = end
+            return "".join(echo), False
+        finally:
+            del buf[:pos]
+
+    def _insert(self, text: str) -> str:
+        if not text:
+            # part of a multibyte character, wait for the rest of it.
+            return ""
+        self._line[self._cursor : self._cursor] = text
+        self._cursor += len(text)
+        tail = "".join(self._line[self._cursor :])
+        return text + tail + _move_cursor(-len(tail))
+
+    def _edit(self, key: str) -> str:
+        line, cursor = self._line, self._cursor
+        if key == "left" and cursor > 0:
+            self._cursor -= 1
+            return _move_cursor(-1)
+        if key == "right" and cursor < len(line):
+            self._cursor += 1
+            return _move_cursor(1)
+        if key == "home":
+            self._cursor = 0
+            return _move_cursor(-cursor)
+        if key == "end":
+            self._cursor = len(line)
+            return _move_cursor(len(line) - cursor)
+        if key == "backspace" and cursor > 0:
+            del line[cursor - 1]
+            self._cursor -= 1
+            tail = "".join(line[self._cursor :])
+            return "\x08" + tail + "\x1b[K" + _move_cursor(-len(tail))
+        if key == "delete" and cursor < len(line):
+            del line[cursor]
+            tail = "".join(line[cursor:])
+            return tail + "\x1b[K" + _move_cursor(-len(tail))
+        if key == "kill_head" and cursor > 0:
+            del line[:cursor]
+            self._cursor = 0
+            rest = "".join(line)
+            return _move_cursor(-cursor) + rest + "\x1b[K" + _move_cursor(-len(rest))
+        if key == "kill_tail":
+            del line[cursor:]
+            return "\x1b[K"
+        return ""
+
+
+def _line_editor(channel: Channel) -> LineEditor:
+    """the editor of the connection for a ``BufferedChannel``, it keeps what the user has typed ahead."""
+    if not isinstance(channel, BufferedChannel):
+        return LineEditor()
+    if channel.line_editor is None:
+        channel.line_editor = LineEditor()
+    return channel.line_editor
+
+
+def read_user_input_line(channel: Channel) -> str:
+    """bytes typed after the line are kept for the next line only if ``channel`` is a ``BufferedChannel``."""
+    return _line_editor(channel).read_line(channel)
+
+
+def take_typed_ahead(channel: Channel) -> bytes:
+    """bytes the user has sent after the last line read from the channel, e.g. a command following a menu answer."""
+    if not isinstance(channel, BufferedChannel) or channel.line_editor is None:
+        return b""
+    return channel.line_editor.typed_ahead()
 
 
 @unique
 class KeyTypeSupport(Enum):
     # openssh ssh-keygen: The default length is 3072 bits (RSA) or 256 bits (ECDSA).
-    # todo default length of DSS/ED25519
+    # ED25519 keys have a fixed length.
     RSA = "RSA", 3072
     DSS = "DSS", 1024
     ED25519 = "ED25519", 256
@@ -255,9 +574,17 @@ def generate_ssh_key_pair(key_type: KeyTypeSupport = KeyTypeSupport.RSA, key_len
         key = paramiko.DSSKey.generate(bits=_key_length)
     elif key_type == KeyTypeSupport.ECDSA:
         key = paramiko.ECDSAKey.generate(bits=_key_length)
-    elif key_type == KeyTypeSupport.Ed25519:
-        # Todo
-        raise UnsupportedPrivateKeyTypeException()
+    elif key_type == KeyTypeSupport.ED25519:
+        # paramiko can not generate ed25519 keys, nor write them, they are in the openssh format only.
+        pri_key = (
+            Ed25519PrivateKey.generate()
+            .private_bytes(
+                serialization.Encoding.PEM, serialization.PrivateFormat.OpenSSH, serialization.NoEncryption()
+            )
+            .decode()
+        )
+        key = paramiko.Ed25519Key.from_private_key(StringIO(pri_key))
+        return pri_key, f"{key.get_name()} {key.get_base64()}"
     else:
         raise UnsupportedPrivateKeyTypeException()
 
@@ -266,6 +593,31 @@ def generate_ssh_key_pair(key_type: KeyTypeSupport = KeyTypeSupport.RSA, key_len
     return out.getvalue(), f"{key.get_name()} {key.get_base64()}"
 
 
+def file_signature(path: Path) -> Optional[Tuple[int, int, int, int]]:
+    """
+    What changes whenever the file is written or replaced, ``None`` if it can not be stat-ed.
+
+    Compared with the one taken last time, a file is read again only when it has changed.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def atomic_write(path: Path, content: str):
+    """
+    Replace the file at once, readers that don't take the writer's lock never see a half-written one.
+
+    The content is written to a temporary file next to it first, then renamed over it.
+    """
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
 def write_key_to_file(
     pri_key: str, pub_key: str, key_type: KeyTypeSupport, save_path: Path, key_name: str = None
 ) -> Tuple[str, str]:
@@ -0,0 +1,105 @@
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from multiprocessing.connection import wait
+from multiprocessing.managers import BaseManager
+from typing import Callable, Dict, Optional, Tuple
+
+from lobbyboy.utils import SessionCounter, detached_session_counter, session_counter
+
+logger = logging.getLogger(__name__)
+
+# a worker died within this seconds after start is considered crashing, wait a while before respawn it.
+MIN_WORKER_LIFE = 5
+RESPAWN_DELAY = 1
+
+# fork is required, the children inherit providers, host keys and the listening socket from the master.
+mp_context = multiprocessing.get_context("fork")
+
+
+class LobbyBoyManager(BaseManager):
+    pass
+
+
+LobbyBoyManager.register("SessionCounter", SessionCounter)
+
+
+def share_session_counter() -> LobbyBoyManager:
+    """
+    Start a manager process holding the session counters, make ``session_counter`` and ``detached_session_counter``
+    of this process (and the processes forked later) use it.
+    """
+    manager = LobbyBoyManager(ctx=mp_context)
+    manager.start()
+    session_counter.share(manager.SessionCounter())
+    detached_session_counter.share(manager.SessionCounter())
+    logger.info(f"session counter is shared by manager process {manager._process.pid}.")  # noqa
+    return manager
+
+
+class WorkerSupervisor:
+    """
+    Run every registered role in its own process, restart it when it dies.
+    """
+
+    def __init__(self):
+        # name -> (target, cpu to pin on)
+        self._roles: Dict[str, Tuple[Callable[[], None], Optional[int]]] = {}
+        self._processes: Dict[str, multiprocessing.Process] = {}
+        self._started_at: Dict[str, float] = {}
+
+    def add(self, name: str, target: Callable[[], None], cpu: int = None):
+        self._roles[name] = (target, cpu)
+
+    def _spawn(self, name: str):
+        target, cpu = self._roles[name]
+        process = mp_context.Process(target=self._run_role, args=(name, target, cpu), name=name)
+        process.start()
+        self._processes[name] = process
+        self._started_at[name] = time.monotonic()
+        logger.info(f"started {name}, pid={process.pid}, cpu={cpu if cpu is not None else 'any'}.")
+
+    @staticmethod
+    def _run_role(name: str, target: Callable[[], None], cpu: Optional[int]):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        if cpu is not None:
+            os.sched_setaffinity(0, {cpu})
+        logger.info(f"{name} running, pid={os.getpid()}.")
+        target()
+
+    def run(self):
+        """start all roles and watch them until lobbyboy is asked to exit."""
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        for name in self._roles:
+            self._spawn(name)
+        try:
+            while 1:
+                self._watch()
+        finally:
+            self.stop()
+
+    def _watch(self):
+        sentinels = {p.sentinel: name for name, p in self._processes.items()}
+        for sentinel in wait(list(sentinels)):
+            name = sentinels[sentinel]
+            process = self._processes[name]
+            process.join()
+            logger.error(f"{name} (pid={process.pid}) exited with code {process.exitcode}, respawn it.")
+            # the sessions it was relaying are gone with it.
+            session_counter.forget(process.pid)
+            detached_session_counter.forget(process.pid)
+            if time.monotonic() - self._started_at[name] < MIN_WORKER_LIFE:
+                time.sleep(RESPAWN_DELAY)
+            self._spawn(name)
+
+    def stop(self):
+        for name, process in self._processes.items():
+            if process.is_alive():
+                logger.info(f"stopping {name}, pid={process.pid}...")
+                process.terminate()
+        for process in self._processes.values():
+            process.join()
@@ -0,0 +1,105 @@
+import fcntl
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# new workspaces go to ``<provider workspace>/<year>/<month>/<server name>``.
+SHARD_FORMAT = "%Y/%m"
+SHARD_PATTERN = re.compile(r"\d{4}")
+# name -> workspace index, every entry is a symlink to the workspace of the name, relative to the provider workspace.
+NAMES_DIR = ".names"
+
+
+class WorkspaceAllocator:
+    """
+    Server names of one provider, and where their workspaces are.
+
+    A name is taken once it is in the index (``NAMES_DIR``), names are reserved by creating their entry there,
+    which only one thread or process can do. Names known to be taken are kept in memory, so trying candidates
+    costs nothing for them.
+
+    Workspaces of data dirs from before the sharded layout stay where they are (``<provider workspace>/<name>``),
+    they are put in the index the first time it is needed.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.names_dir = root.joinpath(NAMES_DIR)
+        # name -> workspace, None if it is not resolved yet.
+        self._names: Optional[Dict[str, Optional[Path]]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Optional[Path]]:
+        if self._names is None:
+            if not self.names_dir.exists():
+                self._migrate()
+            self._names = dict.fromkeys(os.listdir(self.names_dir))
+        return self._names
+
+    def _migrate(self):
+        """index the workspaces of the flat layout, once, by the first process getting here."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root.joinpath(f"{NAMES_DIR}.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self.names_dir.exists():
+                    return
+                tmp_dir = self.root.joinpath(f"{NAMES_DIR}.tmp")
+                tmp_dir.mkdir(exist_ok=True)
+                legacy = [
+                    p.name
+                    for p in self.root.iterdir()
+                    if p.is_dir() and not p.name.startswith(".") and not SHARD_PATTERN.fullmatch(p.name)
+                ]
+                for name in legacy:
+                    if not tmp_dir.joinpath(name).is_symlink():
+                        os.symlink(Path("..", name), tmp_dir.joinpath(name))
+                os.rename(tmp_dir, self.names_dir)
+                logger.info(f"indexed {len(legacy)} workspaces under {self.root}.")
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def allocate(self, candidates: Iterable[str]) -> Optional[Tuple[str, Path]]:
+        """
+        Reserve the first name of ``candidates`` not taken yet, its workspace is created.
+
+        Returns:
+            tuple(str, Path): (name, workspace), None if all of them are taken.
+        """
+        shard = datetime.now().strftime(SHARD_FORMAT)
+        with self._lock:
+            names = self._load()
+            for name in candidates:
+                if name in names:
+                    continue
+                workspace = self.root.joinpath(shard, name)
+                try:
+                    os.symlink(Path("..", shard, name), self.names_dir.joinpath(name))
+                except FileExistsError:
+                    # taken by another process.
+                    names[name] = None
+                    continue
+                workspace.mkdir(parents=True, exist_ok=True)
+                names[name] = workspace
+                return name, workspace
+        return None
+
+    def workspace(self, name: str) -> Path:
+        """the workspace of ``name``, in the flat layout if it is not in the index."""
+        with self._lock:
+            names = self._load()
+            workspace = names.get(name)
+            if workspace is None:
+                try:
+                    workspace = self.names_dir.joinpath(os.readlink(self.names_dir.joinpath(name)))
+                    workspace = Path(os.path.normpath(workspace))
+                except OSError:
+                    return self.root.joinpath(name)
+                names[name] = workspace
+            return workspace
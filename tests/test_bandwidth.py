@@ -0,0 +1,39 @@
+import math
+
+from lobbyboy.bandwidth import (
+    MIN_ALLOWANCE,
+    TRAFFIC_TIME_CONSTANT,
+    TokenBucket,
+    TrafficMeter,
+    session_limiter,
+)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=1000, burst=2000)
+    now = bucket.updated
+    assert bucket.available(now) == 2000
+
+    bucket.consume(3000, now)
+    assert bucket.allowance(now) == 0
+    # until at least a packet worth of bytes is allowed.
+    assert bucket.wait_time(now) == (1000 + MIN_ALLOWANCE) / 1000
+    assert bucket.allowance(now + 2.5) == 1500
+    # refilled, but never more than the burst.
+    assert bucket.available(now + 100) == 2000
+
+
+def test_unlimited_token_bucket():
+    bucket = TokenBucket()
+    bucket.consume(1 << 40, bucket.updated)
+    assert bucket.available(bucket.updated) == math.inf
+    assert session_limiter(0) is None
+    assert session_limiter(1000).burst == 1000
+
+
+def test_traffic_meter():
+    meter = TrafficMeter()
+    now = meter.updated
+    meter.add(1000, now)
+    assert meter.rate(now) == 1000 / TRAFFIC_TIME_CONSTANT
+    assert meter.rate(now + TRAFFIC_TIME_CONSTANT) < meter.rate(now) / 2
@@ -0,0 +1,89 @@
+import threading
+import time
+from unittest import mock
+
+from lobbyboy.channel_writer import BufferedChannel
+from lobbyboy.utils import choose_option, read_user_input_line, send_to_channel
+
+
+def test_buffer_until_flush():
+    channel = mock.MagicMock()
+    buffered = BufferedChannel(channel, max_latency=10)
+    send_to_channel(buffered, "line 1")
+    send_to_channel(buffered, "line 2")
+    channel.sendall.assert_not_called()
+
+    buffered.flush()
+    channel.sendall.assert_called_once_with(b"line 1\r\nline 2\r\n")
+
+
+def test_flush_before_recv():
+    channel = mock.MagicMock()
+    channel.recv.return_value = b"1"
+    buffered = BufferedChannel(channel, max_latency=10)
+    send_to_channel(buffered, "choose: ", suffix=b"")
+
+    assert buffered.recv(1024) == b"1"
+    assert channel.mock_calls[:2] == [mock.call.sendall(b"choose: "), mock.call.recv(1024)]
+
+
+def test_flush_when_buffer_full():
+    channel = mock.MagicMock()
+    buffered = BufferedChannel(channel, max_latency=10, max_buffer=8)
+    buffered.sendall(b"1234")
+    buffered.sendall(b"5678")
+    channel.sendall.assert_called_once_with(b"12345678")
+
+
+def test_flush_on_timer():
+    channel = mock.MagicMock()
+    buffered = BufferedChannel(channel, max_latency=0.01)
+    send_to_channel(buffered, ".", suffix=b"")
+
+    deadline = time.time() + 5
+    while not channel.sendall.called and time.time() < deadline:
+        time.sleep(0.01)
+    channel.sendall.assert_called_once_with(b".")
+
+
+def test_one_flusher_for_progress_output():
+    channel = mock.MagicMock()
+    flushers = set()
+    channel.sendall.side_effect = lambda data: flushers.add(threading.current_thread())
+    buffered = BufferedChannel(channel, max_latency=0.01)
+    for _ in range(5):
+        send_to_channel(buffered, ".", suffix=b"")
+        time.sleep(0.03)
+    # every dot is sent on time, by the same thread.
+    assert len(flushers) == 1
+    assert b"".join(c.args[0] for c in channel.sendall.call_args_list) == b"....."
+
+
+def test_write_while_sending():
+    channel = mock.MagicMock()
+    sending, release = threading.Event(), threading.Event()
+    channel.sendall.side_effect = lambda data: sending.set() or release.wait(5)
+    buffered = BufferedChannel(channel, max_latency=10)
+    buffered.sendall(b"menu")
+    flusher = threading.Thread(target=buffered.flush)
+    flusher.start()
+    assert sending.wait(5)
+
+    # the channel is stuck (e.g. its window is full), lobbyboy can still write.
+    start = time.monotonic()
+    buffered.sendall(b"more")
+    assert time.monotonic() - start < 1
+    release.set()
+    flusher.join(5)
+    buffered.flush()
+    assert [c.args[0] for c in channel.sendall.call_args_list] == [b"menu", b"more"]
+
+
+def test_read_menu_input():
+    # what handler threads read the user's answers from.
+    channel = mock.MagicMock()
+    channel.recv.side_effect = [b"9\r1\r", b"hello\r"]
+    buffered = BufferedChannel(channel, max_latency=10)
+    assert choose_option(buffered, ["a", "b"]) == 1
+    assert read_user_input_line(buffered) == "hello"
+    assert b"You selected: b" in b"".join(c.args[0] for c in channel.sendall.call_args_list)
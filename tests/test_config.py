@@ -1,6 +1,13 @@
+from binascii import hexlify
 from pathlib import Path
+from unittest import mock
 
-from lobbyboy.config import LBConfig
+import paramiko
+import pytest
+
+from lobbyboy.config import AuthorizedKeyIndex, LBConfig, LBConfigUser, LBConfigWatcher
+from lobbyboy.exceptions import InvalidConfigException
+from lobbyboy.utils import KeyTypeSupport
 
 PARENT_DIR = Path(__file__).parent
 CONFIG_FILE = PARENT_DIR.parent / "lobbyboy" / "conf" / "lobbyboy_config.toml"
@@ -13,3 +20,108 @@ def test_load_config():
 def test_load_providers_from_config():
     config = LBConfig.load(CONFIG_FILE)
     assert len(config.provider_cls) > 0
+
+
+def test_config_watcher_reload_only_when_file_changed(tmp_path):
+    config_file = tmp_path / "config.toml"
+    config_file.write_text(CONFIG_FILE.read_text())
+    watcher = LBConfigWatcher(LBConfig.load(config_file))
+
+    snapshot = watcher.config
+    with mock.patch.object(LBConfig, "load") as load:
+        assert watcher.config is snapshot
+        load.assert_not_called()
+
+    with open(config_file, "a") as f:
+        f.write('\n[user.Zero]\npassword = "Moustafa"\n')
+    reloaded = watcher.config
+    assert reloaded is not snapshot
+    assert reloaded.user["Zero"].password == "Moustafa"
+    assert "Zero" not in snapshot.user
+    assert watcher.config is reloaded
+
+
+def test_config_watcher_keep_last_good_config(tmp_path):
+    config_file = tmp_path / "config.toml"
+    config_file.write_text(CONFIG_FILE.read_text())
+    watcher = LBConfigWatcher(LBConfig.load(config_file))
+    snapshot = watcher.config
+
+    config_file.write_text("this is not toml [")
+    assert watcher.config is snapshot
+
+
+def test_authorized_key_index():
+    key, other_key = paramiko.ECDSAKey.generate(), paramiko.ECDSAKey.generate()
+    user = LBConfigUser(authorized_keys=f"\n# my laptop\n{key.get_name()} {key.get_base64()} gustave@laptop\n")
+    index = AuthorizedKeyIndex({"Gustave": user, "Zero": LBConfigUser()})
+
+    assert user.auth_key_pairs() == [(key.get_name(), key.get_base64())]
+    assert index.accept("Gustave", key.get_name(), key.asbytes())
+    assert not index.accept("Zero", key.get_name(), key.asbytes())
+    assert not index.accept("Gustave", other_key.get_name(), other_key.asbytes())
+    assert index.fingerprint(key.asbytes()) == hexlify(key.get_fingerprint()).decode()
+    assert index.users_of(key.asbytes()) == ["Gustave"]
+    assert index.users_of(other_key.asbytes()) == []
+
+
+def test_user_transport_profile(tmp_path):
+    config_file = tmp_path / "config.toml"
+    config_file.write_text(
+        'data_dir = "./dev_datadir"\n'
+        '[transport]\nciphers = ["aes128-ctr"]\n'
+        '[user.Gustave]\npassword = "Fiennes"\n'
+        '[user.Zero]\npassword = "Moustafa"\n[user.Zero.transport]\ncompression = true\nwindow_size = 8388608\n'
+    )
+    config = LBConfig.load(config_file)
+
+    assert config.transport_profile("Gustave") is config.transport
+    profile = config.transport_profile("Zero")
+    assert (profile.ciphers, profile.compression, profile.window_size) == (["aes128-ctr"], True, 8388608)
+
+
+def test_unknown_user_transport_config(tmp_path):
+    config_file = tmp_path / "config.toml"
+    config_file.write_text(CONFIG_FILE.read_text() + "\n[user.Zero.transport]\nwindow = 1\n")
+    with pytest.raises(InvalidConfigException):
+        LBConfig.load(config_file)
+
+
+def test_host_key_types(tmp_path):
+    config_file = tmp_path / "config.toml"
+    config_file.write_text(CONFIG_FILE.read_text().replace('host_key_types = ["ed25519", "ecdsa", "rsa"]', ""))
+    assert LBConfig.load(config_file).host_key_type_list == [
+        KeyTypeSupport.ED25519,
+        KeyTypeSupport.ECDSA,
+        KeyTypeSupport.RSA,
+    ]
+
+    config_file.write_text(CONFIG_FILE.read_text().replace('"ed25519", "ecdsa", "rsa"', '"dss"'))
+    with pytest.raises(InvalidConfigException):
+        LBConfig.load(config_file)
+
+
+def test_servers_backend(tmp_path):
+    config_file = tmp_path / "config.toml"
+    config_file.write_text(CONFIG_FILE.read_text().replace('servers_backend = "json"', 'servers_backend = "redis"'))
+    with pytest.raises(InvalidConfigException):
+        LBConfig.load(config_file)
+
+
+def test_user_bandwidth_profile(tmp_path):
+    config_file = tmp_path / "config.toml"
+    config_file.write_text(
+        'data_dir = "./dev_datadir"\n'
+        "[bandwidth]\nsession_rate = 1000\nglobal_rate = 5000\n"
+        '[user.Gustave]\npassword = "Fiennes"\n'
+        '[user.Zero]\npassword = "Moustafa"\n[user.Zero.bandwidth]\nsession_rate = 0\n'
+    )
+    config = LBConfig.load(config_file)
+
+    assert config.bandwidth_profile("Gustave").session_rate == 1000
+    profile = config.bandwidth_profile("Zero")
+    assert (profile.session_rate, profile.global_rate) == (0, 5000)
+
+    config_file.write_text(config_file.read_text() + "global_rate = 1\n")
+    with pytest.raises(InvalidConfigException):
+        LBConfig.load(config_file)
@@ -0,0 +1,55 @@
+import threading
+from unittest import mock
+
+from lobbyboy.config import LBServerMeta
+from lobbyboy.detach import DetachedSession, DetachedSessions
+from lobbyboy.utils import detached_session_counter
+
+
+def detached_session(username: str, server_name: str) -> DetachedSession:
+    meta = LBServerMeta(provider_name="fake", workspace=None, server_name=server_name)
+    return DetachedSession(username, meta, session=mock.MagicMock(), server=mock.MagicMock())
+
+
+def test_claim_detached_session():
+    sessions = DetachedSessions()
+    first, second = detached_session("Gustave", "srv-1"), detached_session("Gustave", "srv-2")
+    sessions.add(first, 60, on_expire=mock.MagicMock())
+    sessions.add(second, 60, on_expire=mock.MagicMock())
+    sessions.add(detached_session("Zero", "srv-1"), 60, on_expire=mock.MagicMock())
+    assert detached_session_counter.count("srv-1") == 2
+
+    assert sessions.of_user("Gustave") == [second, first]
+    assert sessions.claim(first)
+    assert not sessions.claim(first)
+    assert detached_session_counter.count("srv-1") == 1
+    sessions.discard(second.session)
+    assert sessions.of_user("Gustave") == []
+
+
+def test_detached_session_expire():
+    sessions = DetachedSessions()
+    detached = detached_session("Gustave", "srv-3")
+    expired = threading.Event()
+    sessions.add(detached, 0.01, on_expire=lambda session: expired.set())
+
+    assert expired.wait(5)
+    assert not sessions.claim(detached)
+    assert detached_session_counter.count("srv-3") == 0
+
+
+def test_detached_session_counted_before_published():
+    sessions = DetachedSessions()
+    detached = detached_session("Gustave", "srv-4")
+    visible = []
+
+    def add(*args):
+        # a claim from now on must take the session off the counter.
+        visible.append(sessions.of_user("Gustave"))
+        return "session-id"
+
+    with mock.patch.object(detached_session_counter, "add", side_effect=add):
+        sessions.add(detached, 60, on_expire=mock.MagicMock())
+    assert visible == [[]]
+    assert sessions.of_user("Gustave")[0].session_id == "session-id"
+    sessions.discard(detached.session)
@@ -0,0 +1,24 @@
+import threading
+
+from lobbyboy import footprint
+from lobbyboy.server import Server
+
+
+def test_footprint_of_sessions():
+    baseline = footprint.take()
+    assert baseline.threads >= 1 and baseline.fds > 0 and baseline.rss > 0
+
+    now = footprint.Footprint(sessions=10, threads=baseline.threads + 10, fds=baseline.fds + 50, rss=baseline.rss)
+    report = footprint.report(baseline, now)
+    assert "footprint of 10 sessions" in report
+    assert "threads: " in report and "+10, 1.0 per session" in report
+    assert "+50, 5.0 per session" in report
+
+
+def test_server_wait_for_requests():
+    server = Server(config_watcher=None)
+    assert not server.wait_for("pty", 0.01)
+    # the shell request waits for the pty.
+    threading.Timer(0.05, server.check_channel_pty_request, [None, "xterm", 80, 24, 0, 0, b""]).start()
+    assert server.check_channel_shell_request(None)
+    assert server.pty_requested and server.wait_for("shell", 0)
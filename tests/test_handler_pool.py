@@ -0,0 +1,50 @@
+import time
+from unittest import mock
+
+from lobbyboy.exceptions import HandshakeTimeoutException
+from lobbyboy.handler_pool import HandlerPool
+
+
+def wait_until(predicate, timeout: float = 5) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_reject_when_queue_is_full():
+    pool = HandlerPool(handler_factory=mock.MagicMock(), max_workers=1, queue_size=1, handshake_timeout=10)
+    first, second = mock.MagicMock(), mock.MagicMock()
+
+    assert pool.submit(first, ("127.0.0.1", 1)) is True
+    assert pool.submit(second, ("127.0.0.1", 2)) is False
+    second.close.assert_called_once()
+    assert pool.stats.accepted == 1
+    assert pool.stats.queued == 1
+    assert pool.stats.rejected == 1
+
+
+def test_start_handler_after_handshake():
+    handler = mock.MagicMock()
+    handler.handshake.return_value = True
+    pool = HandlerPool(handler_factory=lambda *_: handler, max_workers=1, queue_size=1, handshake_timeout=10)
+    pool.start()
+
+    pool.submit(mock.MagicMock(), ("127.0.0.1", 1))
+    assert wait_until(lambda: handler.start.called)
+    assert pool.stats.queued == 0
+
+
+def test_shed_timed_out_connection():
+    handler = mock.MagicMock()
+    handler.handshake.side_effect = HandshakeTimeoutException("client never asked for a shell")
+    pool = HandlerPool(handler_factory=lambda *_: handler, max_workers=1, queue_size=1, handshake_timeout=10)
+    pool.start()
+
+    sock = mock.MagicMock()
+    pool.submit(sock, ("127.0.0.1", 1))
+    assert wait_until(lambda: pool.stats.timed_out == 1)
+    sock.close.assert_called()
+    handler.start.assert_not_called()
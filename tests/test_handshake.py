@@ -0,0 +1,101 @@
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from lobbyboy.config import LBConfig, LBConfigWatcher
+from lobbyboy.exceptions import HandshakeTimeoutException
+from lobbyboy.handshake import HandshakeContext
+from lobbyboy.socket_handle import SocketHandlerThread
+from lobbyboy.utils import KeyTypeSupport
+
+CONFIG_FILE = Path(__file__).parent.parent / "lobbyboy" / "conf" / "lobbyboy_config.toml"
+
+
+@pytest.fixture
+def handshake_context(tmp_path):
+    with mock.patch("socket.getfqdn", return_value="lobbyboy.test"):
+        yield HandshakeContext(tmp_path)
+
+
+def test_host_keys_generated_once(handshake_context, tmp_path):
+    for key_name in ("ssh_host_ed25519_key", "ssh_host_ecdsa_key", "ssh_host_rsa_key"):
+        assert tmp_path.joinpath(key_name).exists()
+    host_keys = handshake_context.host_keys()
+    assert [key.get_name() for key in host_keys] == ["ssh-ed25519", "ecdsa-sha2-nistp256", "ssh-rsa"]
+    assert handshake_context.host_keys() is host_keys
+
+
+def test_serve_chosen_host_key_types(tmp_path):
+    with mock.patch("socket.getfqdn", return_value="lobbyboy.test"):
+        context = HandshakeContext(tmp_path, [KeyTypeSupport.ED25519])
+    assert [key.get_name() for key in context.host_keys()] == ["ssh-ed25519"]
+    assert not tmp_path.joinpath("ssh_host_rsa_key").exists()
+
+
+def test_host_keys_reloaded_after_key_file_changed(handshake_context, tmp_path):
+    host_keys = handshake_context.host_keys()
+    st = tmp_path.joinpath("ssh_host_rsa_key").stat()
+    os.utime(tmp_path.joinpath("ssh_host_rsa_key"), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    reloaded = handshake_context.host_keys()
+    assert reloaded is not host_keys
+    assert reloaded == host_keys
+
+
+def test_prepare_transport(handshake_context):
+    transport = mock.MagicMock()
+    handshake_context.prepare(transport)
+    transport.set_gss_host.assert_called_once_with("lobbyboy.test")
+    assert transport.add_server_key.call_args_list == [mock.call(key) for key in handshake_context.host_keys()]
+
+
+def test_handshake_bounded_by_deadline(handshake_context):
+    client, sock = socket.socketpair()
+    handler = SocketHandlerThread(
+        sock,
+        ("127.0.0.1", 1),
+        LBConfigWatcher(LBConfig.load(CONFIG_FILE)),
+        providers={},
+        relay=mock.MagicMock(),
+        handshake_context=handshake_context,
+    )
+
+    def slow_loris():
+        # paramiko waits 2 seconds for every line before the banner, up to 100 lines.
+        try:
+            while True:
+                client.sendall(b"hello\r\n")
+                time.sleep(1)
+        except OSError:
+            pass
+
+    threading.Thread(target=slow_loris, daemon=True).start()
+    start = time.monotonic()
+    with mock.patch("lobbyboy.socket_handle.DoGSSAPIKeyExchange", False), pytest.raises(HandshakeTimeoutException):
+        handler.handshake(time.monotonic() + 0.5)
+    assert time.monotonic() - start < 2
+    client.close()
+
+
+def test_destroy_server_before_handshake(handshake_context):
+    handler = SocketHandlerThread(
+        socket.socketpair()[1],
+        ("127.0.0.1", 1),
+        LBConfigWatcher(LBConfig.load(CONFIG_FILE)),
+        providers={"fake": mock.MagicMock()},
+        relay=mock.MagicMock(),
+        handshake_context=handshake_context,
+    )
+    handler.channel = mock.MagicMock(closed=False)
+    handler.killer = mock.MagicMock()
+    handler.killer.need_destroy.return_value = (True, "is going to be destroyed")
+    server = mock.MagicMock(provider_name="fake")
+    # no ``Server`` yet, the user is told as an interactive one.
+    assert handler.server is None
+    handler.destroy_server_if_needed(server)
+    handler.killer.destroy.assert_called_once_with(handler.providers["fake"], server, handler.channel)
@@ -0,0 +1,41 @@
+import gzip
+import json
+from pathlib import Path
+
+from lobbyboy.config import LBServerMeta
+from lobbyboy.contrib.provider.footloose import FootlooseConfig, FootlooseProvider
+from lobbyboy.payloads import PayloadStore
+
+
+def test_payload_store(tmp_path):
+    store = PayloadStore(tmp_path / "raw_servers.jsonl.gz")
+    first = store.save("first", {"id": 1, "networks": {"v4": ["10.0.0.1"]}, "workspace": Path("/tmp")})
+    second = store.save("second", {"id": 2})
+    assert store.load(second) == {"id": 2}
+    assert store.load(first) == {"id": 1, "networks": {"v4": ["10.0.0.1"]}, "workspace": "/tmp"}
+    # one gzip stream, readable by any gzip tool.
+    with gzip.open(store.path, "rt") as f:
+        assert [json.loads(line)["server_name"] for line in f] == ["first", "second"]
+
+    # torn by a crash.
+    with open(store.path, "ab") as f:
+        data = gzip.compress(b'{"server_name": "third", "payload": {"id": 3, "name": "third"}}\n')
+        f.write(data[: len(data) // 2])
+    assert [name for name, _ in store.export()] == ["first", "second"]
+
+
+def test_provider_field(tmp_path):
+    provider = FootlooseProvider(name="footloose", config=FootlooseConfig(), workspace=tmp_path)
+    meta = LBServerMeta(
+        provider_name="footloose",
+        workspace=tmp_path,
+        server_name="new",
+        provider_data=provider.save_payload("new", {"id": 42, "region": "sgp1"}, id=42),
+    )
+    assert provider.provider_field(meta, "id") == 42
+    assert provider.provider_field(meta, "region") == "sgp1"
+
+    # servers created before the payload store.
+    provider.save_raw_server({"id": 7}, tmp_path)
+    old = LBServerMeta(provider_name="footloose", workspace=tmp_path, server_name="old")
+    assert provider.provider_field(old, "id") == 7
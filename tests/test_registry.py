@@ -0,0 +1,123 @@
+import threading
+
+import pytest
+
+from lobbyboy.config import LBServerMeta, load_local_servers, update_local_servers
+from lobbyboy.registry import (
+    JournalServerRegistry,
+    JsonServerRegistry,
+    SQLiteServerRegistry,
+)
+from lobbyboy.routing import find_server
+
+
+def meta(name, provider_name="vagrant", created_timestamp=1000, **kwargs):
+    return LBServerMeta(
+        provider_name=provider_name, workspace=None, server_name=name, created_timestamp=created_timestamp, **kwargs
+    )
+
+
+@pytest.fixture(params=["json", "sqlite", "journal"])
+def registry(request, tmp_path):
+    if request.param == "json":
+        return JsonServerRegistry(tmp_path / "available_servers_db.json")
+    if request.param == "journal":
+        return JournalServerRegistry(tmp_path / "available_servers_db.json", compact_after=5)
+    return SQLiteServerRegistry(tmp_path / "available_servers_db.sqlite3")
+
+
+def test_registry(registry):
+    assert len(registry) == 0 and registry.get("first") is None
+    registry.add(meta("first", created_timestamp=3000))
+    registry.add(meta("second", "multipass", created_timestamp=1000))
+    registry.add(meta("third", created_timestamp=2000))
+    # replaced servers keep their place.
+    registry.add(meta("first", created_timestamp=3000, server_host="10.0.0.1"))
+
+    assert list(registry) == ["first", "second", "third"]
+    assert len(registry) == 3 and "second" in registry and "fourth" not in registry
+    assert registry["first"].server_host == "10.0.0.1"
+    assert registry.provider_names() == {"vagrant", "multipass"}
+    assert list(registry.servers(provider_name="vagrant")) == ["first", "third"]
+    assert list(registry.servers(created_until=2000)) == ["second", "third"]
+    assert list(registry.servers(provider_name="vagrant", created_until=2000)) == ["third"]
+    assert find_server(registry, "third").created_timestamp == 2000
+
+    registry.remove(meta("first"))
+    registry.remove(meta("first"))
+    assert list(registry.servers()) == ["second", "third"]
+    assert registry.get("first") is None
+
+
+def test_registry_between_threads(registry):
+    threads = [threading.Thread(target=registry.add, args=(meta(f"server-{i}"),)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(registry) == 8
+
+
+def test_sqlite_migrate_from_json(tmp_path):
+    json_path = tmp_path / "available_servers_db.json"
+    update_local_servers(json_path, new=[meta("first", ssh_extra_args=["-o", "Foo=bar"]), meta("second", manage=False)])
+    db_path = tmp_path / "available_servers_db.sqlite3"
+
+    registry = SQLiteServerRegistry(db_path, json_path)
+    assert list(registry) == ["first", "second"]
+    assert registry["first"].ssh_extra_args == ["-o", "Foo=bar"]
+    assert registry["second"].manage is False
+
+    # only once, when the database is created.
+    registry.remove(meta("first"))
+    assert list(SQLiteServerRegistry(db_path, json_path)) == ["second"]
+
+
+def test_journal_between_processes(tmp_path):
+    servers_db_path = tmp_path / "available_servers_db.json"
+    worker_1 = JournalServerRegistry(servers_db_path, compact_after=4)
+    worker_2 = JournalServerRegistry(servers_db_path, compact_after=4)
+    worker_1.add(meta("first"))
+    worker_2.add(meta("second"))
+    assert list(worker_1) == ["first", "second"]
+
+    # compacted by worker_1, worker_2 rebuilds from the snapshot.
+    worker_1.remove(meta("first"))
+    worker_1.add(meta("third"))
+    assert worker_1.journal_path.stat().st_size == 0
+    assert list(load_local_servers(servers_db_path)) == ["second", "third"]
+    assert list(worker_2) == ["second", "third"]
+    worker_2.add(meta("fourth"))
+    assert list(worker_1) == ["second", "third", "fourth"]
+
+
+def test_journal_truncate_torn_records(tmp_path):
+    servers_db_path = tmp_path / "available_servers_db.json"
+    registry = JournalServerRegistry(servers_db_path)
+    registry.add(meta("first"))
+    registry.add(meta("second"))
+    size = registry.journal_path.stat().st_size
+    with open(registry.journal_path, "ab") as f:
+        f.write(b'{"add": {"provider_name": "vagr')
+
+    # torn by a crash, truncated when the registry is loaded.
+    registry = JournalServerRegistry(servers_db_path)
+    assert list(registry) == ["first", "second"]
+    assert registry.journal_path.stat().st_size == size
+    registry.add(meta("third"))
+    assert list(JournalServerRegistry(servers_db_path)) == ["first", "second", "third"]
+
+
+def test_journal_skip_invalid_records(tmp_path):
+    servers_db_path = tmp_path / "available_servers_db.json"
+    registry = JournalServerRegistry(servers_db_path)
+    registry.add(meta("first"))
+    with open(registry.journal_path, "ab") as f:
+        f.write(b'{"add": {"provider_name": "vagr\n')
+    registry.add(meta("second"))
+
+    # only a torn tail is truncated, records after an invalid one are kept.
+    size = registry.journal_path.stat().st_size
+    registry = JournalServerRegistry(servers_db_path)
+    assert list(registry) == ["first", "second"]
+    assert registry.journal_path.stat().st_size == size
@@ -0,0 +1,299 @@
+import os
+import pty
+import socket
+import subprocess
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from lobbyboy.bandwidth import TokenBucket
+from lobbyboy.relay import ChannelEndpoint, PtyEndpoint, RelayEngine, RelaySession
+
+
+class FakeChannel:
+    """paramiko channel look-alike backed by a socket pair."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.closed = False
+        self.stderr = bytearray()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def recv(self, size):
+        try:
+            return self.sock.recv(size)
+        except BlockingIOError:
+            raise socket.timeout()
+
+    def send(self, data):
+        try:
+            return self.sock.send(data)
+        except BlockingIOError:
+            raise socket.timeout()
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+    def send_stderr(self, data):
+        self.stderr.extend(data)
+        return len(data)
+
+    def shutdown_write(self):
+        self.sock.shutdown(socket.SHUT_WR)
+
+
+def recv_until(sock: socket.socket, expected: bytes, timeout: float = 5) -> bytes:
+    sock.settimeout(timeout)
+    received = b""
+    deadline = time.time() + timeout
+    while expected not in received and time.time() < deadline:
+        received += sock.recv(1024)
+    return received
+
+
+def send_quietly(sock: socket.socket, data: bytes):
+    """``sendall`` in a thread, the test may stop reading and shut the socket down before it is done."""
+    try:
+        sock.sendall(data)
+    except OSError:
+        pass
+
+
+@pytest.fixture
+def relay_engine():
+    engine = RelayEngine()
+    engine.start()
+    yield engine
+
+
+def test_relay_pty_session(relay_engine):
+    master_fd, slave_fd = pty.openpty()
+    process = subprocess.Popen(["cat"], stdin=slave_fd, stdout=slave_fd, stderr=slave_fd, start_new_session=True)
+    os.close(slave_fd)
+
+    user_side, lobbyboy_side = socket.socketpair()
+    closed = threading.Event()
+    session = RelaySession(
+        downstream=ChannelEndpoint(FakeChannel(lobbyboy_side)),
+        upstream=PtyEndpoint(master_fd, process),
+        on_close=lambda _: closed.set(),
+    )
+    relay_engine.attach(session)
+
+    user_side.sendall(b"hello lobbyboy\n")
+    assert b"hello lobbyboy" in recv_until(user_side, b"hello lobbyboy")
+    # a pty is always read with the same size.
+    assert session.upstream not in session.read_sizes
+
+    # user leaves, relay engine should hang up the proxy process.
+    user_side.close()
+    assert closed.wait(5)
+    assert process.poll() is not None
+    assert session not in relay_engine.sessions
+
+
+def test_relay_half_close(relay_engine):
+    user_side, lobbyboy_side = socket.socketpair()
+    server_side, upstream_side = socket.socketpair()
+    closed = threading.Event()
+    session = RelaySession(
+        downstream=ChannelEndpoint(FakeChannel(lobbyboy_side)),
+        upstream=ChannelEndpoint(FakeChannel(upstream_side)),
+        on_close=lambda _: closed.set(),
+        half_close=True,
+    )
+    relay_engine.attach(session)
+
+    # like scp uploading a file: the user sends EOF after the data, then waits for the result.
+    user_side.sendall(b"file content")
+    user_side.shutdown(socket.SHUT_WR)
+    assert recv_until(server_side, b"file content") == b"file content"
+    assert server_side.recv(1024) == b""
+    assert not closed.is_set()
+
+    server_side.sendall(b"uploaded")
+    server_side.close()
+    assert recv_until(user_side, b"uploaded") == b"uploaded"
+    assert closed.wait(5)
+
+
+def test_detach_and_reattach(relay_engine):
+    user_side, lobbyboy_side = socket.socketpair()
+    server_side, upstream_side = socket.socketpair()
+    detached, closed = threading.Event(), threading.Event()
+    session = RelaySession(
+        downstream=ChannelEndpoint(FakeChannel(lobbyboy_side)),
+        upstream=ChannelEndpoint(FakeChannel(upstream_side)),
+        on_detach=lambda _: detached.set(),
+    )
+    relay_engine.attach(session)
+
+    # the user's network drops, the server keeps writing.
+    user_side.close()
+    assert detached.wait(5)
+    server_side.sendall(b"while you were away")
+    time.sleep(0.1)
+    assert session in relay_engine.sessions
+
+    user_side, lobbyboy_side = socket.socketpair()
+    assert relay_engine.reattach(session, ChannelEndpoint(FakeChannel(lobbyboy_side)), on_close=lambda _: closed.set())
+    assert recv_until(user_side, b"away") == b"while you were away"
+    user_side.sendall(b"back")
+    assert recv_until(server_side, b"back") == b"back"
+
+    # the user leaves again, without on_detach the session is closed.
+    user_side.close()
+    assert closed.wait(5)
+    assert not relay_engine.reattach(session, ChannelEndpoint(FakeChannel(socket.socketpair()[0])))
+
+
+def test_reattach_error(relay_engine):
+    session = RelaySession(
+        downstream=ChannelEndpoint(FakeChannel(socket.socketpair()[0])),
+        upstream=ChannelEndpoint(FakeChannel(socket.socketpair()[0])),
+    )
+    downstream = ChannelEndpoint(FakeChannel(socket.socketpair()[0]))
+    # the error in the relay thread goes to the caller, instead of leaving it waiting forever.
+    with mock.patch.object(relay_engine, "_reattach", side_effect=OSError("bad fd")):
+        with pytest.raises(OSError, match="bad fd"):
+            relay_engine.reattach(session, downstream)
+    assert relay_engine.is_alive()
+
+
+def test_reattach_relay_not_running():
+    session = RelaySession(
+        downstream=ChannelEndpoint(FakeChannel(socket.socketpair()[0])),
+        upstream=ChannelEndpoint(FakeChannel(socket.socketpair()[0])),
+    )
+    with pytest.raises(TimeoutError):
+        RelayEngine().reattach(session, ChannelEndpoint(FakeChannel(socket.socketpair()[0])))
+
+
+def socket_session(**kwargs):
+    user_side, lobbyboy_side = socket.socketpair()
+    server_side, upstream_side = socket.socketpair()
+    session = RelaySession(
+        downstream=ChannelEndpoint(FakeChannel(lobbyboy_side)),
+        upstream=ChannelEndpoint(FakeChannel(upstream_side)),
+        **kwargs,
+    )
+    return session, user_side, server_side
+
+
+def test_session_rate_limit(relay_engine):
+    session, user_side, server_side = socket_session(limiter=TokenBucket(rate=100 * 1024, burst=16 * 1024))
+    relay_engine.attach(session)
+
+    start = time.monotonic()
+    threading.Thread(target=server_side.sendall, args=(b"x" * 96 * 1024,), daemon=True).start()
+    received = 0
+    user_side.settimeout(5)
+    while received < 96 * 1024:
+        received += len(user_side.recv(65536))
+    # 16KB at once, then 100KB per second.
+    assert time.monotonic() - start > 0.6
+    assert session.throttled > 0
+    assert relay_engine.throttle_counts["session"] > 0
+
+
+def test_interactive_session_not_held_back_by_global_rate():
+    engine = RelayEngine(global_rate=64 * 1024, global_burst=16 * 1024, bulk_threshold=8 * 1024)
+    engine.start()
+    bulk, bulk_user, bulk_server = socket_session()
+    interactive, user_side, server_side = socket_session()
+    engine.attach(bulk)
+    engine.attach(interactive)
+
+    # like ``cat`` a huge log in one session.
+    sender = threading.Thread(target=send_quietly, args=(bulk_server, b"x" * 1024 * 1024), daemon=True)
+    sender.start()
+    bulk_user.settimeout(5)
+    bulk_user.recv(65536)
+    time.sleep(0.5)
+
+    for _ in range(3):
+        start = time.monotonic()
+        user_side.sendall(b"ls\r")
+        assert recv_until(server_side, b"ls\r") == b"ls\r"
+        server_side.sendall(b"ls\r\n")
+        assert recv_until(user_side, b"\n") == b"ls\r\n"
+        assert time.monotonic() - start < 0.2
+    assert bulk.throttled > 0 and interactive.throttled == 0
+    assert engine.throttle_counts["global"] > 0
+
+    engine.close(bulk)
+    bulk_server.shutdown(socket.SHUT_RDWR)
+    sender.join(5)
+
+
+def test_user_input_not_held_back(relay_engine):
+    session, user_side, server_side = socket_session(limiter=TokenBucket(rate=1024, burst=1024))
+    relay_engine.attach(session)
+
+    # a runaway ``cat``, the user can still stop it.
+    sender = threading.Thread(target=send_quietly, args=(server_side, b"x" * 1024 * 1024), daemon=True)
+    sender.start()
+    user_side.settimeout(5)
+    user_side.recv(65536)
+    time.sleep(0.2)
+    assert session.throttled > 0
+    start = time.monotonic()
+    user_side.sendall(b"\x03")
+    assert recv_until(server_side, b"\x03").endswith(b"\x03")
+    assert time.monotonic() - start < 0.2
+
+    relay_engine.close(session)
+    server_side.shutdown(socket.SHUT_RDWR)
+    sender.join(5)
+
+
+class ShortWriteChannel(FakeChannel):
+    """takes a few bytes at a time, like a channel whose window is nearly used up."""
+
+    def send(self, data):
+        return super().send(data[:100])
+
+
+def test_relay_short_writes(relay_engine):
+    user_side, lobbyboy_side = socket.socketpair()
+    server_side, upstream_side = socket.socketpair()
+    session = RelaySession(
+        downstream=ChannelEndpoint(ShortWriteChannel(lobbyboy_side)),
+        upstream=ChannelEndpoint(FakeChannel(upstream_side)),
+    )
+    relay_engine.attach(session)
+
+    data = bytes(range(256)) * 1024
+    threading.Thread(target=server_side.sendall, args=(data,), daemon=True).start()
+    received = b""
+    user_side.settimeout(5)
+    while len(received) < len(data):
+        received += user_side.recv(65536)
+    assert received == data
+
+
+def test_read_size_follows_throughput():
+    engine = RelayEngine(read_size=1024, max_read_size=8192)
+    engine.start()
+    session, user_side, server_side = socket_session()
+    engine.attach(session)
+
+    threading.Thread(target=server_side.sendall, args=(b"x" * 1024 * 1024,), daemon=True).start()
+    received = 0
+    user_side.settimeout(5)
+    while received < 1024 * 1024:
+        received += len(user_side.recv(65536))
+    assert 1024 < session.read_sizes[session.upstream] <= 8192
+
+    # typing again, reads shrink back.
+    for _ in range(5):
+        server_side.sendall(b"$ ")
+        assert recv_until(user_side, b"$ ") == b"$ "
+    assert session.read_sizes[session.upstream] == 1024
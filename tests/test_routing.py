@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from unittest import mock
+
+import paramiko
+import pytest
+
+from lobbyboy.config import AuthorizedKeyIndex, LBConfigUser, LBServerMeta
+from lobbyboy.exceptions import ProviderException, RoutingException
+from lobbyboy.provider import BaseProvider
+from lobbyboy.routing import Target, find_server, split_command, split_username
+from lobbyboy.server import Server
+
+
+@pytest.mark.parametrize(
+    "login, expected",
+    [
+        ("Gustave", ("Gustave", None)),
+        ("Gustave@srv", ("Gustave", Target(server_name="srv"))),
+        ("Gustave@", ("Gustave", None)),
+        ("@srv", ("", Target(server_name="srv"))),
+        ("do+1", ("", Target(provider_name="do", template="1"))),
+        ("vagrant+", ("", Target(provider_name="vagrant"))),
+        (
+            "Gustave@linode+ap-south:g6-nanode-1:linode/centos7",
+            ("Gustave", Target(provider_name="linode", template="ap-south:g6-nanode-1:linode/centos7")),
+        ),
+    ],
+)
+def test_split_username(login, expected):
+    assert split_username(login) == expected
+
+
+@pytest.mark.parametrize(
+    "command, expected",
+    [
+        (b"uname -a", (None, b"uname -a")),
+        (b"@srv uname -a", (Target(server_name="srv"), b"uname -a")),
+        (b"@srv  scp -t /tmp", (Target(server_name="srv"), b"scp -t /tmp")),
+        (b"@do+ ls", (Target(provider_name="do"), b"ls")),
+        (b"@ ls", (None, b"ls")),
+    ],
+)
+def test_split_command(command, expected):
+    assert split_command(command) == expected
+
+
+def test_find_server():
+    first = LBServerMeta(provider_name="fake", workspace=None, server_name="first")
+    servers = OrderedDict(first=first)
+    assert find_server(servers, None) is first
+    assert find_server(servers, "first") is first
+    with pytest.raises(RoutingException):
+        find_server(servers, "second")
+
+    servers["second"] = LBServerMeta(provider_name="fake", workspace=None, server_name="second")
+    with pytest.raises(RoutingException):
+        find_server(servers, None)
+
+
+def test_choose_template():
+    templates = ["sgp1:s-1vcpu-1gb:ubuntu-21-04-x64", "sfo1:s-1vcpu-1gb:fedora-33-x64"]
+    assert BaseProvider.choose_template(templates, "") == templates[0]
+    assert BaseProvider.choose_template(templates, "2") == templates[1]
+    assert BaseProvider.choose_template(templates, templates[1]) == templates[1]
+    with pytest.raises(ProviderException):
+        BaseProvider.choose_template(templates, "3")
+    with pytest.raises(ProviderException):
+        BaseProvider.choose_template([], "")
+
+
+def test_route_by_key_owner():
+    key = paramiko.ECDSAKey.generate()
+    users = {"Gustave": LBConfigUser(authorized_keys=f"{key.get_name()} {key.get_base64()}", password="Fiennes")}
+    config_watcher = mock.MagicMock()
+    config_watcher.config.user = users
+    config_watcher.config.authorized_key_index = AuthorizedKeyIndex(users)
+    on_authenticated = mock.MagicMock()
+    server = Server(config_watcher, on_authenticated=on_authenticated)
+
+    assert server.check_auth_publickey("@srv", key) == paramiko.common.AUTH_SUCCESSFUL
+    assert (server.username, server.target) == ("Gustave", Target(server_name="srv"))
+    assert server.check_auth_publickey("do+1", key) == paramiko.common.AUTH_SUCCESSFUL
+    assert (server.username, server.target) == ("Gustave", Target(provider_name="do", template="1"))
+    assert server.check_auth_publickey("@srv", paramiko.ECDSAKey.generate()) == paramiko.common.AUTH_FAILED
+    # nobody owns a password.
+    assert server.check_auth_password("@srv", "Fiennes") == paramiko.common.AUTH_FAILED
+    assert server.check_auth_password("Gustave@srv", "Fiennes") == paramiko.common.AUTH_SUCCESSFUL
+    # checks are not auth results, paramiko may still reject the signature.
+    on_authenticated.assert_not_called()
+    assert server.check_channel_request("session", 0) == paramiko.common.OPEN_SUCCEEDED
+    assert server.check_channel_request("session", 1) == paramiko.common.OPEN_SUCCEEDED
+    on_authenticated.assert_called_once_with("Gustave")
+
+    assert server.check_channel_env_request(None, b"LOBBYBOY_TARGET", b"vagrant+")
+    assert server.target == Target(provider_name="vagrant")
+    assert not server.check_channel_env_request(None, b"LANG", b"C")
@@ -0,0 +1,98 @@
+import os
+import pty
+import signal
+import subprocess
+import time
+from unittest import mock
+
+import pytest
+
+from lobbyboy.exceptions import SpawnerException
+from lobbyboy.spawner import Spawner
+
+
+@pytest.fixture
+def spawner():
+    spawner = Spawner()
+    spawner.start()
+    yield spawner
+    if spawner.running:
+        spawner._process.kill()
+        spawner._process.wait()
+
+
+def read_all(master_fd: int) -> bytes:
+    output = b""
+    while True:
+        try:
+            data = os.read(master_fd, 1024)
+        except OSError:
+            # EIO once the process has gone.
+            return output
+        if not data:
+            return output
+        output += data
+
+
+def test_spawn(spawner):
+    master_fd, slave_fd = pty.openpty()
+    process = spawner.spawn("echo hello from $0; exit 3", slave_fd)
+    os.close(slave_fd)
+
+    assert b"hello from" in read_all(master_fd)
+    assert process.wait(5) == 3
+    assert process.poll() == 3
+
+
+def test_wait_timeout(spawner):
+    master_fd, slave_fd = pty.openpty()
+    process = spawner.spawn("sleep 10", slave_fd)
+    os.close(slave_fd)
+
+    with pytest.raises(subprocess.TimeoutExpired):
+        process.wait(0.1)
+    assert process.poll() is None
+    # in a session of its own, like ``setsid``.
+    assert os.getsid(process.pid) == process.pid
+    os.killpg(process.pid, signal.SIGHUP)
+    assert process.wait(5) == -signal.SIGHUP
+
+
+def test_helper_gone(spawner):
+    master_fd, slave_fd = pty.openpty()
+    process = spawner.spawn("sleep 0.3", slave_fd)
+    os.close(slave_fd)
+
+    spawner._process.kill()
+    spawner._process.wait()
+    deadline = time.time() + 5
+    while spawner.running and time.time() < deadline:
+        time.sleep(0.01)
+    assert not spawner.running
+    with pytest.raises(SpawnerException):
+        spawner.spawn("true", master_fd)
+    # exit of the orphan is still noticed.
+    assert process.wait(5) == -1
+
+
+def test_late_spawn_killed(spawner):
+    master_fd, slave_fd = pty.openpty()
+    with mock.patch("os.killpg", wraps=os.killpg) as killpg:
+        with pytest.raises(SpawnerException):
+            spawner.spawn("exec sleep 10", slave_fd, timeout=0)
+        os.close(slave_fd)
+
+        # the requester spawns it by itself after the timeout, the late one must not share the PTY.
+        deadline = time.time() + 5
+        while not killpg.called and time.time() < deadline:
+            time.sleep(0.01)
+    pid = killpg.call_args[0][0]
+    while time.time() < deadline:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.01)
+    else:
+        pytest.fail("the late process is still running.")
+    assert not spawner._processes and not spawner._abandoned
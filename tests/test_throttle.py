@@ -0,0 +1,95 @@
+import json
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from lobbyboy.socket_handle import SocketHandlerThread
+from lobbyboy.throttle import SourceThrottle, load_bans
+
+
+def test_connections_in_sliding_window():
+    throttle = SourceThrottle(max_connections=3, window=60)
+    with mock.patch("time.monotonic", return_value=1000):
+        assert all(throttle.allow("10.0.0.1") for _ in range(3))
+        assert not throttle.allow("10.0.0.1")
+        # other addresses are not affected.
+        assert throttle.allow("10.0.0.2")
+    with mock.patch("time.monotonic", return_value=1060):
+        assert throttle.allow("10.0.0.1")
+    assert throttle.stats.rate_limited == 1
+
+
+def test_ban_after_auth_failures(tmp_path):
+    bans_file = tmp_path / "banned_addresses.json"
+    throttle = SourceThrottle(max_auth_failures=3, ban_time=600, bans_file=bans_file)
+    for _ in range(2):
+        throttle.auth_failed("10.0.0.1")
+    # failures are forgotten once the user gets in, e.g. the agent offered other keys first.
+    throttle.auth_succeeded("10.0.0.1")
+    throttle.auth_failed("10.0.0.1")
+    assert throttle.allow("10.0.0.1")
+
+    for _ in range(2):
+        throttle.auth_failed("10.0.0.1")
+    assert not throttle.allow("10.0.0.1")
+    assert set(throttle.bans) == {"10.0.0.1"}
+    assert load_bans(bans_file)["10.0.0.1"].failures == 3
+
+    # bans are kept across restarts.
+    assert not SourceThrottle(bans_file=bans_file).allow("10.0.0.1")
+
+
+def test_ban_expires(tmp_path):
+    bans_file = tmp_path / "banned_addresses.json"
+    bans_file.write_text(json.dumps({"10.0.0.1": {"until": time.time() - 1, "failures": 3}}))
+    throttle = SourceThrottle(bans_file=bans_file)
+    assert throttle.allow("10.0.0.1")
+    assert throttle.bans == {}
+
+
+def test_bans_shared_between_processes(tmp_path):
+    bans_file = tmp_path / "banned_addresses.json"
+    worker_1 = SourceThrottle(max_auth_failures=1, bans_file=bans_file)
+    worker_2 = SourceThrottle(max_auth_failures=1, bans_file=bans_file)
+    worker_1.auth_failed("10.0.0.1")
+    worker_2.auth_failed("10.0.0.2")
+    assert set(load_bans(bans_file)) == {"10.0.0.1", "10.0.0.2"}
+    with mock.patch("lobbyboy.throttle.BANS_RELOAD_INTERVAL", 0):
+        assert not worker_2.allow("10.0.0.1")
+
+
+def test_bounded_tables():
+    throttle = SourceThrottle(max_connections=1, max_auth_failures=1, max_addresses=2)
+    for i in range(5):
+        assert throttle.allow(f"10.0.0.{i}")
+        throttle.auth_failed(f"10.0.1.{i}")
+    assert len(throttle._connections) == 2
+    assert set(throttle.bans) == {"10.0.1.3", "10.0.1.4"}
+
+
+def test_trusted_addresses():
+    throttle = SourceThrottle(max_connections=1, max_auth_failures=1, trusted_addresses=["10.0.0.0/8"])
+    throttle.auth_failed("10.1.2.3")
+    assert all(throttle.allow("10.1.2.3") for _ in range(3))
+    assert throttle.allow("192.168.0.1")
+    assert not throttle.allow("192.168.0.1")
+
+
+def test_final_auth_result_of_connection():
+    throttle = SourceThrottle(max_auth_failures=3)
+    handler = SimpleNamespace(throttle=throttle, client_address=("10.0.0.1", 22))
+    transport = mock.MagicMock()
+    transport.is_authenticated.return_value = False
+
+    # only asked whether a public key is acceptable, never signed anything.
+    transport.auth_handler.auth_fail_count = 0
+    SocketHandlerThread.account_auth(handler, transport)
+    assert "10.0.0.1" not in throttle._failures
+
+    # a bad signature and a wrong password.
+    transport.auth_handler.auth_fail_count = 2
+    SocketHandlerThread.account_auth(handler, transport)
+    assert throttle.allow("10.0.0.1")
+    SocketHandlerThread.account_auth(handler, transport)
+    assert not throttle.allow("10.0.0.1")
+    assert throttle.bans["10.0.0.1"].failures == 3
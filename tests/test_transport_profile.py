@@ -0,0 +1,32 @@
+import socket
+
+from lobbyboy.config import LBConfigTransport
+from lobbyboy.transport_profile import apply_user_profile, create_transport
+
+
+def test_create_transport():
+    sock, peer = socket.socketpair()
+    profile = LBConfigTransport(
+        window_size=8 * 1024 * 1024, ciphers=["aes256-ctr", "no-such-cipher"], macs=["hmac-sha2-512"], compression=True
+    )
+    t = create_transport(sock, profile, gss_kex=False)
+
+    assert t.default_window_size == 8 * 1024 * 1024
+    options = t.get_security_options()
+    assert options.ciphers == ("aes256-ctr",)
+    assert options.digests == ("hmac-sha2-512",)
+    assert "zlib@openssh.com" in options.compression
+    peer.close()
+    t.close()
+
+
+def test_apply_user_profile():
+    sock, peer = socket.socketpair()
+    t = create_transport(sock, LBConfigTransport(), gss_kex=False)
+    default_window_size = t.default_window_size
+
+    apply_user_profile(t, LBConfigTransport(max_packet_size=64 * 1024))
+    assert t.default_window_size == default_window_size
+    assert t.default_max_packet_size == 64 * 1024
+    peer.close()
+    t.close()
@@ -0,0 +1,194 @@
+import socket
+import threading
+from pathlib import Path
+
+import paramiko
+import pytest
+
+from lobbyboy.config import LBServerMeta
+from lobbyboy.exceptions import UpstreamException
+from lobbyboy.upstream import UpstreamAddress, UpstreamPool
+
+
+class EchoServer(paramiko.ServerInterface):
+    """A provider's server: accepts one key, echoes everything in the shell."""
+
+    def __init__(self, client_key: paramiko.PKey):
+        self.client_key = client_key
+        self.pty_request = None
+        self.window_changes = []
+        self.window_changed = threading.Event()
+
+    def get_allowed_auths(self, username):
+        return "publickey"
+
+    def check_auth_publickey(self, username, key):
+        if username == "root" and key == self.client_key:
+            return paramiko.common.AUTH_SUCCESSFUL
+        return paramiko.common.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.common.OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        self.pty_request = (term, width, height)
+        return True
+
+    def check_channel_shell_request(self, channel):
+        threading.Thread(target=self._echo, args=(channel,), daemon=True).start()
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self._cat, args=(channel,), daemon=True).start()
+        return True
+
+    def check_channel_window_change_request(self, channel, width, height, pixelwidth, pixelheight):
+        self.window_changes.append((width, height))
+        self.window_changed.set()
+        return True
+
+    @staticmethod
+    def _cat(channel):
+        """output the input after EOF, like ``sort``"""
+        received = b""
+        while 1:
+            data = channel.recv(1024)
+            if not data:
+                break
+            received += data
+        channel.sendall(received)
+        channel.sendall_stderr(b"done")
+        channel.send_exit_status(3)
+        channel.close()
+
+    @staticmethod
+    def _echo(channel):
+        while 1:
+            data = channel.recv(1024)
+            if not data:
+                return
+            channel.sendall(data)
+
+
+@pytest.fixture
+def client_key(tmp_path):
+    key = paramiko.RSAKey.generate(1024)
+    key.write_private_key_file(str(tmp_path.joinpath("id_rsa")))
+    return key
+
+
+@pytest.fixture
+def echo_server(client_key):
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(5)
+    server = EchoServer(client_key)
+    server.connections = 0
+
+    def serve():
+        while 1:
+            try:
+                sock, _ = listener.accept()
+            except OSError:
+                return
+            server.connections += 1
+            t = paramiko.Transport(sock)
+            t.add_server_key(paramiko.RSAKey.generate(1024))
+            t.start_server(server=server)
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield server, listener.getsockname()[1]
+    listener.close()
+
+
+@pytest.fixture
+def server_meta(tmp_path):
+    return LBServerMeta(provider_name="fake", server_name="srv", workspace=tmp_path)
+
+
+@pytest.fixture
+def pool():
+    pool = UpstreamPool(idle_timeout=0)
+    yield pool
+    pool.close()
+
+
+def address(port: int, key_path: Path) -> UpstreamAddress:
+    return UpstreamAddress(host="127.0.0.1", port=port, user="root", key_path=key_path)
+
+
+def test_splice_shell(echo_server, pool, server_meta, tmp_path):
+    server, port = echo_server
+    upstream = pool.open_shell(server_meta, address(port, tmp_path.joinpath("id_rsa")), "xterm", 80, 24)
+    assert server.pty_request == (b"xterm", 80, 24)
+
+    upstream.channel.sendall(b"hello lobbyboy")
+    upstream.channel.settimeout(5)
+    assert upstream.channel.recv(1024) == b"hello lobbyboy"
+
+    upstream.resize(120, 40)
+    assert server.window_changed.wait(5)
+    assert server.window_changes == [(120, 40)]
+
+    upstream.close()
+    assert upstream.channel.closed
+
+
+def test_splice_auth_failed(echo_server, pool, server_meta, tmp_path):
+    _, port = echo_server
+    paramiko.RSAKey.generate(1024).write_private_key_file(str(tmp_path.joinpath("other_key")))
+    with pytest.raises(UpstreamException):
+        pool.open_shell(server_meta, address(port, tmp_path.joinpath("other_key")), "xterm", 80, 24)
+
+
+def test_sessions_share_master(echo_server, pool, server_meta, tmp_path):
+    server, port = echo_server
+    first = pool.open_shell(server_meta, address(port, tmp_path.joinpath("id_rsa")), "xterm", 80, 24)
+    second = pool.open_shell(server_meta, address(port, tmp_path.joinpath("id_rsa")), "xterm", 80, 24)
+    assert server.connections == 1
+    assert first.channel.get_transport() is second.channel.get_transport()
+
+    # the master is still used by the second session.
+    first.close()
+    pool.check()
+    assert second.channel.get_transport().is_active()
+
+    second.close()
+    pool.check()
+    assert not second.channel.get_transport().is_active()
+
+
+def test_discard_master(echo_server, pool, server_meta, tmp_path):
+    server, port = echo_server
+    upstream = pool.open_shell(server_meta, address(port, tmp_path.joinpath("id_rsa")), "xterm", 80, 24)
+    pool.discard(server_meta)
+    assert not upstream.channel.get_transport().is_active()
+
+    # a new master is connected for the next session.
+    upstream = pool.open_shell(server_meta, address(port, tmp_path.joinpath("id_rsa")), "xterm", 80, 24)
+    assert server.connections == 2
+    upstream.close()
+    # nothing is kept for servers nobody is connecting to.
+    assert not pool._connect_locks
+
+
+def test_exec(echo_server, pool, server_meta, tmp_path):
+    _, port = echo_server
+    upstream = pool.open_exec(server_meta, address(port, tmp_path.joinpath("id_rsa")), command=b"sort")
+    upstream.channel.sendall(b"hello lobbyboy")
+    upstream.shutdown_write()
+
+    upstream.channel.settimeout(5)
+    assert upstream.channel.recv(1024) == b"hello lobbyboy"
+    assert upstream.channel.recv(1024) == b""
+    assert upstream.read_stderr(1024) == b"done"
+    upstream.close()
+    assert upstream.exit_status == 3
+
+
+def test_master_closed_if_refused(echo_server, pool, server_meta, tmp_path):
+    server, port = echo_server
+    with pytest.raises(UpstreamException):
+        pool.open_exec(server_meta, address(port, tmp_path.joinpath("id_rsa")), subsystem="sftp")
+    # nobody uses the master connected for it.
+    assert not pool._masters
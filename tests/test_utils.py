@@ -1,24 +1,40 @@
 import copy
 import os.path
 import sys
+import threading
 from dataclasses import dataclass
 from datetime import date, datetime
 from decimal import Decimal
+from io import StringIO
 from pathlib import Path
 from unittest import mock
 
+import paramiko
 import pytest
 
-from lobbyboy.exceptions import CantEnsureBytesException, TimeStrParseTypeException
+from lobbyboy.channel_writer import BufferedChannel
+from lobbyboy.exceptions import (
+    CantEnsureBytesException,
+    TimeStrParseTypeException,
+    UserCancelException,
+)
 from lobbyboy.utils import (
+    KeyTypeSupport,
+    SessionCounter,
+    atomic_write,
+    choose_option,
     confirm_dc_type,
     dict_factory,
     encoder_factory,
     ensure_bytes,
+    file_signature,
+    generate_ssh_key_pair,
     humanize_seconds,
     import_class,
     port_is_open,
+    read_user_input_line,
     send_to_channel,
+    take_typed_ahead,
     to_seconds,
 )
 from tests.conftest import test_pair
@@ -217,16 +233,86 @@ def test_confirm_dc_type(test: test_pair):
     assert test.expected == confirm_dc_type(*test.input)
 
 
-def test_choose_option(): ...
+def fake_input_channel(*chunks: bytes) -> mock.MagicMock:
+    channel = mock.MagicMock()
+    channel.recv.side_effect = [*chunks, b""]
+    return channel
+
+
+def test_choose_option():
+    # the first input is invalid, user is asked again.
+    channel = fake_input_channel(b"9\r", b"1\r")
+    assert choose_option(channel, ["a", "b"]) == 1
+    assert channel.sendall.call_args_list[0] == mock.call(bytearray(b"Available options:\r\n  0 - a\r\n  1 - b\r\n"))
+    assert mock.call(bytearray(b"You selected: b\r\n")) in channel.sendall.call_args_list
+
+    assert choose_option(fake_input_channel(b"x\r", b"\r"), ["a", "b"], default=0) == 0
+
+
+test_args_read_user_input_line = [
+    test_pair(input=[b"12\r"], expected=["12"]),
+    # paste burst, "\r\n" split across recv
+    test_pair(input=[b"hello\r", b"\nworld\r"], expected=["hello", "world"]),
+    # typed ahead
+    test_pair(input=[b"1\r2\n"], expected=["1", "2"]),
+    # backspace
+    test_pair(input=[b"13\x7f2\r"], expected=["12"]),
+    # left arrow split across recv, then insert
+    test_pair(input=[b"13\x1b[", b"D2\r"], expected=["123"]),
+    # home, delete, end
+    test_pair(input=[b"x12\x1b[H\x1b[3~\x1b[F3\r"], expected=["123"]),
+    # SS3 arrow keys, up/down and bracketed paste markers are ignored
+    test_pair(input=[b"\x1b[200~2\x1b[201~\x1bOD1\x1b[A\r"], expected=["12"]),
+    # Ctrl-U
+    test_pair(input=[b"abc\x1512\r"], expected=["12"]),
+    # multibyte character split across recv
+    test_pair(input=["é".encode()[:1], "é".encode()[1:] + b"\r"], expected=["é"]),
+]
+
+
+@pytest.mark.parametrize("test", test_args_read_user_input_line)
+def test_read_user_input_line(test: test_pair):
+    # the user's channel of a connection, it keeps what the user has typed ahead.
+    channel = BufferedChannel(fake_input_channel(*test.input))
+    assert [read_user_input_line(channel) for _ in test.expected] == test.expected
+
+
+def test_read_user_input_line_echo():
+    channel = fake_input_channel(b"13\x1b[D2\r")
+    assert read_user_input_line(channel) == "123"
+    # one write for the whole burst
+    channel.sendall.assert_called_once_with(bytearray(b"13\x1b[1D23\x1b[1D\r\n"))
 
 
-def test_read_user_input_line(): ...
+def test_take_typed_ahead():
+    # a script answers the menu and sends its first command in one write.
+    channel = BufferedChannel(fake_input_channel(b"1\r\nuname -a\n"))
+    assert read_user_input_line(channel) == "1"
+    assert take_typed_ahead(channel) == b"uname -a\n"
+    assert take_typed_ahead(channel) == b""
+
+
+@pytest.mark.parametrize("content", [b"\x03", b"\x04", b""])
+def test_read_user_input_line_cancel(content: bytes):
+    with pytest.raises(UserCancelException):
+        read_user_input_line(fake_input_channel(content))
 
 
 def test_confirm_ssh_key_pair(): ...
 
 
-def test_generate_ssh_key_pair(): ...
+@pytest.mark.parametrize(
+    "key_type, key_cls",
+    [
+        (KeyTypeSupport.RSA, paramiko.RSAKey),
+        (KeyTypeSupport.ECDSA, paramiko.ECDSAKey),
+        (KeyTypeSupport.ED25519, paramiko.Ed25519Key),
+    ],
+)
+def test_generate_ssh_key_pair(key_type, key_cls):
+    pri_key, pub_key = generate_ssh_key_pair(key_type)
+    key = key_cls.from_private_key(StringIO(pri_key))
+    assert pub_key == f"{key.get_name()} {key.get_base64()}"
 
 
 def test_write_key_to_file(): ...
@@ -243,3 +329,51 @@ def test_import_class():
     with mock.patch("importlib.import_module") as imp:
         imp.side_effect = mock.MagicMock(return_value=sys.modules[__name__])
         assert import_class(f"FAKE_MODULE::{FakeDataclass.__name__}") is FakeDataclass
+
+
+def test_session_counter():
+    counter = SessionCounter()
+    first = counter.add("srv", pid=1)
+    counter.add("srv", pid=2)
+    counter.add("srv", "third", pid=2)
+    # sessions are known by their id, adding or removing one twice changes nothing.
+    counter.add("srv", "third", pid=2)
+    assert counter.count("srv") == 3
+    assert counter.remove(first, last_activity=1000) == 2
+    assert counter.remove(first) == 0
+    assert counter.count("srv") == 2 and counter.last_activity("srv") == 1000
+
+    # worker 2 died, its sessions are gone with it.
+    counter.forget(2)
+    assert counter.count("srv") == 0
+    assert counter.wait_idle(0) == ["srv"]
+    assert counter.wait_idle(0) == []
+
+
+def test_session_counter_wait_idle():
+    counter = SessionCounter()
+    session_id = counter.add("srv")
+    counter.add("other")
+    threading.Timer(0.05, counter.remove, [session_id]).start()
+    assert counter.wait_idle(5) == ["srv"]
+    assert counter.count("other") == 1
+
+    # whoever removes it checks the server by itself.
+    counter.remove(counter.add("srv"), notify=False)
+    assert counter.wait_idle(0.01) == []
+
+
+def test_atomic_write_and_file_signature(tmp_path):
+    path = tmp_path / "servers.json"
+    assert file_signature(path) is None
+
+    atomic_write(path, "[]")
+    assert path.read_text() == "[]"
+    signature = file_signature(path)
+    assert signature is not None and file_signature(path) == signature
+
+    # the same size, but a new file replaced it.
+    atomic_write(path, "{}")
+    assert path.read_text() == "{}"
+    assert file_signature(path) != signature
+    assert [p.name for p in tmp_path.iterdir()] == ["servers.json"]
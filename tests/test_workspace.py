@@ -0,0 +1,44 @@
+import threading
+
+from freezegun import freeze_time
+
+from lobbyboy.workspace import WorkspaceAllocator
+
+
+@freeze_time("2021-12-05 14:05:00")
+def test_allocate_in_shards(tmp_path):
+    allocator = WorkspaceAllocator(tmp_path)
+    assert allocator.allocate(["srv", "srv-a"]) == ("srv", tmp_path / "2021/12/srv")
+    assert allocator.allocate(["srv", "srv-a"]) == ("srv-a", tmp_path / "2021/12/srv-a")
+    assert allocator.allocate(["srv", "srv-a"]) is None
+    assert (tmp_path / "2021/12/srv-a").is_dir()
+
+    # another process sees the names taken, and where their workspaces are.
+    other = WorkspaceAllocator(tmp_path)
+    assert other.allocate(["srv", "srv-b"]) == ("srv-b", tmp_path / "2021/12/srv-b")
+    assert other.workspace("srv") == tmp_path / "2021/12/srv"
+    assert allocator.allocate(["srv-b", "srv-c"])[0] == "srv-c"
+
+
+def test_allocate_between_threads(tmp_path):
+    allocator = WorkspaceAllocator(tmp_path)
+    names = []
+    candidates = [str(i) for i in range(1, 99)]
+    threads = [threading.Thread(target=lambda: names.append(allocator.allocate(candidates)[0])) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(names, key=int) == candidates[:8]
+
+
+def test_migrate_flat_layout(tmp_path):
+    (tmp_path / "1" / ".vagrant").mkdir(parents=True)
+    (tmp_path / "2021-12-05-1405").mkdir()
+    (tmp_path / ".ssh").mkdir()
+    allocator = WorkspaceAllocator(tmp_path)
+    # workspaces of the flat layout stay where they are.
+    assert allocator.workspace("1") == tmp_path / "1"
+    assert allocator.allocate(["1", "2"])[0] == "2"
+    assert allocator.allocate(["2021-12-05-1405"]) is None
+    assert WorkspaceAllocator(tmp_path).workspace("2021-12-05-1405") == tmp_path / "2021-12-05-1405"